@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 import json
@@ -7,13 +8,18 @@ import datetime
 import logging
 
 from app.services.chat_service import (
-    get_chat_history,
-    save_chat_message,
-    delete_chat,
-    delete_all_chats,
-    process_message as service_process_message
+    aget_chat_history_page,
+    aget_chat_session,
+    aget_chats_page,
+    adelete_chat,
+    adelete_all_chats,
+    asearch_messages,
+    process_message as service_process_message,
+    stream_message
 )
-from app.schemas.chat import ChatMessage, ChatSession
+from app.schemas.chat import ChatMessage, ChatSession, ChatHistoryResponse, ChatSearchResult
+from app.config import settings
+from app.dependencies import require_rag_engine
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
@@ -34,8 +40,14 @@ class MessageRequest(BaseModel):
 class ChatListResponse(BaseModel):
     """Schema per la risposta con la lista delle chat"""
     chats: List[ChatSession]
+    next_before: Optional[str] = None  # Cursore per caricare le chat successive
 
-@router.post("/message", response_model=Dict[str, Any])
+class ChatSearchResponse(BaseModel):
+    """Schema per la risposta della ricerca nei messaggi"""
+    query: str
+    results: List[ChatSearchResult]
+
+@router.post("/message", response_model=Dict[str, Any], dependencies=[Depends(require_rag_engine)])
 async def send_message(message_request: MessageRequest):
     """
     Endpoint per inviare un messaggio al chatbot e ricevere una risposta
@@ -59,38 +71,89 @@ async def send_message(message_request: MessageRequest):
         logger.error(f"Errore nell'elaborazione del messaggio: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nell'elaborazione del messaggio: {str(e)}")
 
-@router.get("/history/{chat_id}", response_model=List[ChatMessage])
-async def get_history(chat_id: str):
+@router.post("/message/stream", dependencies=[Depends(require_rag_engine)])
+async def send_message_stream(message_request: MessageRequest):
+    """
+    Endpoint per inviare un messaggio e ricevere la risposta in streaming
+    come Server-Sent Events (un evento JSON per ogni frammento generato)
     """
-    Recupera la cronologia dei messaggi per una specifica chat
+    message_data = {
+        "chat_id": message_request.chat_id or str(uuid.uuid4()),
+        "message": message_request.message,
+        "timestamp": message_request.timestamp or datetime.datetime.now().isoformat()
+    }
+    
+    async def event_stream():
+        async for payload in stream_message(message_data):
+            yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/history/{chat_id}", response_model=ChatHistoryResponse)
+async def get_history(
+    chat_id: str,
+    limit: int = Query(settings.CHAT_PAGE_SIZE, ge=1, le=settings.CHAT_PAGE_MAX_SIZE),
+    before: Optional[int] = Query(None, ge=0)
+):
+    """
+    Recupera una pagina della cronologia dei messaggi per una specifica chat.
+    Senza cursore restituisce gli ultimi messaggi; passando next_before come
+    before si ottengono i messaggi precedenti.
     """
     try:
-        history = get_chat_history(chat_id)
-        return history
+        messages, next_before = await aget_chat_history_page(chat_id, limit, before)
+        session = await aget_chat_session(chat_id)
+        return ChatHistoryResponse(
+            chat_id=chat_id,
+            title=session.title if session else None,
+            messages=messages,
+            next_before=next_before,
+            has_more=next_before is not None
+        )
     except Exception as e:
         logger.error(f"Errore nel recupero della cronologia chat: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nel recupero della cronologia: {str(e)}")
 
 @router.get("/list", response_model=ChatListResponse)
-async def list_chats():
+async def list_chats(
+    limit: int = Query(settings.CHAT_PAGE_SIZE, ge=1, le=settings.CHAT_PAGE_MAX_SIZE),
+    before: Optional[str] = Query(None)
+):
     """
-    Recupera l'elenco di tutte le chat salvate
+    Recupera una pagina dell'elenco delle chat salvate, dalla più recente
     """
     try:
-        from app.db.chat_repository import get_all_chats
-        chats = get_all_chats()
-        return ChatListResponse(chats=chats)
+        chats, next_before = await aget_chats_page(limit, before)
+        return ChatListResponse(chats=chats, next_before=next_before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Errore nel recupero dell'elenco chat: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nel recupero dell'elenco chat: {str(e)}")
 
+@router.get("/search", response_model=ChatSearchResponse)
+async def search_chats(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=100)):
+    """
+    Cerca un testo nei messaggi di tutte le chat salvate
+    """
+    try:
+        results = await asearch_messages(q, limit)
+        return ChatSearchResponse(query=q, results=results)
+    except Exception as e:
+        logger.error(f"Errore nella ricerca nelle chat: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nella ricerca nelle chat: {str(e)}")
+
 @router.delete("/{chat_id}", response_model=Dict[str, str])
 async def remove_chat(chat_id: str):
     """
     Elimina una specifica chat
     """
     try:
-        delete_chat(chat_id)
+        await adelete_chat(chat_id)
         return {"status": "success", "message": f"Chat {chat_id} eliminata con successo"}
     except Exception as e:
         logger.error(f"Errore nell'eliminazione della chat: {e}")
@@ -102,7 +165,7 @@ async def remove_all_chats():
     Elimina tutte le chat
     """
     try:
-        delete_all_chats()
+        await adelete_all_chats()
         return {"status": "success", "message": "Tutte le chat sono state eliminate con successo"}
     except Exception as e:
         logger.error(f"Errore nell'eliminazione di tutte le chat: {e}")
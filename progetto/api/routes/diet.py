@@ -1,10 +1,15 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
+import json
 import logging
 
+from app.config import settings
 from app.core.diet_generator import generate_diet_plan, analyze_nutritional_query
-from app.schemas.diet import DietRequest, DietResponse
+from app.schemas.diet import DietRequest, DietResponse, DietBatchRequest
+from app.services.diet_service import generate_diet_batch
+from app.dependencies import require_rag_engine
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
@@ -14,6 +19,8 @@ router = APIRouter(
     prefix="/diet",
     tags=["diet"],
     responses={404: {"description": "Non trovato"}},
+    # Tutti gli endpoint usano il motore RAG
+    dependencies=[Depends(require_rag_engine)],
 )
 
 @router.post("/generate", response_model=DietResponse)
@@ -23,12 +30,15 @@ async def create_diet_plan(diet_request: DietRequest):
     """
     try:
         # Genera la dieta personalizzata
-        diet_result = generate_diet_plan(diet_request.user_profile)
+        diet_result = await generate_diet_plan(diet_request.user_profile)
         
         # Restituisci la risposta
         return DietResponse(
             user_profile=diet_request.user_profile,
             diet_plan=diet_result["diet_plan"],
+            plan_id=diet_result.get("plan_id"),
+            plan=diet_result.get("plan"),
+            energy_targets=diet_result.get("energy_targets"),
             sources=diet_result.get("sources", []),
             success=True,
             message="Dieta generata con successo"
@@ -37,6 +47,29 @@ async def create_diet_plan(diet_request: DietRequest):
         logger.error(f"Errore nella generazione della dieta: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nella generazione della dieta: {str(e)}")
 
+@router.post("/generate/batch")
+async def create_diet_plans_batch(batch_request: DietBatchRequest):
+    """
+    Genera i piani dietetici di più profili, restituiti in streaming come
+    NDJSON (una riga JSON per profilo, appena pronta, e una riga finale di
+    riepilogo). Un errore su un profilo non interrompe gli altri
+    """
+    if len(batch_request.profiles) > settings.DIET_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Troppi profili: massimo {settings.DIET_BATCH_MAX_ITEMS} per richiesta"
+        )
+    
+    async def ndjson_stream():
+        async for item in generate_diet_batch(batch_request.profiles):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/analyze", response_model=Dict[str, Any])
 async def analyze_nutrition_query(query: str = Body(..., embed=True)):
     """
@@ -44,7 +77,7 @@ async def analyze_nutrition_query(query: str = Body(..., embed=True)):
     """
     try:
         # Analizza la query nutrizionale
-        analysis_result = analyze_nutritional_query(query)
+        analysis_result = await analyze_nutritional_query(query)
         
         # Restituisci la risposta
         return {
@@ -67,7 +100,7 @@ async def get_recommendations(category: str):
     try:
         # Analizza la query per la categoria
         query = f"Quali sono le raccomandazioni nutrizionali per {category} secondo le linee guida italiane?"
-        analysis_result = analyze_nutritional_query(query)
+        analysis_result = await analyze_nutritional_query(query)
         
         # Restituisci la risposta
         return {
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException
+import logging
+
+from app.core.job_queue import submit_job, describe_job
+from app.db.job_repository import get_job_store
+from app.schemas.diet import DietRequest, DietJobResponse
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Creazione del router. I job sono accodati e consultati senza attendere il
+# motore RAG: i worker li eseguono appena il motore è pronto
+router = APIRouter(
+    prefix="/diet/jobs",
+    tags=["diet"],
+    responses={404: {"description": "Job non trovato"}},
+)
+
+@router.post("", response_model=DietJobResponse, status_code=202)
+async def create_diet_job(diet_request: DietRequest):
+    """
+    Accoda la generazione di una dieta e restituisce subito l'ID del job.
+    Il risultato si legge con GET /api/diet/jobs/{job_id} oppure si riceve
+    tramite WebSocket inviando {"type": "job", "job_id": ...}
+    """
+    try:
+        job = submit_job("diet", {"user_profile": diet_request.user_profile})
+        return DietJobResponse(**describe_job(job))
+    except Exception as e:
+        logger.error(f"Errore nell'accodamento della dieta: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nell'accodamento della dieta: {str(e)}")
+
+@router.get("/{job_id}", response_model=DietJobResponse)
+async def read_diet_job(job_id: str):
+    """
+    Restituisce lo stato di un job (queued, running, done, failed) e,
+    quando è concluso, la dieta generata o l'errore
+    """
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} non trovato")
+    return DietJobResponse(**describe_job(job))
@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Dict, Any
+import logging
+
+from app.core.diet_plan import compute_totals, find_meal, render_diet_plan
+from app.core.nutrient_db import get_nutrient_db, compute_plan_nutrition, fill_plan_calories
+from app.db.diet_plan_repository import get_diet_plan, delete_diet_plan, save_diet_plan
+from app.models.diet import DietPlan
+from app.schemas.diet import DietPlanTotals, MealLookupResponse
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Creazione del router. I piani salvati si consultano senza il motore RAG
+# né chiamate al modello: totali, ricerca dei pasti e testo sono calcolati localmente
+router = APIRouter(
+    prefix="/diet/plans",
+    tags=["diet"],
+    responses={404: {"description": "Piano non trovato"}},
+)
+
+def _load_plan(plan_id: str) -> DietPlan:
+    plan = get_diet_plan(plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail=f"Piano {plan_id} non trovato")
+    return plan
+
+@router.get("/{plan_id}", response_model=DietPlan)
+async def read_diet_plan(plan_id: str):
+    """
+    Restituisce un piano dietetico strutturato
+    """
+    return _load_plan(plan_id)
+
+@router.get("/{plan_id}/totals", response_model=DietPlanTotals)
+async def read_diet_plan_totals(plan_id: str):
+    """
+    Totali calorici per pasto, giornata e settimana
+    """
+    return DietPlanTotals(plan_id=plan_id, **compute_totals(_load_plan(plan_id)))
+
+@router.get("/{plan_id}/meals/{day}/{meal}", response_model=MealLookupResponse)
+async def read_meal(plan_id: str, day: str, meal: str):
+    """
+    Cerca un pasto per giorno (nome o numero) e nome (es. /lunedi/pranzo)
+    """
+    found = find_meal(_load_plan(plan_id), day, meal)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Pasto '{meal}' di '{day}' non trovato")
+    return MealLookupResponse(plan_id=plan_id, day=day, meal=found)
+
+@router.get("/{plan_id}/text", response_model=Dict[str, Any])
+async def read_diet_plan_text(plan_id: str):
+    """
+    Testo del piano in markdown, ricostruito dai dati strutturati
+    """
+    return {"plan_id": plan_id, "diet_plan": render_diet_plan(_load_plan(plan_id))}
+
+@router.get("/{plan_id}/nutrition", response_model=Dict[str, Any])
+async def read_diet_plan_nutrition(plan_id: str):
+    """
+    Energia e macronutrienti del piano calcolati dalla tabella di composizione
+    degli alimenti, con le calorie indicate dal modello che se ne discostano
+    """
+    plan = _load_plan(plan_id)
+    try:
+        return {"plan_id": plan_id, **compute_plan_nutrition(get_nutrient_db(), plan)}
+    except Exception as e:
+        logger.error(f"Errore nel calcolo dei nutrienti del piano: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nel calcolo dei nutrienti: {str(e)}")
+
+@router.post("/{plan_id}/nutrition/fill", response_model=Dict[str, Any])
+async def fill_diet_plan_calories(plan_id: str, overwrite: bool = Query(False)):
+    """
+    Scrive nel piano le calorie calcolate dalla tabella: solo quelle mancanti,
+    oppure (overwrite=true) anche quelle indicate dal modello
+    """
+    plan = _load_plan(plan_id)
+    try:
+        updated = fill_plan_calories(get_nutrient_db(), plan, overwrite=overwrite)
+        save_diet_plan(plan)
+        return {"plan_id": plan_id, "updated_items": updated, **compute_totals(plan)}
+    except Exception as e:
+        logger.error(f"Errore nell'aggiornamento delle calorie del piano: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nell'aggiornamento delle calorie: {str(e)}")
+
+@router.delete("/{plan_id}", response_model=Dict[str, str])
+async def remove_diet_plan(plan_id: str):
+    """
+    Elimina un piano salvato
+    """
+    try:
+        if not delete_diet_plan(plan_id):
+            raise HTTPException(status_code=404, detail=f"Piano {plan_id} non trovato")
+        return {"status": "success", "message": f"Piano {plan_id} eliminato con successo"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Errore nell'eliminazione del piano: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nell'eliminazione del piano: {str(e)}")
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+import logging
+
+from app.core.warmup import get_engine_status, is_ready
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Creazione del router (senza prefisso /api: usato dall'orchestratore)
+router = APIRouter(tags=["health"])
+
+@router.get("/healthz")
+async def healthz():
+    """
+    Liveness: il processo risponde, qualunque sia lo stato del motore RAG
+    """
+    return {"status": "ok", "engine": get_engine_status()["state"]}
+
+@router.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 solo se il motore RAG può rispondere alle query
+    (anche in modo degradato), altrimenti 503
+    """
+    engine = get_engine_status()
+    return JSONResponse(status_code=200 if is_ready() else 503, content=engine)
@@ -0,0 +1,40 @@
+from fastapi import APIRouter
+from typing import Dict, Any
+import logging
+
+from app.core.answer_cache import get_answer_cache
+from app.core.context_builder import get_context_stats
+from app.core.conversation_memory import get_memory_stats
+from app.core.intent_router import get_router_stats
+from app.core.job_queue import get_job_stats
+from app.core.plan_cache import get_plan_cache
+from app.core.rag_engine import get_retrieval_stats
+from app.core.singleflight import get_singleflight_stats
+from app.core.warmup import get_engine_status
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Creazione del router
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+@router.get("", response_model=Dict[str, Any])
+async def get_metrics():
+    """
+    Restituisce i contatori di funzionamento dei componenti interni
+    (cache, code, chiamate al modello)
+    """
+    return {
+        "engine": get_engine_status(),
+        "answer_cache": get_answer_cache().stats(),
+        "plan_cache": get_plan_cache().stats(),
+        "retrieval": get_retrieval_stats(),
+        "context": get_context_stats(),
+        "singleflight": get_singleflight_stats(),
+        "router": get_router_stats(),
+        "memory": get_memory_stats(),
+        "jobs": get_job_stats()
+    }
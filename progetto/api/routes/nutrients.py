@@ -0,0 +1,60 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Dict, Any
+import logging
+
+from app.core.diet_profile import extract_profile_attributes
+from app.core.energy_targets import compute_energy_targets, format_targets_block
+from app.core.nutrient_db import get_nutrient_db, compute_items
+from app.schemas.diet import DietRequest, NutritionRequest
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Creazione del router (tabella di composizione locale, senza chiamate al modello)
+router = APIRouter(
+    prefix="/nutrients",
+    tags=["nutrients"],
+)
+
+@router.get("/search", response_model=Dict[str, Any])
+async def search_foods(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    """
+    Cerca un alimento nella tabella di composizione, con i valori per 100 g
+    """
+    try:
+        return {"query": q, "results": get_nutrient_db().search(q, limit)}
+    except Exception as e:
+        logger.error(f"Errore nella ricerca degli alimenti: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nella ricerca degli alimenti: {str(e)}")
+
+@router.post("/compute", response_model=Dict[str, Any])
+async def compute_nutrition(request: NutritionRequest):
+    """
+    Calcola energia e macronutrienti di una lista di alimenti con quantità
+    (es. "150 g", "2 cucchiai", "1 vasetto")
+    """
+    try:
+        return compute_items(get_nutrient_db(), [item.model_dump() for item in request.items])
+    except Exception as e:
+        logger.error(f"Errore nel calcolo dei nutrienti: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nel calcolo dei nutrienti: {str(e)}")
+
+@router.post("/targets", response_model=Dict[str, Any])
+async def compute_targets(request: DietRequest):
+    """
+    Calcola dal profilo metabolismo basale, dispendio energetico e obiettivi
+    di macro e micronutrienti (LARN), gli stessi inseriti nel prompt delle diete
+    """
+    attributes = extract_profile_attributes(request.user_profile)
+    targets = compute_energy_targets(attributes)
+    if targets is None:
+        raise HTTPException(
+            status_code=422,
+            detail="Per calcolare gli obiettivi servono sesso, età (almeno 18 anni) e peso"
+        )
+    return {
+        "user_profile": request.user_profile,
+        "profile_attributes": attributes,
+        "energy_targets": targets,
+        "prompt_block": format_targets_block(targets)
+    }
@@ -0,0 +1 @@
+# Script di benchmark dell'applicazione
@@ -0,0 +1,108 @@
+"""
+Confronto di latenza tra le modalità di recupero dei documenti.
+
+Esegue le stesse query con recupero solo vettoriale, ibrido (BM25 + vettoriale)
+e ibrido con scorciatoia lessicale, sull'indice già salvato:
+    python -m app.benchmarks.retrieval [--repeat N] [--queries file.txt]
+
+La cache degli embedding viene disattivata, così ogni query vettoriale paga
+la chiamata al modello di embedding come una query mai vista.
+"""
+from typing import Dict, List, Any, Optional
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.core import embedding_cache, rag_engine
+
+# Query tipiche degli utenti: parole chiave su nutrienti e alimenti e domande discorsive
+DEFAULT_QUERIES = [
+    "vitamina D",
+    "ferro",
+    "legumi",
+    "calcio latticini",
+    "fabbisogno proteico",
+    "omega 3 pesce",
+    "quante porzioni di frutta e verdura al giorno?",
+    "cosa mangiare a colazione per avere energia tutta la mattina?",
+    "una dieta vegetariana copre il fabbisogno di vitamina B12?",
+    "quanta acqua bisogna bere se si fa sport?",
+]
+
+# Modalità confrontate: (nome, RETRIEVAL_MODE, scorciatoia lessicale)
+MODES = [
+    ("vector", "vector", False),
+    ("hybrid", "hybrid", False),
+    ("hybrid_fast_path", "hybrid", True),
+]
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    return round(float(np.percentile(values, percentile)), 2) if values else 0.0
+
+
+def run_benchmark(queries: List[str], repeat: int = 3) -> Dict[str, Any]:
+    """
+    Misura la latenza di recupero per ciascuna modalità
+
+    Args:
+        queries: Le query da eseguire
+        repeat: Numero di ripetizioni di ciascuna query
+
+    Returns:
+        Per ogni modalità latenze (ms), chiamate di embedding e recuperi solo lessicali
+    """
+    # Nessuna cache: ogni ripetizione ricalcola l'embedding della query
+    embedding_cache._embedding_cache = embedding_cache.EmbeddingCache(max_entries=0)
+
+    report: Dict[str, Any] = {}
+    for name, mode, fast_path in MODES:
+        settings.RETRIEVAL_MODE = mode
+        settings.LEXICAL_FAST_PATH_ENABLED = fast_path
+
+        before = rag_engine.get_retrieval_stats()
+        latencies = []
+        for _ in range(repeat):
+            for query in queries:
+                started_at = time.perf_counter()
+                rag_engine.query_rag(query)
+                latencies.append((time.perf_counter() - started_at) * 1000)
+        after = rag_engine.get_retrieval_stats()
+
+        report[name] = {
+            "queries": len(latencies),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "mean_ms": round(float(np.mean(latencies)), 2),
+            "embedding_calls": after["embedding_calls"] - before["embedding_calls"],
+            "lexical_only": after["lexical_only"] - before["lexical_only"],
+        }
+
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Punto di ingresso della riga di comando
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks.retrieval", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni di ciascuna query")
+    parser.add_argument("--queries", type=str, default=None, help="File con una query per riga")
+    args = parser.parse_args(argv)
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    rag_engine.initialize_rag_engine()
+    print(json.dumps(run_benchmark(queries, repeat=args.repeat), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Tempo di importazione dei moduli dell'applicazione, misurato con -X importtime.
+
+Importa ogni modulo in un interprete nuovo, più volte, e riporta la mediana
+del tempo cumulativo, i moduli più lenti e i pacchetti pesanti caricati:
+    python -m app.benchmarks.startup [--repeat N] [--budget-ms MS] [--top N]
+
+Termina con codice 1 se un modulo supera il budget o carica un pacchetto che
+non dovrebbe (es. llama_index importando solo l'archivio delle chat), così
+può essere usato come controllo in CI.
+"""
+from typing import Dict, List, Any, Optional, Tuple
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Budget predefinito per l'importazione di app.main, in millisecondi
+DEFAULT_BUDGET_MS = 1500.0
+
+# Moduli misurati e pacchetti che non devono caricare all'importazione
+CHECKS = [
+    ("app.main", ("llama_index", "openai")),
+    ("app.db.chat_repository", ("llama_index", "openai", "numpy")),
+    ("app.config", ("llama_index", "openai", "numpy", "fastapi")),
+]
+
+# Pacchetti pesanti di cui riportare il caricamento
+HEAVY_PACKAGES = ("llama_index", "openai", "httpx", "numpy", "tiktoken", "fastapi", "pydantic")
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    Estrae (modulo, tempo proprio, tempo cumulativo) in microsecondi
+    dall'output di -X importtime
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure_import(module: str, app_root: Path) -> Dict[str, Any]:
+    """
+    Importa un modulo in un interprete nuovo
+
+    Args:
+        module: Il modulo da importare
+        app_root: La directory che contiene il pacchetto app
+
+    Returns:
+        Il tempo cumulativo (ms), i moduli più lenti per tempo proprio e i
+        pacchetti caricati
+    """
+    code = f"import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+    env = dict(os.environ, PYTHONPATH=str(app_root))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, check=True
+    )
+
+    entries = _parse_importtime(result.stderr)
+    cumulative_us = next(cumulative for name, _, cumulative in reversed(entries) if name == module)
+    modules = json.loads(result.stdout.strip().splitlines()[-1])
+    return {
+        "ms": cumulative_us / 1000,
+        "slowest": sorted(entries, key=lambda entry: entry[1], reverse=True),
+        "packages": sorted({name.split(".")[0] for name in modules}),
+    }
+
+
+def run_benchmark(repeat: int = 5, budget_ms: float = DEFAULT_BUDGET_MS, top: int = 10) -> Dict[str, Any]:
+    """
+    Misura l'importazione dei moduli di CHECKS
+
+    Args:
+        repeat: Numero di interpreti per modulo (si riporta la mediana)
+        budget_ms: Budget per l'importazione di app.main
+        top: Numero di moduli più lenti da riportare
+
+    Returns:
+        Per ogni modulo tempi, moduli più lenti, pacchetti pesanti caricati,
+        violazioni e l'esito complessivo ("ok")
+    """
+    import app
+    app_root = Path(app.__file__).parent.parent
+
+    report: Dict[str, Any] = {"budget_ms": budget_ms, "ok": True}
+    for module, forbidden in CHECKS:
+        runs = [measure_import(module, app_root) for _ in range(repeat)]
+        last = runs[-1]
+        violations = [package for package in forbidden if package in last["packages"]]
+        entry = {
+            "median_ms": round(statistics.median(run["ms"] for run in runs), 1),
+            "min_ms": round(min(run["ms"] for run in runs), 1),
+            "heavy_packages": [package for package in HEAVY_PACKAGES if package in last["packages"]],
+            "slowest_self_ms": [(name, round(self_us / 1000, 1)) for name, self_us, _ in last["slowest"][:top]],
+            "forbidden_loaded": violations,
+        }
+        if violations:
+            report["ok"] = False
+        if module == "app.main" and entry["median_ms"] > budget_ms:
+            entry["over_budget"] = True
+            report["ok"] = False
+        report[module] = entry
+
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Punto di ingresso della riga di comando
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks.startup", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Interpreti per modulo")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Budget per importare app.main")
+    parser.add_argument("--top", type=int, default=10, help="Moduli più lenti da riportare")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(repeat=args.repeat, budget_ms=args.budget_ms, top=args.top)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
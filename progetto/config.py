@@ -1,31 +1,166 @@
-import os
-from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
-
-# Carica le variabili d'ambiente dal file .env
-load_dotenv()
+from typing import Optional
 
 class Settings(BaseSettings):
+    # Variabili d'ambiente, anche dal file .env della directory principale o del pacchetto
+    # (letto da pydantic-settings, senza modificare os.environ)
+    model_config = SettingsConfigDict(
+        env_file=(
+            Path(__file__).resolve().parent.parent / ".env",
+            Path(__file__).resolve().parent / ".env",
+        ),
+        extra="ignore",
+    )
+    
     # Cartella di base
     BASE_DIR: Path = Path(__file__).resolve().parent.parent
     
     # OpenAI API
-    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    OPENAI_API_KEY: str = ""
     
     # Modelli
     EMBEDDING_MODEL: str = "text-embedding-3-small"
     CHAT_MODEL: str = "gpt-4"
     
+    # Chiamate al modello
+    LLM_MAX_CONCURRENCY: int = 8  # Chiamate concorrenti massime verso OpenAI per worker
+    LLM_HTTP_MAX_CONNECTIONS: int = 20  # Dimensione del pool di connessioni HTTP
+    LLM_REQUEST_TIMEOUT: float = 120.0  # Timeout in secondi di una singola richiesta
+    
+    # Server di produzione (python run.py --production, gunicorn con worker uvicorn)
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 1  # Con più worker serve CHAT_BACKEND=sqlite
+    SERVER_PRELOAD_INDEX: bool = True  # Carica l'indice nel processo master, condiviso copy-on-write dai worker
+    SERVER_KEEPALIVE: int = 5  # Secondi di attesa di una nuova richiesta su una connessione keep-alive
+    SERVER_BACKLOG: int = 2048  # Connessioni in coda prima dell'accept
+    SERVER_GRACEFUL_TIMEOUT: int = 60  # Secondi concessi alle richieste e chiamate al modello in corso allo spegnimento
+    SERVER_TIMEOUT: int = 180  # Secondi senza segnali di vita prima del riavvio di un worker
+    
+    # Caricamento del motore RAG in background all'avvio
+    WARMUP_MAX_ATTEMPTS: int = 3  # Tentativi di inizializzazione prima dello stato "failed"
+    WARMUP_RETRY_DELAY_SECONDS: float = 5.0  # Attesa prima del secondo tentativo (poi raddoppia)
+    WARMUP_REQUEST_TIMEOUT: float = 10.0  # Attesa massima di una richiesta durante il caricamento (0 = 503 immediato)
+    
     # Paths dei documenti
     DOCUMENTS_DIR: Path = Path(__file__).resolve().parent / "static" / "documents"
     
     # Vectorstore
     VECTORSTORE_PATH: Path = Path(__file__).resolve().parent / "db" / "vectorstore"
     
+    # Archivio delle chat: "log" (append-only su file) oppure "sqlite" (WAL + ricerca full-text)
+    CHAT_BACKEND: str = "log"
+    CHAT_SQLITE_PATH: Path = Path(__file__).resolve().parent / "db" / "data" / "chats.db"
+    
+    # Paginazione di cronologia ed elenco chat
+    CHAT_PAGE_SIZE: int = 50
+    CHAT_PAGE_MAX_SIZE: int = 200
+    
+    # Log append-only delle chat
+    CHAT_LOG_COMPACTION_RATIO: float = 0.5  # Quota di byte non validi oltre cui compattare il log
+    CHAT_LOG_COMPACTION_MIN_BYTES: int = 1024 * 1024  # Spazio sprecato minimo prima di compattare
+    
     # Configurazioni di RAG
     TOP_K_RESULTS: int = 5  # Numero di documenti più rilevanti da recuperare
+    CHUNK_SIZE: int = 1024  # Dimensione dei chunk in token
+    CHUNK_OVERLAP: int = 20  # Sovrapposizione tra chunk consecutivi
+    
+    # Recupero: "hybrid" (BM25 + vettoriale con reciprocal rank fusion), "vector" o "lexical"
+    RETRIEVAL_MODE: str = "hybrid"
+    HYBRID_CANDIDATES: int = 20  # Candidati per classifica prima della fusione
+    RRF_K: int = 60
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    # Con parole chiave molto affidabili si usa solo l'indice lessicale, senza calcolare l'embedding
+    LEXICAL_FAST_PATH_ENABLED: bool = True
+    LEXICAL_FAST_PATH_MIN_CONFIDENCE: float = 0.8
+    
+    # Costruzione del contesto: selezione MMR dei chunk, rimozione dei duplicati e budget di token
+    CONTEXT_BUILDER_ENABLED: bool = True
+    CONTEXT_CANDIDATES: int = 10  # Candidati tra cui scegliere i TOP_K_RESULTS chunk del contesto
+    CONTEXT_MMR_DIVERSITY: float = 0.3  # Peso della diversità rispetto alla rilevanza (0 = solo rilevanza)
+    CONTEXT_DUPLICATE_THRESHOLD: float = 0.95  # Similarità oltre cui un chunk è un quasi duplicato
+    CONTEXT_TOKEN_BUDGET_QA: int = 1500  # Token di contesto per le domande nutrizionali
+    CONTEXT_TOKEN_BUDGET_DIET: int = 3000  # Token di contesto per la generazione delle diete
+    CONTEXT_TOKEN_BUDGET_DIET_TARGETS: int = 800  # Token di contesto per le diete con obiettivi calcolati
+    
+    # Vectorstore: "memmap" (embedding float32 in memoria mappata) o "simple" (JSON di llama_index)
+    VECTOR_STORE_BACKEND: str = "memmap"
+    
+    # Ricerca approssimata (IVF) nel vectorstore memmap, per corpora grandi
+    ANN_ENABLED: bool = True
+    ANN_MIN_VECTORS: int = 50000  # Sotto questa soglia la ricerca esatta è già veloce
+    ANN_NLIST: Optional[int] = None  # Numero di liste IVF (default: radice del numero di vettori)
+    ANN_NPROBE: int = 16  # Liste esplorate per query: più alto = recall maggiore, latenza maggiore
+    
+    # Ingestion offline (python -m app.ingest)
+    INGEST_WORKERS: Optional[int] = None  # Processi per la lettura dei documenti (default: numero di CPU)
+    INGEST_EMBED_BATCH_SIZE: int = 128  # Testi per richiesta di embedding
+    INGEST_EMBED_CONCURRENCY: int = 4  # Richieste di embedding in parallelo
+    
+    # Cache degli embedding delle query
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 5000
+    EMBEDDING_CACHE_DISK_PATH: Optional[Path] = None  # Es. app/db/data/embedding_cache.db
     
+    # Cache delle risposte alle domande nutrizionali
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL_SECONDS: float = 24 * 3600
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95  # Similarità coseno minima per le query quasi identiche
+    ANSWER_CACHE_DISK_PATH: Optional[Path] = None  # Es. app/db/data/answer_cache.db per il livello su disco
+
+    # Cache dei piani dietetici per impronta del profilo (età, sesso, peso, attività, obiettivo, restrizioni)
+    DIET_PLAN_CACHE_ENABLED: bool = True
+    DIET_PLAN_CACHE_MAX_ENTRIES: int = 500
+    DIET_PLAN_CACHE_TTL_SECONDS: float = 7 * 24 * 3600
+    DIET_PLAN_CACHE_DISK_PATH: Optional[Path] = None  # Es. app/db/data/plan_cache.db
+
+    # Tabella di composizione degli alimenti (CSV esportato dalle tabelle CREA)
+    NUTRIENT_DB_PATH: Optional[Path] = None  # Senza file si usa il campione incluso nel progetto
+    NUTRIENT_SAMPLE_PATH: Path = Path(__file__).resolve().parent / "static" / "data" / "alimenti_crea_esempio.csv"
+    NUTRIENT_MATCH_THRESHOLD: float = 0.6  # Punteggio minimo della ricerca approssimata dei nomi
+    NUTRIENT_VERIFY_TOLERANCE: float = 0.25  # Scarto oltre cui le calorie del modello sono segnalate
+    NUTRIENT_FILL_PLANS: bool = True  # Completa con la tabella le calorie mancanti dei piani generati
+
+    # Obiettivi nutrizionali calcolati localmente (LARN) e inseriti nel prompt delle diete
+    ENERGY_TARGETS_ENABLED: bool = True
+
+    # Instradamento dei messaggi della chat: parole chiave, poi similarità con frasi prototipo
+    ROUTER_EMBEDDING_ENABLED: bool = True  # Secondo livello per i messaggi ambigui (un embedding, riusato dal recupero)
+    ROUTER_MIN_SIMILARITY: float = 0.3  # Sotto questa similarità si usa il percorso predefinito (domanda)
+    ROUTER_QA_MODEL: Optional[str] = None  # Modello per le domande (default: CHAT_MODEL)
+    ROUTER_QA_MAX_TOKENS: int = 700
+    ROUTER_DIET_MODEL: Optional[str] = None  # Modello per le diete (default: CHAT_MODEL)
+    ROUTER_DIET_MAX_TOKENS: int = 4000
+    ROUTER_RETRIEVAL_TOKEN_BUDGET: int = 800  # Token di estratti restituiti senza chiamare il modello
+
+    # Memoria delle conversazioni: ultimi messaggi testuali più un riassunto incrementale salvato con la chat
+    MEMORY_ENABLED: bool = True
+    MEMORY_RECENT_MESSAGES: int = 4  # Messaggi più recenti inviati al modello così come sono
+    MEMORY_SUMMARY_BATCH: int = 2  # Messaggi usciti dalla finestra da accumulare prima di aggiornare il riassunto
+    MEMORY_MESSAGE_MAX_CHARS: int = 800  # Lunghezza massima di un messaggio in memoria (es. diete lunghe)
+    MEMORY_SUMMARY_MAX_TOKENS: int = 300
+    MEMORY_SUMMARY_MODEL: Optional[str] = None  # Modello per i riassunti (default: CHAT_MODEL)
+    MEMORY_FOLLOWUP_MAX_WORDS: int = 8  # Le domande più brevi sono completate con la richiesta precedente nel recupero
+
+    # Generazione di diete a lotti (POST /api/diet/generate/batch)
+    DIET_BATCH_CONCURRENCY: int = 4  # Diete generate in parallelo per richiesta (entro LLM_MAX_CONCURRENCY)
+    DIET_BATCH_MAX_ITEMS: int = 100  # Profili massimi per richiesta
+
+    # Coda persistente dei job di generazione (POST /api/diet/jobs)
+    JOBS_DB_PATH: Path = Path(__file__).resolve().parent / "db" / "data" / "jobs.db"
+    JOBS_WORKERS: int = 2  # Job eseguiti in parallelo per processo (0 = il processo accoda soltanto)
+    JOBS_LEASE_SECONDS: float = 60.0  # Senza rinnovo entro questo tempo un job in esecuzione torna in coda
+    JOBS_MAX_ATTEMPTS: int = 3  # Tentativi massimi per un job interrotto prima di segnarlo come fallito
+    JOBS_POLL_INTERVAL: float = 1.0  # Secondi tra due controlli della coda (job accodati da altri processi)
+    JOBS_RETENTION_SECONDS: float = 7 * 24 * 3600  # I job conclusi più vecchi vengono eliminati all'avvio
+
+    # Accorpamento delle richieste identiche in corso (una sola chiamata al modello)
+    SINGLEFLIGHT_ENABLED: bool = True
+    SINGLEFLIGHT_QUERY_TIMEOUT: float = 90.0  # Attesa massima per una domanda, in secondi
+    SINGLEFLIGHT_DIET_TIMEOUT: float = 240.0  # Attesa massima per una dieta, in secondi
+
     # Prompt templates per la generazione di diete
     DIET_SYSTEM_PROMPT: str = """
     Sei un nutrizionista esperto italiano specializzato nella creazione di diete personalizzate.
@@ -56,12 +191,21 @@ class Settings(BaseSettings):
     Formatta la risposta in modo chiaro e leggibile, usando elenchi puntati quando appropriato.
     """
     
+    # Piani dietetici strutturati (modelli di app.models.diet)
+    DIET_STRUCTURED_OUTPUT: bool = True
+    DIET_JSON_MODE: bool = True  # response_format JSON; se il modello non lo supporta si usa solo il prompt
+    DIET_PLAN_DB_PATH: Path = Path(__file__).resolve().parent / "db" / "data" / "diet_plans.db"
+
+    DIET_JSON_PROMPT: str = """
+    Restituisci il piano esclusivamente come oggetto JSON, senza testo prima o dopo, con questa struttura:
+    {"title": "...", "daily_plans": [{"day": "Lunedì", "meals": [{"name": "Colazione", "items": [{"name": "Yogurt greco", "quantity": "150 g", "calories": 130}], "total_calories": 350, "notes": "..."}], "total_calories": 1800, "notes": "..."}], "nutritional_principles": "...", "general_recommendations": "..."}
+    Includi tutti i giorni della settimana e tutti i pasti richiesti. Le calorie sono numeri interi in kcal.
+    Le fonti scientifiche vanno citate in "nutritional_principles".
+    """
+    
     # Chiave per il widget Eleven Labs
     ELEVENLABS_AGENT_ID: str = "81R2UL4OJFryMGXHQIth"
 
-# Istanzia le impostazioni
+# Istanzia le impostazioni. Le directory di documenti e vectorstore vengono
+# create da chi le usa (motore RAG, ingestion, run.py), non all'importazione
 settings = Settings()
-
-# Assicurati che le directory necessarie esistano
-os.makedirs(settings.DOCUMENTS_DIR, exist_ok=True)
-os.makedirs(settings.VECTORSTORE_PATH, exist_ok=True)
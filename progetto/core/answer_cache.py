@@ -0,0 +1,378 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizza una query per il confronto esatto: minuscole, senza accenti,
+    punteggiatura e spazi superflui
+
+    Args:
+        query: Il testo della query
+
+    Returns:
+        La query normalizzata
+    """
+    text = unicodedata.normalize("NFKD", query.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def generation_variant(model: Optional[str], max_tokens: int) -> str:
+    """
+    Identifica modello e token massimi con cui è stata generata una risposta:
+    le cache servono solo risposte generate con le stesse impostazioni
+
+    Args:
+        model: Il modello usato (None per CHAT_MODEL)
+        max_tokens: Numero massimo di token generati
+
+    Returns:
+        La variante, da passare alle cache delle risposte e dei piani
+    """
+    return f"{model or settings.CHAT_MODEL}:{max_tokens}"
+
+
+class AnswerCache:
+    """
+    Cache a due livelli per le risposte del modello.
+
+    Il primo livello confronta la query normalizzata in modo esatto, il secondo
+    cerca una query quasi identica tramite la similarità coseno degli embedding.
+    Le voci sono legate alla versione dell'indice, quindi una reindicizzazione
+    le invalida, e alla variante di generazione (modello e token massimi).
+
+    Le voci in memoria sono gestite con politica LRU e scadenza (TTL);
+    opzionalmente vengono salvate anche su disco (SQLite) e ricaricate all'avvio.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: float = 86400,
+        similarity_threshold: float = 0.95,
+        disk_path: Optional[Path] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.disk_path = Path(disk_path) if disk_path else None
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        # Matrice degli embedding (normalizzati) ricostruita solo quando le voci cambiano
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._matrix_dirty = True
+
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+        self._disk: Optional[sqlite3.Connection] = None
+        if self.disk_path is not None:
+            self._open_disk()
+
+    # ------------------------------------------------------------------
+    # Livello su disco
+    # ------------------------------------------------------------------
+
+    def _open_disk(self) -> None:
+        os.makedirs(self.disk_path.parent, exist_ok=True)
+        self._disk = sqlite3.connect(str(self.disk_path), check_same_thread=False, isolation_level=None)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                index_version TEXT NOT NULL,
+                variant TEXT NOT NULL DEFAULT '',
+                answer TEXT NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._disk.execute("PRAGMA table_info(answers)")}
+        if "variant" not in columns:
+            # Archivio precedente alle varianti: le sue voci non corrispondono più ad alcuna chiave
+            self._disk.execute("ALTER TABLE answers ADD COLUMN variant TEXT NOT NULL DEFAULT ''")
+        self._disk.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+        # Riscalda la memoria con le voci più recenti, così anche il confronto
+        # semantico funziona subito dopo un riavvio
+        rows = self._disk.execute(
+            "SELECT key, index_version, variant, answer, embedding, created_at FROM answers ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, index_version, variant, answer, embedding, created_at in reversed(rows):
+            self._entries[key] = self._make_entry(index_version, variant, json.loads(answer), _from_blob(embedding), created_at)
+        logger.info(f"Cache delle risposte: caricate {len(rows)} voci da {self.disk_path}")
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._disk is None:
+            return None
+        row = self._disk.execute(
+            "SELECT index_version, variant, answer, embedding, created_at FROM answers WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        index_version, variant, answer, embedding, created_at = row
+        return self._make_entry(index_version, variant, json.loads(answer), _from_blob(embedding), created_at)
+
+    def _disk_put(self, key: str, entry: Dict[str, Any]) -> None:
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO answers (key, index_version, variant, answer, embedding, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, entry["index_version"], entry["variant"], json.dumps(entry["answer"], ensure_ascii=False),
+                 _to_blob(entry["embedding"]), entry["created_at"])
+            )
+        except sqlite3.Error as e:
+            # Un errore del livello su disco non deve far fallire la richiesta
+            logger.error(f"Errore nel salvataggio su disco della cache delle risposte: {e}")
+
+    # ------------------------------------------------------------------
+    # Gestione delle voci
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _make_key(query: str, index_version: str, variant: str) -> str:
+        return f"{index_version}:{variant}:{normalize_query(query)}"
+
+    @staticmethod
+    def _make_entry(
+        index_version: str,
+        variant: str,
+        answer: Dict[str, Any],
+        embedding: Optional[np.ndarray],
+        created_at: float
+    ) -> Dict[str, Any]:
+        return {
+            "index_version": index_version,
+            "variant": variant,
+            "answer": answer,
+            "embedding": embedding,
+            "created_at": created_at,
+        }
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] > self.ttl_seconds
+
+    def _insert(self, key: str, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._matrix_dirty = True
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._matrix_dirty = True
+
+    def get_exact(self, query: str, index_version: str, variant: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Cerca una risposta per la stessa query normalizzata. Conta solo gli hit:
+        il miss di una ricerca si registra una volta sola con record_miss
+
+        Args:
+            query: La query dell'utente
+            index_version: La versione corrente dell'indice
+            variant: La variante di generazione (vedi generation_variant)
+
+        Returns:
+            La risposta salvata, oppure None
+        """
+        key = self._make_key(query, index_version, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._disk_get(key)
+                if entry is not None and not self._is_expired(entry):
+                    self._insert(key, entry)
+                    self._stats["disk_hits"] += 1
+                    self._stats["exact_hits"] += 1
+                    return entry["answer"]
+                return None
+
+            if self._is_expired(entry):
+                self._remove(key)
+                self._stats["expirations"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            return entry["answer"]
+
+    def get_similar(self, embedding: List[float], index_version: str, variant: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Cerca una risposta per una query quasi identica, confrontando gli embedding.
+        Conta solo gli hit (vedi record_miss)
+
+        Args:
+            embedding: L'embedding della query dell'utente
+            index_version: La versione corrente dell'indice
+            variant: La variante di generazione (vedi generation_variant)
+
+        Returns:
+            La risposta salvata con similarità sopra la soglia, oppure None
+        """
+        query_vector = _normalize(np.asarray(embedding, dtype=np.float32))
+
+        with self._lock:
+            matrix, keys = self._get_matrix()
+            if matrix is None:
+                return None
+
+            # Similarità coseno con tutte le voci in un'unica operazione
+            scores = matrix @ query_vector
+            for position in np.argsort(-scores):
+                if scores[position] < self.similarity_threshold:
+                    break
+                key = keys[position]
+                entry = self._entries.get(key)
+                if entry is None or entry["index_version"] != index_version or entry["variant"] != variant:
+                    continue
+                if self._is_expired(entry):
+                    self._remove(key)
+                    self._stats["expirations"] += 1
+                    continue
+
+                self._entries.move_to_end(key)
+                self._stats["semantic_hits"] += 1
+                return entry["answer"]
+
+            return None
+
+    def record_miss(self) -> None:
+        """
+        Conta una ricerca conclusa senza risposta (esatta e semantica, o
+        esatta soltanto quando il confronto semantico viene saltato)
+        """
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def _get_matrix(self) -> Tuple[Optional[np.ndarray], List[str]]:
+        """
+        Restituisce la matrice degli embedding in memoria, ricostruendola se necessario
+        """
+        if self._matrix_dirty:
+            keys = [key for key, entry in self._entries.items() if entry["embedding"] is not None]
+            if keys:
+                self._matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+            else:
+                self._matrix = None
+            self._matrix_keys = keys
+            self._matrix_dirty = False
+        return self._matrix, self._matrix_keys
+
+    def put(
+        self,
+        query: str,
+        index_version: str,
+        answer: Dict[str, Any],
+        embedding: Optional[List[float]] = None,
+        variant: str = ""
+    ) -> None:
+        """
+        Salva una risposta nella cache
+
+        Args:
+            query: La query dell'utente
+            index_version: La versione dell'indice usata per la risposta
+            answer: La risposta da salvare (deve essere serializzabile in JSON)
+            embedding: L'embedding della query (opzionale, abilita il confronto semantico)
+            variant: La variante di generazione (vedi generation_variant)
+        """
+        vector = _normalize(np.asarray(embedding, dtype=np.float32)) if embedding is not None else None
+        key = self._make_key(query, index_version, variant)
+        entry = self._make_entry(index_version, variant, answer, vector, time.time())
+
+        with self._lock:
+            self._insert(key, entry)
+            self._disk_put(key, entry)
+
+    def clear(self) -> None:
+        """
+        Svuota la cache in memoria e su disco
+        """
+        with self._lock:
+            self._entries.clear()
+            self._matrix_dirty = True
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM answers")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Restituisce i contatori di hit/miss e l'occupazione della cache
+        """
+        with self._lock:
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _to_blob(vector: Optional[np.ndarray]) -> Optional[bytes]:
+    return vector.astype(np.float32).tobytes() if vector is not None else None
+
+
+def _from_blob(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    return np.frombuffer(blob, dtype=np.float32) if blob is not None else None
+
+
+# Istanza condivisa della cache (creata al primo utilizzo)
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Restituisce la cache delle risposte configurata nelle impostazioni
+
+    Returns:
+        L'istanza condivisa di AnswerCache
+    """
+    global _answer_cache
+
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+            similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            disk_path=settings.ANSWER_CACHE_DISK_PATH
+        )
+
+    return _answer_cache
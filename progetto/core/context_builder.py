@@ -0,0 +1,232 @@
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Sequence
+import hashlib
+import logging
+import re
+import threading
+
+import numpy as np
+
+from app.config import settings
+from app.core.lexical_index import normalize_text
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import NodeWithScore
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Fine frase: punteggiatura seguita da spazio, oppure una riga vuota
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?;])\s+|\n\s*\n")
+
+# Statistiche del contesto inviato al modello
+_context_stats = {
+    "requests": 0, "candidate_tokens": 0, "context_tokens": 0, "tokens_saved": 0, "duplicates_removed": 0
+}
+_stats_lock = threading.Lock()
+
+_tokenizer = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Conta i token di un testo con lo stesso tokenizer usato per i chunk
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        from llama_index.core.utils import get_tokenizer
+        _tokenizer = get_tokenizer()
+    return len(_tokenizer(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Divide un testo in frasi, scartando i frammenti vuoti
+    """
+    return [sentence.strip() for sentence in _SENTENCE_PATTERN.split(text) if sentence and sentence.strip()]
+
+
+def _sentence_key(sentence: str) -> str:
+    # Le frasi ripetute nelle sovrapposizioni tra chunk differiscono al più per spazi e maiuscole
+    return hashlib.sha1(" ".join(normalize_text(sentence).split()).encode("utf-8")).hexdigest()
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def mmr_select(
+    relevance: np.ndarray,
+    embeddings: np.ndarray,
+    k: int,
+    diversity: float = 0.3,
+    duplicate_threshold: float = 0.95
+) -> Dict[str, List[int]]:
+    """
+    Seleziona i chunk con la maximal marginal relevance: a ogni passo sceglie
+    il candidato che massimizza (1 - diversity) * rilevanza - diversity * la
+    massima similarità con i chunk già scelti
+
+    Args:
+        relevance: La rilevanza di ciascun candidato rispetto alla query
+        embeddings: Gli embedding normalizzati dei candidati, uno per riga
+        k: Numero massimo di chunk da selezionare
+        diversity: Peso della diversità (0 = solo rilevanza)
+        duplicate_threshold: Similarità oltre cui un candidato è un quasi duplicato
+
+    Returns:
+        Un dizionario con gli indici selezionati ("selected", in ordine di
+        selezione) e quelli scartati come quasi duplicati ("duplicates")
+    """
+    similarities = embeddings @ embeddings.T
+    remaining = list(range(len(relevance)))
+    selected: List[int] = []
+    duplicates: List[int] = []
+
+    while remaining and len(selected) < k:
+        if selected:
+            redundancy = similarities[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = (1 - diversity) * relevance[remaining] - diversity * redundancy
+        best = remaining.pop(int(np.argmax(scores)))
+
+        if selected and similarities[best, selected].max() >= duplicate_threshold:
+            duplicates.append(best)
+            continue
+        selected.append(best)
+
+    return {"selected": selected, "duplicates": duplicates}
+
+
+def _relevance(
+    nodes: Sequence["NodeWithScore"],
+    embeddings: np.ndarray,
+    query_embedding: Optional[List[float]]
+) -> np.ndarray:
+    """
+    Rilevanza dei candidati: similarità coseno con la query se l'embedding è
+    disponibile, altrimenti una rilevanza decrescente con la posizione in classifica
+    """
+    if query_embedding is not None:
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+        return embeddings @ query_vector
+    # Recupero solo lessicale: la classifica BM25 è l'unica misura di rilevanza
+    return 1.0 - np.arange(len(nodes), dtype=np.float32) / max(len(nodes), 1)
+
+
+def pack_sentences(texts: List[str], token_budget: int) -> Dict[str, Any]:
+    """
+    Inserisce nel budget di token le frasi dei chunk, nell'ordine dei chunk,
+    saltando le frasi già presenti in un chunk precedente
+
+    Args:
+        texts: I testi dei chunk selezionati, dal più rilevante
+        token_budget: Numero massimo di token del contesto
+
+    Returns:
+        Un dizionario con i passaggi (uno per chunk, frasi nell'ordine originale,
+        vuoto se nessuna frase del chunk è entrata), i token usati e le frasi
+        duplicate scartate
+    """
+    seen = set()
+    passages: List[str] = []
+    used = 0
+    duplicates = 0
+    separator_tokens = 1
+
+    for text in texts:
+        kept = []
+        for sentence in split_sentences(text):
+            key = _sentence_key(sentence)
+            if key in seen:
+                duplicates += 1
+                continue
+            tokens = count_tokens(sentence) + separator_tokens
+            # Una frase che non entra viene saltata: una più breve può ancora entrare
+            if used + tokens > token_budget:
+                continue
+            seen.add(key)
+            kept.append(sentence)
+            used += tokens
+        passages.append(" ".join(kept))
+
+    return {"passages": passages, "tokens": used, "duplicates": duplicates}
+
+
+def build_context(
+    nodes: List["NodeWithScore"],
+    query_embedding: Optional[List[float]] = None,
+    top_k: int = settings.TOP_K_RESULTS,
+    token_budget: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Costruisce il contesto per il modello a partire dai candidati recuperati:
+    selezione MMR dei chunk, rimozione dei quasi duplicati e inserimento
+    delle frasi nel budget di token
+
+    Args:
+        nodes: I candidati recuperati, dal più rilevante (con embedding)
+        query_embedding: L'embedding della query, se calcolato
+        top_k: Numero massimo di chunk nel contesto
+        token_budget: Budget di token del contesto (default: CONTEXT_TOKEN_BUDGET_QA)
+
+    Returns:
+        Un dizionario con il contesto, i nodi usati e le statistiche sui token
+    """
+    token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET_QA
+    # Riferimento: il contesto che si otterrebbe unendo i primi top_k chunk
+    candidate_tokens = sum(count_tokens(node.node.text) for node in nodes[:top_k])
+
+    if nodes and all(node.node.embedding is not None for node in nodes):
+        embeddings = _unit_rows(np.array([node.node.embedding for node in nodes], dtype=np.float32))
+        selection = mmr_select(
+            _relevance(nodes, embeddings, query_embedding),
+            embeddings,
+            top_k,
+            diversity=settings.CONTEXT_MMR_DIVERSITY,
+            duplicate_threshold=settings.CONTEXT_DUPLICATE_THRESHOLD
+        )
+        selected = [nodes[i] for i in selection["selected"]]
+        duplicate_chunks = len(selection["duplicates"])
+    else:
+        selected = nodes[:top_k]
+        duplicate_chunks = 0
+
+    packed = pack_sentences([node.node.text for node in selected], token_budget)
+    # Le fonti sono solo i chunk di cui almeno una frase è entrata nel contesto
+    used_nodes = [node for node, passage in zip(selected, packed["passages"]) if passage]
+
+    stats = {
+        "candidate_tokens": candidate_tokens,
+        "context_tokens": packed["tokens"],
+        "tokens_saved": max(candidate_tokens - packed["tokens"], 0),
+        "chunks_considered": len(nodes),
+        "chunks_used": len(used_nodes),
+        "duplicates_removed": duplicate_chunks + packed["duplicates"],
+    }
+    with _stats_lock:
+        _context_stats["requests"] += 1
+        _context_stats["candidate_tokens"] += stats["candidate_tokens"]
+        _context_stats["context_tokens"] += stats["context_tokens"]
+        _context_stats["tokens_saved"] += stats["tokens_saved"]
+        _context_stats["duplicates_removed"] += stats["duplicates_removed"]
+    logger.debug(f"Contesto: {stats}")
+
+    context = "\n\n".join(passage for passage in packed["passages"] if passage)
+    return {"context": context, "nodes": used_nodes, "stats": stats}
+
+
+def get_context_stats() -> Dict[str, Any]:
+    """
+    Restituisce le statistiche cumulative del contesto inviato al modello
+
+    Returns:
+        Un dizionario con richieste, token prima e dopo la costruzione del
+        contesto, token risparmiati (totali e medi) e duplicati rimossi
+    """
+    with _stats_lock:
+        stats = dict(_context_stats)
+    stats["avg_tokens_saved"] = round(stats["tokens_saved"] / stats["requests"], 1) if stats["requests"] else 0.0
+    return stats
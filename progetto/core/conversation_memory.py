@@ -0,0 +1,237 @@
+from typing import Dict, Any, List, Optional, Set
+import asyncio
+import logging
+import weakref
+
+from app.config import settings
+from app.core.llm_manager import agenerate_chat_completion
+from app.db.chat_repository import aget_chat_session, aget_chat_history_page, aget_chat_summary, asave_chat_summary
+from app.schemas.chat import ChatMessage
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = """
+Aggiorni il riassunto di una conversazione tra un utente e un nutrizionista.
+Conserva i dati del profilo dell'utente (età, sesso, peso, altezza, attività, obiettivi,
+restrizioni, allergie, patologie), le sue richieste e le indicazioni o diete già fornite.
+Scrivi al massimo 150 parole, in italiano, senza introduzioni: solo il riassunto aggiornato.
+"""
+
+# Messaggi riassunti al massimo in una singola chiamata (chat lunghe create prima della memoria)
+_MAX_MESSAGES_PER_UPDATE = 20
+
+# Un lock per chat, così lo stesso riassunto non viene aggiornato due volte in parallelo
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+# Aggiornamenti in background in corso (riferimenti mantenuti fino al termine)
+_pending: Set[asyncio.Task] = set()
+
+_memory_stats = {"loads": 0, "updates": 0, "messages_summarized": 0, "summary_tokens": 0, "errors": 0}
+
+
+def _truncate(text: str) -> str:
+    limit = settings.MEMORY_MESSAGE_MAX_CHARS
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def _format_messages(messages: List[ChatMessage]) -> str:
+    return "\n".join(
+        f"{'Utente' if message.role == 'user' else 'Assistente'}: {_truncate(message.content)}"
+        for message in messages
+    )
+
+
+def _get_lock(chat_id: str) -> asyncio.Lock:
+    lock = _locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[chat_id] = lock
+    return lock
+
+
+async def _summarize(summary: str, messages: List[ChatMessage]) -> str:
+    """
+    Integra i nuovi messaggi nel riassunto esistente, senza rileggere la chat
+    """
+    prompt = (
+        f"Riassunto attuale:\n{summary or '(nessuno)'}\n\n"
+        f"Nuovi messaggi:\n{_format_messages(messages)}\n\n"
+        "Riassunto aggiornato:"
+    )
+    response = await agenerate_chat_completion(
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=settings.MEMORY_SUMMARY_MAX_TOKENS,
+        temperature=0.2,
+        model=settings.MEMORY_SUMMARY_MODEL
+    )
+    _memory_stats["summary_tokens"] += response["tokens_used"]["total_tokens"]
+    return response["text"].strip()
+
+
+async def update_memory(chat_id: str) -> None:
+    """
+    Integra nel riassunto della chat i messaggi usciti dalla finestra degli
+    ultimi MEMORY_RECENT_MESSAGES, quando sono almeno MEMORY_SUMMARY_BATCH.
+    Il modello riceve solo il riassunto precedente e i nuovi messaggi
+
+    Args:
+        chat_id: L'ID della chat
+    """
+    async with _get_lock(chat_id):
+        session = await aget_chat_session(chat_id)
+        if session is None:
+            return
+        state = await aget_chat_summary(chat_id) or {"summary": "", "seq": 0}
+        window_start = session.message_count - settings.MEMORY_RECENT_MESSAGES
+        if window_start - state["seq"] < settings.MEMORY_SUMMARY_BATCH:
+            return
+
+        summary, seq = state["summary"], state["seq"]
+        while seq < window_start:
+            end = min(seq + _MAX_MESSAGES_PER_UPDATE, window_start)
+            messages, _ = await aget_chat_history_page(chat_id, limit=end - seq, before=end)
+            summary = await _summarize(summary, messages)
+            seq = end
+            await asave_chat_summary(chat_id, summary, seq)
+            _memory_stats["updates"] += 1
+            _memory_stats["messages_summarized"] += len(messages)
+        logger.debug(f"Riassunto della chat {chat_id} aggiornato fino al messaggio {seq}")
+
+
+async def _update_safely(chat_id: str) -> None:
+    try:
+        await update_memory(chat_id)
+    except Exception as e:
+        _memory_stats["errors"] += 1
+        logger.error(f"Errore nell'aggiornamento del riassunto della chat {chat_id}: {e}")
+
+
+def schedule_memory_update(chat_id: str) -> None:
+    """
+    Aggiorna il riassunto in background, dopo che la risposta è stata inviata
+
+    Args:
+        chat_id: L'ID della chat
+    """
+    if not settings.MEMORY_ENABLED:
+        return
+    task = asyncio.create_task(_update_safely(chat_id))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def load_memory(chat_id: str) -> Dict[str, Any]:
+    """
+    Carica la memoria della chat: il riassunto e i messaggi non ancora
+    riassunti (al massimo MEMORY_RECENT_MESSAGES + MEMORY_SUMMARY_BATCH),
+    così la dimensione del prompt non cresce con la lunghezza della chat
+
+    Args:
+        chat_id: L'ID della chat
+
+    Returns:
+        Un dizionario con il riassunto ("summary") e i messaggi recenti ("messages")
+    """
+    memory = {"summary": "", "messages": []}
+    if not settings.MEMORY_ENABLED or not chat_id:
+        return memory
+
+    try:
+        session = await aget_chat_session(chat_id)
+        if session is None or session.message_count == 0:
+            return memory
+
+        max_recent = settings.MEMORY_RECENT_MESSAGES + settings.MEMORY_SUMMARY_BATCH
+        state = await aget_chat_summary(chat_id) or {"summary": "", "seq": 0}
+        if session.message_count - state["seq"] > max_recent:
+            # L'aggiornamento in background non è ancora avvenuto (o è fallito)
+            await update_memory(chat_id)
+            state = await aget_chat_summary(chat_id) or state
+
+        pending = session.message_count - state["seq"]
+        messages, _ = await aget_chat_history_page(chat_id, limit=min(pending, max_recent))
+        memory["summary"] = state["summary"]
+        memory["messages"] = [{"role": message.role, "content": _truncate(message.content)} for message in messages]
+        _memory_stats["loads"] += 1
+    except Exception as e:
+        # Senza memoria il messaggio viene comunque elaborato
+        _memory_stats["errors"] += 1
+        logger.error(f"Errore nel caricamento della memoria della chat {chat_id}: {e}")
+    return memory
+
+
+def has_memory(memory: Optional[Dict[str, Any]]) -> bool:
+    """
+    Indica se la memoria contiene qualcosa (la risposta dipende allora dalla conversazione)
+    """
+    return bool(memory and (memory["summary"] or memory["messages"]))
+
+
+def memory_messages(memory: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Messaggi da inserire nel prompt prima della richiesta corrente
+
+    Args:
+        memory: La memoria della chat
+
+    Returns:
+        Il riassunto come messaggio di sistema, seguito dai messaggi recenti
+    """
+    if not has_memory(memory):
+        return []
+    messages = []
+    if memory["summary"]:
+        messages.append({"role": "system", "content": f"Riassunto della conversazione precedente:\n{memory['summary']}"})
+    messages.extend(memory["messages"])
+    return messages
+
+
+def contextual_query(query: str, memory: Optional[Dict[str, Any]]) -> str:
+    """
+    Query per il recupero dei documenti: una domanda breve di seguito
+    (es. "e per la cena?") viene completata con l'ultima richiesta dell'utente
+
+    Args:
+        query: Il messaggio corrente
+        memory: La memoria della chat
+
+    Returns:
+        Il testo da usare per il recupero
+    """
+    if not has_memory(memory) or len(query.split()) > settings.MEMORY_FOLLOWUP_MAX_WORDS:
+        return query
+    previous = [message["content"] for message in memory["messages"] if message["role"] == "user"]
+    return f"{previous[-1]} {query}" if previous else query
+
+
+def contextual_profile(message: str, memory: Optional[Dict[str, Any]]) -> str:
+    """
+    Profilo per la generazione di una dieta: il messaggio corrente completato con
+    quanto l'utente ha detto in precedenza (riassunto e messaggi recenti dell'utente)
+
+    Args:
+        message: Il messaggio corrente
+        memory: La memoria della chat
+
+    Returns:
+        Il testo del profilo
+    """
+    if not has_memory(memory):
+        return message
+    parts = [message]
+    previous = [m["content"] for m in memory["messages"] if m["role"] == "user"]
+    if previous:
+        parts.append("Messaggi precedenti dell'utente: " + " ".join(previous))
+    if memory["summary"]:
+        parts.append(f"Dalla conversazione precedente: {memory['summary']}")
+    return "\n".join(parts)
+
+
+def get_memory_stats() -> Dict[str, Any]:
+    """
+    Restituisce le statistiche della memoria delle conversazioni
+    """
+    return {**_memory_stats, "pending_updates": len(_pending)}
@@ -1,132 +1,639 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional, Set, Tuple
 import logging
-from openai import OpenAI
+import time
 from app.config import settings
-from app.core.rag_engine import query_rag
+from app.core.rag_engine import aquery_rag, aembed_query, get_index_version, is_lexical_fast_query
+from app.core.answer_cache import get_answer_cache, generation_variant, normalize_query
+from app.core.conversation_memory import has_memory, memory_messages, contextual_query
+from app.core.diet_profile import extract_profile_attributes, profile_fingerprint, personalize_plan
+from app.core.diet_plan import parse_diet_plan, render_diet_plan, copy_plan
+from app.core.energy_targets import compute_energy_targets, format_targets_block
+from app.core.nutrient_db import get_nutrient_db, fill_plan_calories
+from app.core.plan_cache import PlanCache, get_plan_cache
+from app.core.llm_manager import agenerate_chat_completion, astream_chat_completion
+from app.core.singleflight import get_singleflight
+from app.db.diet_plan_repository import save_diet_plan
+from app.models.diet import DietPlan
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
 
-# Client OpenAI
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# Modelli che hanno rifiutato la modalità JSON (response_format)
+_json_mode_unsupported: Set[str] = set()
 
-def generate_diet_plan(user_profile: str) -> Dict[str, Any]:
+def _build_diet_messages(user_profile: str, context: str, structured: bool = False) -> List[Dict[str, str]]:
+    """
+    Prepara i messaggi per la generazione di una dieta
+
+    Args:
+        user_profile: Il profilo utente
+        context: Il contesto recuperato dal motore RAG
+        structured: Se richiedere il piano come JSON (vedi DIET_JSON_PROMPT)
+
+    Returns:
+        La lista dei messaggi per il modello
+    """
+    # Prepara il prompt per il modello
+    prompt = settings.DIET_USER_PROMPT_TEMPLATE.format(
+        user_profile=user_profile,
+        context=context
+    )
+    if structured:
+        prompt += settings.DIET_JSON_PROMPT
+
+    return [
+        {"role": "system", "content": settings.DIET_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def _build_query_messages(query: str, context: str, memory: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
+    """
+    Prepara i messaggi per rispondere a una domanda nutrizionale
+
+    Args:
+        query: La domanda dell'utente
+        context: Il contesto recuperato dal motore RAG
+        memory: La memoria della chat (riassunto e messaggi recenti), opzionale
+
+    Returns:
+        La lista dei messaggi per il modello
+    """
+    # Prepara il prompt sistema per il modello
+    system_prompt = """
+    Sei un nutrizionista esperto italiano che fornisce consigli basati sulle linee guida ufficiali italiane.
+    Rispondi alle domande sulla nutrizione in modo chiaro, accurato e utile, basandoti solo sui contenuti
+    forniti come contesto. Se non hai informazioni sufficienti, indica quali informazioni mancano.
+    Cita sempre le tue fonti (LARN, INRAN, CREA) quando opportuno.
+    """
+
+    # Prepara il prompt utente
+    user_prompt = f"""
+    Domanda dell'utente: {query}
+
+    Contesto rilevante:
+    {context}
+
+    Rispondi alla domanda dell'utente in modo chiaro e conciso, basandoti sulle informazioni fornite.
+    Cita le fonti quando appropriato.
+    """
+
+    return [
+        {"role": "system", "content": system_prompt},
+        *memory_messages(memory),
+        {"role": "user", "content": user_prompt}
+    ]
+
+async def _retrieve_diet_context(user_profile: str, attributes: Dict[str, Any]) -> Tuple[Dict[str, Any], str, Optional[Dict[str, Any]]]:
+    """
+    Recupera il contesto per la generazione di una dieta. Se il profilo permette
+    di calcolare gli obiettivi nutrizionali, il prompt riceve il blocco numerico
+    e solo una parte ridotta degli estratti dei documenti
+
+    Args:
+        user_profile: Il profilo utente
+        attributes: Gli attributi estratti dal profilo
+
+    Returns:
+        I risultati del motore RAG, il contesto per il prompt e gli obiettivi (None se non calcolati)
+    """
+    targets = compute_energy_targets(attributes) if settings.ENERGY_TARGETS_ENABLED else None
+    if targets is None:
+        rag_results = await aquery_rag(user_profile, token_budget=settings.CONTEXT_TOKEN_BUDGET_DIET)
+        return rag_results, rag_results["context"], None
+
+    rag_results = await aquery_rag(user_profile, token_budget=settings.CONTEXT_TOKEN_BUDGET_DIET_TARGETS)
+    context = f"{format_targets_block(targets)}\n\nEstratti dalle linee guida:\n{rag_results['context']}"
+    return rag_results, context, targets
+
+def _no_tokens() -> Dict[str, int]:
+    """
+    Conteggio dei token di una risposta prodotta senza chiamare il modello,
+    nella stessa forma restituita da llm_manager
+    """
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+def _extract_sources(rag_results: Dict[str, Any]) -> List[str]:
+    """
+    Estrae i nomi dei documenti usati come fonte dai risultati RAG
+    """
+    return [node.node.metadata.get("file_name", "documento CREA/LARN")
+            for node in rag_results.get("source_nodes", [])]
+
+def _tokens_saved(rag_results: Dict[str, Any]) -> int:
+    """
+    Token di contesto risparmiati dalla costruzione del contesto, rispetto
+    all'unione dei chunk recuperati
+    """
+    return rag_results.get("context_stats", {}).get("tokens_saved", 0)
+
+async def _coalesced(name: str, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]], timeout: float) -> Dict[str, Any]:
+    """
+    Esegue fn una sola volta per le richieste concorrenti con la stessa chiave
+    (e la stessa versione dell'indice)
+
+    Args:
+        name: Il nome del gruppo di accorpamento
+        key: La chiave della richiesta (es. il testo normalizzato)
+        fn: La funzione asincrona che produce il risultato
+        timeout: Attesa massima della singola richiesta, in secondi
+
+    Returns:
+        Il risultato (condiviso tra le richieste accorpate: va copiato prima di modificarlo)
+    """
+    if not settings.SINGLEFLIGHT_ENABLED:
+        return await fn()
+    return await get_singleflight(name).do(f"{get_index_version()}:{key}", fn, timeout=timeout)
+
+def _adapt_plan(plan: Dict[str, Any], user_profile: str, attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Adatta un piano generato per un altro profilo con la stessa impronta.
+    Il piano strutturato viene copiato e salvato con un nuovo ID
+    """
+    diet_plan = plan["diet_plan"]
+    structured = None
+    if plan.get("plan") is not None:
+        structured = copy_plan(DietPlan.model_validate(plan["plan"]), user_profile)
+        save_diet_plan(structured)
+        diet_plan = render_diet_plan(structured)
+    if normalize_query(plan["user_profile"]) != normalize_query(user_profile):
+        diet_plan = personalize_plan(diet_plan, plan["profile_attributes"], attributes)
+    return {
+        "user_profile": user_profile,
+        "diet_plan": diet_plan,
+        "plan_id": structured.id if structured else None,
+        "plan": structured.model_dump(mode="json", exclude_none=True) if structured else None,
+        "tokens_used": _no_tokens(),
+        "context_tokens_saved": 0,
+        "sources": plan["sources"],
+        # Gli obiettivi si ricalcolano sui dati esatti del profilo, non sulle fasce dell'impronta
+        "energy_targets": compute_energy_targets(attributes) if settings.ENERGY_TARGETS_ENABLED else None,
+        "cached": True
+    }
+
+def _fill_missing_calories(plan: DietPlan) -> None:
+    """
+    Completa con la tabella degli alimenti le calorie che il modello non ha indicato
+    """
+    try:
+        filled = fill_plan_calories(get_nutrient_db(), plan)
+        if filled:
+            logger.info(f"Calorie di {filled} alimenti calcolate dalla tabella di composizione")
+    except Exception as e:
+        # Il piano resta valido anche senza la tabella degli alimenti
+        logger.error(f"Errore nel calcolo delle calorie del piano: {e}")
+
+def _rejects_response_format(error: Exception) -> bool:
+    """
+    Indica se l'errore (400) riguarda il parametro response_format, e non
+    ad esempio la lunghezza del contesto o il filtro dei contenuti
+    """
+    if getattr(error, "status_code", None) != 400:
+        return False
+    return getattr(error, "param", None) == "response_format" or "response_format" in str(error)
+
+async def _agenerate_structured(messages: List[Dict[str, str]], max_tokens: int, model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Genera il piano in modalità JSON; se il modello non la supporta ripiega,
+    da quel momento in poi e solo per quel modello, sulla sola istruzione nel prompt
+    """
+    model_name = model or settings.CHAT_MODEL
+    if settings.DIET_JSON_MODE and model_name not in _json_mode_unsupported:
+        try:
+            return await agenerate_chat_completion(
+                messages=messages,
+                max_tokens=max_tokens,
+                model=model,
+                response_format={"type": "json_object"}
+            )
+        except Exception as e:
+            if not _rejects_response_format(e):
+                raise
+            logger.warning(f"Modalità JSON non supportata da {model_name}, si usa solo il prompt: {e}")
+            _json_mode_unsupported.add(model_name)
+
+    return await agenerate_chat_completion(messages=messages, max_tokens=max_tokens, model=model)
+
+async def _astream_structured(
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    model: Optional[str] = None,
+    usage: Optional[Dict[str, int]] = None
+) -> AsyncIterator[str]:
+    """
+    Versione in streaming di _agenerate_structured: si ripiega sulla sola
+    istruzione nel prompt se il modello rifiuta la modalità JSON prima di
+    aver inviato frammenti
+    """
+    model_name = model or settings.CHAT_MODEL
+    if settings.DIET_JSON_MODE and model_name not in _json_mode_unsupported:
+        started = False
+        try:
+            async for delta in astream_chat_completion(
+                messages=messages,
+                max_tokens=max_tokens,
+                model=model,
+                response_format={"type": "json_object"},
+                usage=usage
+            ):
+                started = True
+                yield delta
+            return
+        except Exception as e:
+            if started or not _rejects_response_format(e):
+                raise
+            logger.warning(f"Modalità JSON non supportata da {model_name}, si usa solo il prompt: {e}")
+            _json_mode_unsupported.add(model_name)
+
+    async for delta in astream_chat_completion(messages=messages, max_tokens=max_tokens, model=model, usage=usage):
+        yield delta
+
+def _lookup_plan(
+    user_profile: str,
+    attributes: Dict[str, Any],
+    variant: str
+) -> Tuple[Optional[PlanCache], Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Cerca nella cache dei piani un piano generato per un profilo con la stessa impronta
+
+    Args:
+        user_profile: Il profilo utente
+        attributes: Gli attributi estratti dal profilo
+        variant: La variante di generazione (modello e token massimi)
+
+    Returns:
+        La cache (None se disattivata), l'impronta del profilo (None se non
+        calcolabile) e il piano adattato al profilo (None se assente)
+    """
+    if not settings.DIET_PLAN_CACHE_ENABLED:
+        return None, None, None
+    cache = get_plan_cache()
+    fingerprint = profile_fingerprint(attributes)
+    if fingerprint is None:
+        cache.record_uncacheable()
+        return cache, None, None
+    cached = cache.get(fingerprint, get_index_version(), variant)
+    if cached is None:
+        return cache, fingerprint, None
+    return cache, fingerprint, _adapt_plan(cached, user_profile, attributes)
+
+async def generate_diet_plan(user_profile: str, model: Optional[str] = None, max_tokens: int = 4000) -> Dict[str, Any]:
     """
     Genera un piano dietetico personalizzato basato sul profilo utente
-    e sul contesto recuperato dal motore RAG
-    
+    e sul contesto recuperato dal motore RAG.
+
+    Se un profilo con la stessa impronta (fasce di età e peso, sesso, attività,
+    obiettivo, restrizioni) ha già ricevuto un piano, questo viene riutilizzato
+    e adattato senza chiamare il modello. Le richieste concorrenti con la stessa
+    impronta, o con lo stesso testo, condividono un'unica generazione
+
     Args:
         user_profile: Il profilo utente con informazioni demografiche e obiettivi
-    
+        model: Il modello da usare (default: CHAT_MODEL)
+        max_tokens: Numero massimo di token generati
+
     Returns:
         Un dizionario contenente la dieta generata e metadati
     """
+    start = time.perf_counter()
+    attributes = extract_profile_attributes(user_profile)
+    variant = generation_variant(model, max_tokens)
+    cache, fingerprint, cached = _lookup_plan(user_profile, attributes, variant)
+    if cached is not None:
+        cache.record_latency("hit", time.perf_counter() - start)
+        return cached
+
+    result = await _coalesced(
+        "diet",
+        f"{variant}:profile:{fingerprint}" if fingerprint else f"{variant}:{normalize_query(user_profile)}",
+        lambda: _generate_diet_plan(user_profile, attributes, fingerprint, model, max_tokens),
+        settings.SINGLEFLIGHT_DIET_TIMEOUT
+    )
+    if fingerprint is not None and normalize_query(result["user_profile"]) != normalize_query(user_profile):
+        # Accorpata alla generazione di un profilo diverso con la stessa impronta
+        result = _adapt_plan(result, user_profile, attributes)
+    else:
+        # Le richieste accorpate possono differire per maiuscole o punteggiatura
+        result = {**result, "user_profile": user_profile}
+
+    if cache is not None:
+        cache.record_latency("miss" if fingerprint else "uncacheable", time.perf_counter() - start)
+    return result
+
+def _finish_diet_plan(
+    user_profile: str,
+    attributes: Dict[str, Any],
+    fingerprint: Optional[str],
+    index_version: str,
+    rag_results: Dict[str, Any],
+    targets: Optional[Dict[str, Any]],
+    response: Dict[str, Any],
+    variant: str
+) -> Dict[str, Any]:
+    """
+    Conclude una generazione: il piano strutturato viene riconosciuto, completato
+    e salvato, il testo ricostruito localmente e il risultato inserito nella
+    cache dei piani. Se la risposta non è riconoscibile si restituisce il testo generato
+    """
+    structured = settings.DIET_STRUCTURED_OUTPUT
+    plan = parse_diet_plan(response["text"], user_profile) if structured else None
+    if plan is not None:
+        if settings.NUTRIENT_FILL_PLANS:
+            _fill_missing_calories(plan)
+        save_diet_plan(plan)
+    elif structured:
+        logger.warning("Piano dietetico non strutturato: si restituisce il testo generato")
+
+    result = {
+        "user_profile": user_profile,
+        "diet_plan": render_diet_plan(plan) if plan is not None else response["text"],
+        "plan_id": plan.id if plan is not None else None,
+        "plan": plan.model_dump(mode="json", exclude_none=True) if plan is not None else None,
+        "tokens_used": response["tokens_used"],
+        "context_tokens_saved": _tokens_saved(rag_results),
+        "sources": _extract_sources(rag_results),
+        "energy_targets": targets,
+        "profile_attributes": attributes
+    }
+
+    if fingerprint is not None:
+        get_plan_cache().put(fingerprint, index_version, result, variant)
+
+    return result
+
+async def _generate_diet_plan(
+    user_profile: str,
+    attributes: Dict[str, Any],
+    fingerprint: Optional[str],
+    model: Optional[str] = None,
+    max_tokens: int = 4000
+) -> Dict[str, Any]:
     try:
-        # Recupera informazioni rilevanti dal motore RAG
-        rag_results = query_rag(user_profile)
-        context = rag_results["context"]
-        
-        # Prepara il prompt per il modello
-        prompt = settings.DIET_USER_PROMPT_TEMPLATE.format(
-            user_profile=user_profile,
-            context=context
-        )
-        
+        index_version = get_index_version()
+
+        # Recupera informazioni rilevanti dal motore RAG e calcola gli obiettivi nutrizionali
+        rag_results, context, targets = await _retrieve_diet_context(user_profile, attributes)
+
         # Genera la dieta con il modello GPT-4
-        response = client.chat.completions.create(
-            model=settings.CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": settings.DIET_SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=4000,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0
+        structured = settings.DIET_STRUCTURED_OUTPUT
+        messages = _build_diet_messages(user_profile, context, structured=structured)
+        if structured:
+            response = await _agenerate_structured(messages, max_tokens=max_tokens, model=model)
+        else:
+            response = await agenerate_chat_completion(messages=messages, max_tokens=max_tokens, model=model)
+
+        return _finish_diet_plan(
+            user_profile, attributes, fingerprint, index_version, rag_results, targets,
+            response, generation_variant(model, max_tokens)
         )
-        
-        # Estrai la risposta generata
-        diet_text = response.choices[0].message.content
-        
-        return {
-            "user_profile": user_profile,
-            "diet_plan": diet_text,
-            "tokens_used": {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            },
-            "sources": [node.node.metadata.get("file_name", "documento CREA/LARN") 
-                       for node in rag_results.get("source_nodes", [])]
-        }
     except Exception as e:
         logger.error(f"Errore nella generazione della dieta: {e}")
         raise
 
-def analyze_nutritional_query(query: str) -> Dict[str, Any]:
+async def stream_diet_plan(user_profile: str, model: Optional[str] = None, max_tokens: int = 4000) -> AsyncIterator[Dict[str, Any]]:
     """
-    Analizza una query nutrizionale e fornisce una risposta informativa
-    utilizzando il motore RAG e GPT-4
+    Genera un piano dietetico in streaming. Un piano in cache per la stessa
+    impronta viene inviato in un unico frammento; altrimenti i frammenti del
+    modello (il JSON del piano, con DIET_STRUCTURED_OUTPUT) sono inviati man
+    mano e a fine generazione il piano viene riconosciuto, salvato e messo in
+    cache come in generate_diet_plan. Lo streaming non passa dall'accorpamento
+
+    Args:
+        user_profile: Il profilo utente con informazioni demografiche e obiettivi
+        model: Il modello da usare (default: CHAT_MODEL)
+        max_tokens: Numero massimo di token generati
+
+    Yields:
+        Un evento {"type": "sources"} con le fonti, eventi {"type": "delta"}
+        con i frammenti generati e infine un evento {"type": "plan"} con il
+        piano ricostruito in "content" e il suo ID in "plan_id"
+    """
+    try:
+        start = time.perf_counter()
+        attributes = extract_profile_attributes(user_profile)
+        variant = generation_variant(model, max_tokens)
+        cache, fingerprint, cached = _lookup_plan(user_profile, attributes, variant)
+        if cached is not None:
+            cache.record_latency("hit", time.perf_counter() - start)
+            yield {"type": "sources", "sources": cached["sources"]}
+            yield {"type": "delta", "content": cached["diet_plan"]}
+            yield {"type": "plan", "content": cached["diet_plan"], "plan_id": cached["plan_id"]}
+            return
+
+        # Recupera informazioni rilevanti dal motore RAG e calcola gli obiettivi nutrizionali
+        index_version = get_index_version()
+        rag_results, context, targets = await _retrieve_diet_context(user_profile, attributes)
+        yield {"type": "sources", "sources": _extract_sources(rag_results)}
+
+        structured = settings.DIET_STRUCTURED_OUTPUT
+        messages = _build_diet_messages(user_profile, context, structured=structured)
+        usage: Dict[str, int] = {}
+        if structured:
+            deltas = _astream_structured(messages, max_tokens=max_tokens, model=model, usage=usage)
+        else:
+            deltas = astream_chat_completion(messages=messages, max_tokens=max_tokens, model=model, usage=usage)
+
+        chunks = []
+        async for delta in deltas:
+            chunks.append(delta)
+            yield {"type": "delta", "content": delta}
+
+        result = _finish_diet_plan(
+            user_profile, attributes, fingerprint, index_version, rag_results, targets,
+            {"text": "".join(chunks), "tokens_used": usage or _no_tokens()}, variant
+        )
+        if cache is not None:
+            cache.record_latency("miss" if fingerprint else "uncacheable", time.perf_counter() - start)
+        yield {"type": "plan", "content": result["diet_plan"], "plan_id": result["plan_id"]}
+    except Exception as e:
+        logger.error(f"Errore nella generazione della dieta in streaming: {e}")
+        raise
+
+async def _lookup_cached_answer(query: str, variant: str) -> Dict[str, Any]:
+    """
+    Cerca una risposta già generata per la query: prima per corrispondenza
+    esatta, poi per similarità dell'embedding della query
+
+    Args:
+        query: La domanda dell'utente
+        variant: La variante di generazione (modello e token massimi)
+
+    Returns:
+        Un dizionario con la risposta in cache ("answer", None se assente),
+        la versione dell'indice e l'embedding della query (se calcolato)
+    """
+    index_version = get_index_version()
+    cache = get_answer_cache()
+
+    cached = cache.get_exact(query, index_version, variant)
+    if cached is not None:
+        return {"answer": cached, "index_version": index_version, "embedding": None}
     
+    # Se il recupero userà solo l'indice lessicale, l'embedding non viene calcolato
+    # e il confronto semantico viene saltato
+    if is_lexical_fast_query(query):
+        cache.record_miss()
+        return {"answer": None, "index_version": index_version, "embedding": None}
+
+    # L'embedding serve anche al recupero dei documenti in caso di miss
+    embedding = await aembed_query(query)
+    cached = cache.get_similar(embedding, index_version, variant)
+    if cached is None:
+        cache.record_miss()
+    return {"answer": cached, "index_version": index_version, "embedding": embedding}
+
+async def analyze_nutritional_query(
+    query: str,
+    model: Optional[str] = None,
+    max_tokens: int = 1000,
+    memory: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Analizza una query nutrizionale e fornisce una risposta informativa
+    utilizzando il motore RAG e GPT-4. Le domande identiche in corso
+    condividono un'unica chiamata al modello
+
     Args:
         query: La domanda o richiesta dell'utente
-        
+        model: Il modello da usare (default: CHAT_MODEL)
+        max_tokens: Numero massimo di token generati
+        memory: La memoria della chat; la risposta dipende allora dalla
+            conversazione e non passa da cache né accorpamento
+
     Returns:
         Un dizionario contenente la risposta e metadati
     """
+    if has_memory(memory):
+        return await _analyze_nutritional_query(query, model, max_tokens, memory)
+
+    result = await _coalesced(
+        "query",
+        f"{generation_variant(model, max_tokens)}:{normalize_query(query)}",
+        lambda: _analyze_nutritional_query(query, model, max_tokens),
+        settings.SINGLEFLIGHT_QUERY_TIMEOUT
+    )
+    # Le richieste accorpate possono differire per maiuscole o punteggiatura
+    return {**result, "query": query}
+
+async def _analyze_nutritional_query(
+    query: str,
+    model: Optional[str] = None,
+    max_tokens: int = 1000,
+    memory: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
     try:
+        lookup = None
+        if settings.ANSWER_CACHE_ENABLED and not has_memory(memory):
+            lookup = await _lookup_cached_answer(query, generation_variant(model, max_tokens))
+            if lookup["answer"] is not None:
+                return {**lookup["answer"], "query": query, "cached": True}
+
         # Recupera informazioni rilevanti dal motore RAG
-        rag_results = query_rag(query)
-        context = rag_results["context"]
-        
-        # Prepara il prompt sistema per il modello
-        system_prompt = """
-        Sei un nutrizionista esperto italiano che fornisce consigli basati sulle linee guida ufficiali italiane.
-        Rispondi alle domande sulla nutrizione in modo chiaro, accurato e utile, basandoti solo sui contenuti
-        forniti come contesto. Se non hai informazioni sufficienti, indica quali informazioni mancano.
-        Cita sempre le tue fonti (LARN, INRAN, CREA) quando opportuno.
-        """
-        
-        # Prepara il prompt utente
-        user_prompt = f"""
-        Domanda dell'utente: {query}
-        
-        Contesto rilevante:
-        {context}
-        
-        Rispondi alla domanda dell'utente in modo chiaro e conciso, basandoti sulle informazioni fornite.
-        Cita le fonti quando appropriato.
-        """
-        
+        rag_results = await aquery_rag(contextual_query(query, memory), query_embedding=lookup["embedding"] if lookup else None)
+
         # Genera la risposta con il modello
-        response = client.chat.completions.create(
-            model=settings.CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0
+        response = await agenerate_chat_completion(
+            messages=_build_query_messages(query, rag_results["context"], memory),
+            max_tokens=max_tokens,
+            model=model
         )
-        
-        # Estrai la risposta generata
-        answer_text = response.choices[0].message.content
-        
-        return {
+
+        result = {
             "query": query,
-            "answer": answer_text,
-            "tokens_used": {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            },
-            "sources": [node.node.metadata.get("file_name", "documento CREA/LARN") 
-                       for node in rag_results.get("source_nodes", [])]
+            "answer": response["text"],
+            "tokens_used": response["tokens_used"],
+            "context_tokens_saved": _tokens_saved(rag_results),
+            "sources": _extract_sources(rag_results)
         }
+
+        if lookup is not None:
+            get_answer_cache().put(
+                query, lookup["index_version"], result, lookup["embedding"], generation_variant(model, max_tokens)
+            )
+
+        return result
     except Exception as e:
         logger.error(f"Errore nell'analisi della query nutrizionale: {e}")
         raise
+
+async def stream_nutritional_query(
+    query: str,
+    model: Optional[str] = None,
+    max_tokens: int = 1000,
+    memory: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Risponde a una query nutrizionale in streaming
+
+    Args:
+        query: La domanda o richiesta dell'utente
+        model: Il modello da usare (default: CHAT_MODEL)
+        max_tokens: Numero massimo di token generati
+        memory: La memoria della chat (la risposta non passa allora dalla cache)
+
+    Yields:
+        Un evento {"type": "sources"} con le fonti, seguito da eventi
+        {"type": "delta"} con i frammenti di testo generati
+    """
+    try:
+        lookup = None
+        if settings.ANSWER_CACHE_ENABLED and not has_memory(memory):
+            lookup = await _lookup_cached_answer(query, generation_variant(model, max_tokens))
+            if lookup["answer"] is not None:
+                # Risposta in cache: viene inviata in un unico frammento
+                yield {"type": "sources", "sources": lookup["answer"].get("sources", [])}
+                yield {"type": "delta", "content": lookup["answer"]["answer"]}
+                return
+
+        # Recupera informazioni rilevanti dal motore RAG
+        rag_results = await aquery_rag(contextual_query(query, memory), query_embedding=lookup["embedding"] if lookup else None)
+        sources = _extract_sources(rag_results)
+        yield {"type": "sources", "sources": sources}
+
+        chunks = []
+        async for delta in astream_chat_completion(
+            messages=_build_query_messages(query, rag_results["context"], memory),
+            max_tokens=max_tokens,
+            model=model
+        ):
+            chunks.append(delta)
+            yield {"type": "delta", "content": delta}
+
+        if lookup is not None:
+            get_answer_cache().put(
+                query,
+                lookup["index_version"],
+                {"query": query, "answer": "".join(chunks), "sources": sources},
+                lookup["embedding"],
+                generation_variant(model, max_tokens)
+            )
+    except Exception as e:
+        logger.error(f"Errore nell'analisi in streaming della query nutrizionale: {e}")
+        raise
+
+async def retrieve_guideline_excerpts(query: str) -> Dict[str, Any]:
+    """
+    Risponde con i passaggi più pertinenti dei documenti di riferimento,
+    senza chiamare il modello
+
+    Args:
+        query: La domanda o richiesta dell'utente
+
+    Returns:
+        Un dizionario con gli estratti come risposta e le fonti
+    """
+    try:
+        rag_results = await aquery_rag(query, token_budget=settings.ROUTER_RETRIEVAL_TOKEN_BUDGET)
+        if not rag_results["context"].strip():
+            answer = "Non ho trovato passaggi pertinenti nei documenti di riferimento."
+        else:
+            answer = f"Ecco i passaggi più pertinenti dei documenti di riferimento:\n\n{rag_results['context']}"
+        return {
+            "query": query,
+            "answer": answer,
+            "tokens_used": _no_tokens(),
+            "context_tokens_saved": _tokens_saved(rag_results),
+            "sources": _extract_sources(rag_results)
+        }
+    except Exception as e:
+        logger.error(f"Errore nel recupero degli estratti dei documenti: {e}")
+        raise
@@ -0,0 +1,428 @@
+from typing import Dict, Any, List, Optional
+import json
+import logging
+import re
+import unicodedata
+import uuid
+
+from pydantic import ValidationError
+
+from app.models.diet import DietPlan, DailyPlan, Meal
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ["lunedi", "martedi", "mercoledi", "giovedi", "venerdi", "sabato", "domenica"]
+
+# Intestazioni riconosciute dal parser di riserva
+_DAY_HEADING = re.compile(r"\b(" + "|".join(WEEKDAYS) + r"|giorno\s+\d+)\b")
+_MEAL_HEADING = re.compile(r"\b(colazione|spuntino|meta mattina|merenda|meta pomeriggio|pranzo|cena)\b")
+_PRINCIPLES_HEADING = re.compile(r"\bprincipi\b")
+_RECOMMENDATIONS_HEADING = re.compile(r"\b(consigli|raccomandazioni)\b")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_KCAL = re.compile(r"(\d{2,4})\s*(?:kcal|calorie)")
+_QUANTITY = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:g|gr|grammi|ml|l|kg|cucchia\w*|fett\w*|porzion\w*|tazz\w*|vasett\w*|bicchier\w*|pz|pezz\w*)\b"
+    r"|\b(?:un[oa']?|due|tre|mezz[oa])\s+(?:cucchia\w*|fett\w*|porzion\w*|tazz\w*|vasett\w*|bicchier\w*|frutt\w*|manciat\w*)"
+)
+
+
+def _normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _strip_markup(line: str) -> str:
+    return re.sub(r"[#*_`]+", "", line).strip(" :-–")
+
+
+# ----------------------------------------------------------------------
+# Lettura della risposta del modello
+# ----------------------------------------------------------------------
+
+def _extract_json(text: str) -> Optional[str]:
+    """
+    Restituisce la parte JSON della risposta, togliendo eventuali blocchi ``` e testo attorno
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    end = text.rfind("}")
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _repair_truncated_json(text: str) -> Optional[str]:
+    """
+    Chiude un JSON troncato (es. risposta interrotta da max_tokens): taglia
+    dopo l'ultimo oggetto o lista completi e chiude le parentesi rimaste aperte
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    last_cut = None
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            last_cut = (position + 1, list(stack))
+            if not stack:
+                return text[:position + 1]
+
+    if last_cut is None:
+        return None
+    position, open_brackets = last_cut
+    return text[:position] + "".join(reversed(open_brackets))
+
+
+def _plan_from_dict(data: Dict[str, Any], user_profile: str) -> DietPlan:
+    data = dict(data)
+    data["id"] = uuid.uuid4().hex
+    data["user_profile"] = user_profile
+    data.setdefault("title", "Piano alimentare settimanale")
+    data.pop("created_at", None)
+    return DietPlan.model_validate(data)
+
+
+def parse_json_plan(text: str, user_profile: str) -> Optional[DietPlan]:
+    """
+    Valida la risposta JSON del modello nel modello DietPlan
+
+    Args:
+        text: La risposta del modello
+        user_profile: Il profilo utente
+
+    Returns:
+        Il piano, oppure None se la risposta non è un JSON valido per lo schema
+    """
+    raw = _extract_json(text)
+    if raw is None:
+        return None
+    for candidate in (raw, _repair_truncated_json(raw)):
+        if candidate is None:
+            continue
+        try:
+            plan = _plan_from_dict(json.loads(candidate), user_profile)
+        except (json.JSONDecodeError, ValidationError, TypeError) as e:
+            logger.debug(f"Piano JSON non valido: {e}")
+            continue
+        if plan.daily_plans:
+            return plan
+    return None
+
+
+def parse_text_plan(text: str, user_profile: str) -> Optional[DietPlan]:
+    """
+    Parser di riserva per i piani in testo libero (markdown): riconosce le
+    intestazioni dei giorni e dei pasti, gli elenchi di alimenti con quantità
+    e le calorie indicate in kcal
+
+    Args:
+        text: Il piano in testo libero
+        user_profile: Il profilo utente
+
+    Returns:
+        Il piano, oppure None se non è stato riconosciuto nessun pasto
+    """
+    days: List[Dict[str, Any]] = []
+    day: Optional[Dict[str, Any]] = None
+    meal: Optional[Dict[str, Any]] = None
+    section: Optional[str] = None
+    extra: Dict[str, List[str]] = {"nutritional_principles": [], "general_recommendations": []}
+    title = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        normalized = _normalize_text(stripped)
+        is_bullet = _BULLET.match(stripped) is not None
+        is_heading = not is_bullet and len(stripped) <= 80
+        kcal = _KCAL.search(normalized)
+
+        if title is None and stripped.startswith("#") and not days:
+            title = _strip_markup(stripped)
+            continue
+
+        if is_heading and _PRINCIPLES_HEADING.search(normalized):
+            section, meal = "nutritional_principles", None
+            continue
+        if is_heading and _RECOMMENDATIONS_HEADING.search(normalized) and not _MEAL_HEADING.search(normalized):
+            section, meal = "general_recommendations", None
+            continue
+
+        day_match = _DAY_HEADING.search(normalized) if is_heading else None
+        meal_match = _MEAL_HEADING.search(normalized) if is_heading or (is_bullet and len(stripped) <= 60) else None
+
+        if day_match and not meal_match:
+            day = {"day": _strip_markup(stripped).split("(")[0].strip(), "meals": [], "total_calories": None}
+            days.append(day)
+            meal, section = None, None
+            continue
+
+        if meal_match:
+            if day is None:
+                day = {"day": "Giorno 1", "meals": [], "total_calories": None}
+                days.append(day)
+            name = _strip_markup(_BULLET.sub("", stripped))
+            meal = {"name": name.split("(")[0].split(":")[0].strip() or name, "items": [], "total_calories": None, "notes": None}
+            if kcal:
+                meal["total_calories"] = int(kcal.group(1))
+            day["meals"].append(meal)
+            section = None
+            # "Colazione: yogurt 150 g, ..." sulla stessa riga
+            rest = name.split(":", 1)[1].strip() if ":" in name else ""
+            if rest and _QUANTITY.search(_normalize_text(rest)):
+                meal["items"].append(_parse_item(rest))
+            continue
+
+        if section is not None:
+            extra[section].append(_strip_markup(_BULLET.sub("", stripped)))
+            continue
+
+        if meal is None:
+            continue
+
+        if "totale" in normalized and kcal:
+            if meal["items"] or meal["total_calories"] is None:
+                meal["total_calories"] = int(kcal.group(1))
+            continue
+
+        content = _BULLET.sub("", stripped)
+        if is_bullet and _QUANTITY.search(_normalize_text(content)) or is_bullet and kcal:
+            meal["items"].append(_parse_item(content))
+        else:
+            note = _strip_markup(content)
+            meal["notes"] = f"{meal['notes']} {note}" if meal["notes"] else note
+
+    days = [day for day in days if day["meals"]]
+    if not days:
+        return None
+
+    data = {
+        "title": title or "Piano alimentare settimanale",
+        "daily_plans": days,
+        "nutritional_principles": "\n".join(extra["nutritional_principles"]) or None,
+        "general_recommendations": "\n".join(extra["general_recommendations"]) or None,
+    }
+    return _plan_from_dict(data, user_profile)
+
+
+def _parse_item(text: str) -> Dict[str, Any]:
+    """
+    Scompone una riga di alimento ("Yogurt greco: 150 g (130 kcal)") in nome, quantità e calorie
+    """
+    clean = _strip_markup(text)
+    normalized = _normalize_text(clean)
+    kcal = _KCAL.search(normalized)
+    quantity = _QUANTITY.search(normalized)
+
+    name = clean
+    quantity_text = ""
+    if quantity:
+        quantity_text = clean[quantity.start():quantity.end()]
+        name = (clean[:quantity.start()] + clean[quantity.end():])
+    name = re.sub(r"\(?\s*~?\d{2,4}\s*(?:kcal|calorie)\s*\)?", "", name, flags=re.IGNORECASE)
+    name = re.sub(r"^\s*di\s+|\s*[:,(-]\s*$", "", name.strip(" :-,()"), flags=re.IGNORECASE).strip()
+
+    return {
+        "name": name or clean,
+        "quantity": quantity_text or "q.b.",
+        "calories": int(kcal.group(1)) if kcal else None,
+    }
+
+
+def parse_diet_plan(text: str, user_profile: str) -> Optional[DietPlan]:
+    """
+    Converte la risposta del modello in un DietPlan: prima come JSON (anche
+    troncato), poi con il parser di riserva per il testo libero
+
+    Args:
+        text: La risposta del modello
+        user_profile: Il profilo utente
+
+    Returns:
+        Il piano con i totali calcolati, oppure None se non riconosciuto
+    """
+    plan = parse_json_plan(text, user_profile)
+    if plan is None:
+        plan = parse_text_plan(text, user_profile)
+        if plan is not None:
+            logger.info("Piano dietetico ricavato dal testo con il parser di riserva")
+    if plan is not None:
+        fill_totals(plan)
+    return plan
+
+
+# ----------------------------------------------------------------------
+# Calcoli locali
+# ----------------------------------------------------------------------
+
+def meal_calories(meal: Meal) -> Optional[int]:
+    """
+    Calorie di un pasto: somma degli alimenti se tutti le indicano,
+    altrimenti il totale dichiarato
+    """
+    if meal.items and all(item.calories is not None for item in meal.items):
+        return sum(item.calories for item in meal.items)
+    return meal.total_calories
+
+
+def day_calories(day: DailyPlan) -> Optional[int]:
+    """
+    Calorie di una giornata: somma dei pasti, altrimenti il totale dichiarato
+    """
+    values = [meal_calories(meal) for meal in day.meals]
+    if values and all(value is not None for value in values):
+        return sum(values)
+    return day.total_calories
+
+
+def fill_totals(plan: DietPlan) -> DietPlan:
+    """
+    Ricalcola i totali di pasti e giornate a partire dagli alimenti
+
+    Args:
+        plan: Il piano da aggiornare (modificato sul posto)
+
+    Returns:
+        Lo stesso piano
+    """
+    for day in plan.daily_plans:
+        for meal in day.meals:
+            meal.total_calories = meal_calories(meal)
+        day.total_calories = day_calories(day)
+    return plan
+
+
+def compute_totals(plan: DietPlan) -> Dict[str, Any]:
+    """
+    Totali calorici del piano, per pasto, giornata e settimana
+
+    Args:
+        plan: Il piano dietetico
+
+    Returns:
+        Un dizionario con il dettaglio per giornata, il totale settimanale
+        e la media giornaliera (sulle giornate con totale noto)
+    """
+    days = []
+    for day in plan.daily_plans:
+        days.append({
+            "day": day.day,
+            "meals": {meal.name: meal_calories(meal) for meal in day.meals},
+            "total_calories": day_calories(day),
+        })
+    known = [day["total_calories"] for day in days if day["total_calories"] is not None]
+    return {
+        "days": days,
+        "weekly_total_calories": sum(known) if known else None,
+        "average_daily_calories": round(sum(known) / len(known)) if known else None,
+    }
+
+
+def find_meal(plan: DietPlan, day: str, meal: str) -> Optional[Meal]:
+    """
+    Cerca un pasto per giorno e nome, ignorando maiuscole e accenti
+    (es. "lunedì"/"Lunedi", "pranzo")
+
+    Args:
+        plan: Il piano dietetico
+        day: Il giorno, oppure il suo numero a partire da 1
+        meal: Il nome (o parte del nome) del pasto
+
+    Returns:
+        Il pasto, oppure None
+    """
+    day_key = _normalize_text(day)
+    meal_key = _normalize_text(meal)
+    for position, daily_plan in enumerate(plan.daily_plans, start=1):
+        if day_key != str(position) and day_key not in _normalize_text(daily_plan.day):
+            continue
+        for candidate in daily_plan.meals:
+            if meal_key in _normalize_text(candidate.name):
+                return candidate
+    return None
+
+
+def render_diet_plan(plan: DietPlan) -> str:
+    """
+    Produce il testo markdown del piano, senza chiamare il modello
+
+    Args:
+        plan: Il piano dietetico
+
+    Returns:
+        Il piano in markdown
+    """
+    lines = [f"# {plan.title}", ""]
+    for day in plan.daily_plans:
+        total = day_calories(day)
+        lines.append(f"## {day.day}" + (f" ({total} kcal)" if total is not None else ""))
+        for meal in day.meals:
+            calories = meal_calories(meal)
+            lines.append(f"**{meal.name}**" + (f" ({calories} kcal)" if calories is not None else ""))
+            for item in meal.items:
+                line = f"- {item.name}: {item.quantity}"
+                if item.calories is not None:
+                    line += f" (~{item.calories} kcal)"
+                lines.append(line)
+            if meal.notes:
+                lines.append(f"_{meal.notes}_")
+            lines.append("")
+        if day.notes:
+            lines.extend([day.notes, ""])
+
+    totals = compute_totals(plan)
+    if totals["weekly_total_calories"] is not None:
+        lines.extend([
+            f"**Totale settimanale:** {totals['weekly_total_calories']} kcal "
+            f"(media giornaliera {totals['average_daily_calories']} kcal)",
+            ""
+        ])
+    if plan.nutritional_principles:
+        lines.extend(["## Principi nutrizionali", plan.nutritional_principles, ""])
+    if plan.general_recommendations:
+        lines.extend(["## Consigli generali", plan.general_recommendations, ""])
+    return "\n".join(lines).strip()
+
+
+# ----------------------------------------------------------------------
+# Serializzazione compatta
+# ----------------------------------------------------------------------
+
+def dump_plan(plan: DietPlan) -> str:
+    """
+    Serializza il piano in JSON compatto, senza i campi vuoti
+    """
+    return plan.model_dump_json(exclude_none=True)
+
+
+def load_plan(data: str) -> DietPlan:
+    """
+    Ricostruisce un piano serializzato con dump_plan
+    """
+    return DietPlan.model_validate_json(data)
+
+
+def copy_plan(plan: DietPlan, user_profile: str) -> DietPlan:
+    """
+    Copia un piano per un altro utente, con un nuovo identificativo
+    """
+    return DietPlan.model_validate({
+        **plan.model_dump(exclude={"id", "user_profile", "created_at"}),
+        "id": uuid.uuid4().hex,
+        "user_profile": user_profile,
+    })
@@ -0,0 +1,210 @@
+from typing import Dict, Any, List, Optional
+import re
+import unicodedata
+
+# Fasce di età: (limite superiore escluso, etichetta). Sotto i 18 anni l'età
+# resta esatta, perché i fabbisogni cambiano di anno in anno
+AGE_BANDS = [(30, "18-29"), (40, "30-39"), (50, "40-49"), (60, "50-59"), (70, "60-69")]
+WEIGHT_BAND_KG = 5
+HEIGHT_BAND_CM = 5
+
+# Attributi senza i quali un piano non può essere riutilizzato per un altro profilo
+REQUIRED_ATTRIBUTES = ("sex", "age", "weight", "goal")
+
+_SEX_PATTERNS = [
+    ("F", r"\b(?:donna|femmina|ragazza|signora|femminile|sesso\s*f)\b"),
+    ("M", r"\b(?:uomo|maschio|ragazzo|signore|maschile|sesso\s*m)\b"),
+]
+
+# Livello di attività, dal più specifico al più generico: vince il primo riscontro.
+# Le negazioni ("non sono sportiva", "non molto attivo") precedono i riscontri positivi
+_ACTIVITY_PATTERNS = [
+    ("sedentary", r"\bsedentari\w*|\bnessuna attivita\b|\bnon (?:faccio|fa|pratico|pratica) (?:sport|attivita)"
+                  r"|\bnon (?:(?:sono|e|molto|troppo|particolarmente|affatto|per niente|piu|una persona|un tipo) )*(?:attiv|sportiv)\w*"),
+    ("light", r"\b(?:poco|leggermente) attiv\w*|\battivita (?:fisica )?leggera\b"),
+    ("high", r"\bmolto attiv\w*|\batlet\w*|\bagonist\w*|\battivita (?:fisica )?intensa\b|\bsportiv\w*"),
+    ("moderate", r"\bmoderatamente attiv\w*|\battivita (?:fisica )?moderata\b|\battiv[oa]\b"),
+]
+
+# Obiettivi: se il testo ne cita più di uno l'obiettivo resta indeterminato
+_GOAL_PATTERNS = [
+    ("lose", r"\bdimagr\w*|\bperdere (?:\w+ )?(?:peso|chili|kg)\b|\bperdita di peso\b|\bcalare\b|\bridurre (?:il )?peso\b"),
+    ("gain", r"\bmassa muscolare\b|\bingrassare\b|\b(?:aumentare|prendere) (?:di )?peso\b"),
+    ("maintain", r"\bmantener\w*|\bmantenimento\b"),
+]
+
+_RESTRICTION_PATTERNS = [
+    ("vegan", r"\bvegan\w*"),
+    ("vegetarian", r"\bvegetarian\w*"),
+    ("gluten_free", r"\b(?:(?:intolleran\w*|allergi\w*)\s+(?:al\s+)?)?glutine\b|\bceliac\w*"),
+    ("lactose_free", r"\b(?:(?:intolleran\w*|allergi\w*)\s+(?:al\s+)?)?lattosio\b"),
+    ("diabetes", r"\bdiabet\w*"),
+    ("hypertension", r"\biperte\w*|\bpressione alta\b"),
+    ("pregnancy", r"\bincinta\b|\bgravidanza\b|\ballatta\w*"),
+]
+
+# Vincoli espressi a parole che il riconoscimento non sa codificare: un profilo
+# che li contiene non viene mai servito con un piano generato per un altro
+_FREE_CONSTRAINT_MARKERS = r"\ballergi\w*|\bintolleran\w*|\bnon mangi\w*|\bnon posso\b|\bevit\w*|\bpatologi\w*|\bmalattia\b|\bfarmac\w*"
+
+
+def _normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _first_match(patterns: List, text: str) -> Optional[str]:
+    for value, pattern in patterns:
+        if re.search(pattern, text):
+            return value
+    return None
+
+
+def _single_match(patterns: List, text: str) -> Optional[str]:
+    values = {value for value, pattern in patterns if re.search(pattern, text)}
+    return values.pop() if len(values) == 1 else None
+
+
+def _number(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def extract_profile_attributes(user_profile: str) -> Dict[str, Any]:
+    """
+    Estrae dal profilo in testo libero gli attributi che determinano la dieta,
+    con semplici espressioni regolari (nessuna chiamata al modello)
+
+    Args:
+        user_profile: Il profilo utente in testo libero
+
+    Returns:
+        Un dizionario con sex ("F"/"M"), age, weight (kg), height (cm),
+        activity, goal, restrictions (lista ordinata) e free_constraints
+        (True se il testo contiene vincoli non riconosciuti). Gli attributi
+        non trovati valgono None
+    """
+    text = _normalize_text(user_profile)
+
+    age = re.search(r"\b(\d{1,2})\s*anni\b", text) or re.search(r"\beta\W{0,3}(\d{1,2})\b", text)
+    weight = (re.search(r"\b(\d{2,3}(?:[.,]\d)?)\s*(?:kg|chili|chilogrammi)\b", text)
+              or re.search(r"\bpes[oa]\D{0,12}(\d{2,3}(?:[.,]\d)?)\b", text))
+    height_cm = re.search(r"\b(\d{3})\s*cm\b", text) or re.search(r"\balt(?:ezza|[oa])\D{0,12}(\d{3})\b", text)
+    height_m = re.search(r"\b([12][.,]\d{1,2})\s*(?:m|metri)\b", text)
+
+    height = None
+    if height_cm:
+        height = _number(height_cm.group(1))
+    elif height_m:
+        height = float(round(_number(height_m.group(1)) * 100))
+
+    # I vincoli riconosciuti vengono tolti dal testo prima di cercare quelli liberi
+    restrictions = []
+    remaining = text
+    for value, pattern in _RESTRICTION_PATTERNS:
+        if re.search(pattern, remaining):
+            restrictions.append(value)
+            remaining = re.sub(pattern, " ", remaining)
+
+    return {
+        # Se il testo cita entrambi i sessi (es. "mio figlio... io sono una donna") il dato è ambiguo
+        "sex": _single_match(_SEX_PATTERNS, text),
+        "age": int(age.group(1)) if age else None,
+        "weight": _number(weight.group(1)) if weight else None,
+        "height": height,
+        "activity": _first_match(_ACTIVITY_PATTERNS, text),
+        "goal": _single_match(_GOAL_PATTERNS, text),
+        "restrictions": sorted(restrictions),
+        "free_constraints": re.search(_FREE_CONSTRAINT_MARKERS, remaining) is not None,
+    }
+
+
+def _age_band(age: int) -> str:
+    if age < 18:
+        return str(age)
+    for limit, label in AGE_BANDS:
+        if age < limit:
+            return label
+    return "70+"
+
+
+def _band(value: float, width: int) -> str:
+    low = int(value // width * width)
+    return f"{low}-{low + width - 1}"
+
+
+def profile_fingerprint(attributes: Dict[str, Any]) -> Optional[str]:
+    """
+    Costruisce l'impronta canonica di un profilo: due profili con la stessa
+    impronta possono ricevere lo stesso piano
+
+    Args:
+        attributes: Gli attributi estratti da extract_profile_attributes
+
+    Returns:
+        L'impronta (es. "sex=F|age=30-39|weight=65-69|height=?|activity=sedentary|goal=lose|restrictions=-"),
+        oppure None se il profilo è incompleto o contiene vincoli non riconosciuti
+    """
+    if attributes["free_constraints"]:
+        return None
+    if any(attributes[name] is None for name in REQUIRED_ATTRIBUTES):
+        return None
+
+    return "|".join([
+        f"sex={attributes['sex']}",
+        f"age={_age_band(attributes['age'])}",
+        f"weight={_band(attributes['weight'], WEIGHT_BAND_KG)}",
+        f"height={_band(attributes['height'], HEIGHT_BAND_CM) if attributes['height'] else '?'}",
+        f"activity={attributes['activity'] or '?'}",
+        f"goal={attributes['goal']}",
+        f"restrictions={','.join(attributes['restrictions']) or '-'}",
+    ])
+
+
+_SEX_LABELS = {"F": "donna", "M": "uomo"}
+_ACTIVITY_LABELS = {"sedentary": "sedentaria", "light": "poco attiva", "moderate": "moderatamente attiva", "high": "molto attiva"}
+_GOAL_LABELS = {"lose": "perdita di peso", "gain": "aumento di peso/massa muscolare", "maintain": "mantenimento del peso"}
+
+
+def _format_number(value: float) -> str:
+    return f"{value:g}"
+
+
+def personalize_plan(diet_plan: str, source: Dict[str, Any], target: Dict[str, Any]) -> str:
+    """
+    Adatta un piano generato per un profilo simile: sostituisce età, peso e
+    altezza del profilo di origine con quelli dell'utente e aggiunge
+    un'intestazione con il profilo riconosciuto
+
+    Args:
+        diet_plan: Il testo del piano salvato
+        source: Gli attributi del profilo per cui il piano è stato generato
+        target: Gli attributi del profilo dell'utente
+
+    Returns:
+        Il piano adattato
+    """
+    replacements = [
+        ("age", r"\b{}(\s*anni)\b"),
+        ("weight", r"\b{}(\s*kg)\b"),
+        ("height", r"\b{}(\s*cm)\b"),
+    ]
+    for name, pattern in replacements:
+        if source.get(name) is not None and target.get(name) is not None and source[name] != target[name]:
+            diet_plan = re.sub(
+                pattern.format(re.escape(_format_number(source[name]))),
+                lambda match, value=_format_number(target[name]): value + match.group(1),
+                diet_plan
+            )
+
+    details = [_SEX_LABELS[target["sex"]], f"{target['age']} anni", f"{_format_number(target['weight'])} kg"]
+    if target.get("height"):
+        details.append(f"{_format_number(target['height'])} cm")
+    if target.get("activity"):
+        details.append(_ACTIVITY_LABELS[target["activity"]])
+    details.append(f"obiettivo: {_GOAL_LABELS[target['goal']]}")
+
+    header = (
+        f"*Piano per il profilo: {', '.join(details)}. "
+        "Le porzioni sono calibrate per profili nella stessa fascia di età, peso e attività.*"
+    )
+    return f"{header}\n\n{diet_plan}"
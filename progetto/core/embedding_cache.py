@@ -0,0 +1,139 @@
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Cache LRU degli embedding delle query, indicizzata per modello e testo.
+
+    Evita di ricalcolare (e pagare) l'embedding di una query già vista di
+    recente. Opzionalmente gli embedding vengono salvati anche su disco
+    (SQLite), così sopravvivono ai riavvii e sono condivisi tra i worker.
+    """
+
+    def __init__(self, max_entries: int = 5000, disk_path: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.disk_path = Path(disk_path) if disk_path else None
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._disk: Optional[sqlite3.Connection] = None
+        if self.disk_path is not None:
+            os.makedirs(self.disk_path.parent, exist_ok=True)
+            self._disk = sqlite3.connect(str(self.disk_path), check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """
+        Calcola la chiave di cache per un modello e un testo
+        """
+        return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """
+        Cerca l'embedding di un testo
+
+        Args:
+            model: Il nome del modello di embedding
+            text: Il testo della query
+
+        Returns:
+            L'embedding salvato, oppure None
+        """
+        key = self.make_key(model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return vector
+
+            if self._disk is not None:
+                row = self._disk.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._insert(key, vector)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return vector
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, model: str, text: str, vector: List[float]) -> None:
+        """
+        Salva l'embedding di un testo
+
+        Args:
+            model: Il nome del modello di embedding
+            text: Il testo della query
+            vector: L'embedding calcolato
+        """
+        key = self.make_key(model, text)
+        with self._lock:
+            self._insert(key, vector)
+            if self._disk is not None:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        (key, np.asarray(vector, dtype=np.float32).tobytes())
+                    )
+                except sqlite3.Error as e:
+                    logger.error(f"Errore nel salvataggio su disco dell'embedding: {e}")
+
+    def _insert(self, key: str, vector: List[float]) -> None:
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Restituisce i contatori di hit/miss della cache
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Istanza condivisa della cache (creata al primo utilizzo)
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Restituisce la cache degli embedding configurata nelle impostazioni
+
+    Returns:
+        L'istanza condivisa di EmbeddingCache
+    """
+    global _embedding_cache
+
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(
+            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+            disk_path=settings.EMBEDDING_CACHE_DISK_PATH
+        )
+
+    return _embedding_cache
@@ -0,0 +1,139 @@
+from typing import Dict, Any, List, Optional
+
+# Metabolismo basale (kcal/giorno) secondo le equazioni LARN, dal peso in kg:
+# per sesso, (età massima esclusa, coefficiente, costante)
+BMR_EQUATIONS = {
+    "M": [(30, 15.3, 679), (60, 11.6, 879), (75, 11.9, 700), (200, 8.4, 819)],
+    "F": [(30, 14.7, 496), (60, 8.7, 829), (75, 9.2, 688), (200, 9.8, 624)],
+}
+
+# Livelli di attività fisica (PAL) LARN
+PAL_LEVELS = {"sedentary": 1.45, "light": 1.60, "moderate": 1.75, "high": 2.10}
+DEFAULT_ACTIVITY = "light"
+
+# Variazione dell'energia rispetto al dispendio per obiettivo
+GOAL_ADJUSTMENTS = {"lose": -0.20, "maintain": 0.0, "gain": 0.10}
+# Energia minima con obiettivo di dimagrimento
+MIN_ENERGY = {"F": 1200, "M": 1500}
+
+# Intervalli di riferimento LARN per i macronutrienti (quota dell'energia)
+CARBOHYDRATE_RANGE = (0.45, 0.60)
+FAT_RANGE = (0.20, 0.35)
+SATURATED_FAT_MAX = 0.10
+SUGARS_MAX = 0.15
+FIBER_PER_1000_KCAL = 12.6
+FIBER_MIN_G = 25
+
+
+def _bmr(sex: str, age: int, weight: float) -> float:
+    for max_age, coefficient, constant in BMR_EQUATIONS[sex]:
+        if age < max_age:
+            return coefficient * weight + constant
+    return BMR_EQUATIONS[sex][-1][1] * weight + BMR_EQUATIONS[sex][-1][2]
+
+
+def _micronutrients(sex: str, age: int, pregnancy: bool) -> Dict[str, str]:
+    """
+    Assunzioni raccomandate (PRI) o adeguate (AI) LARN per adulti
+    """
+    female = sex == "F"
+    return {
+        "calcio": "1200 mg" if age >= 60 or (female and age >= 50) else "1000 mg",
+        "ferro": "27 mg" if pregnancy else ("18 mg" if female and age < 50 else "10 mg"),
+        "vitamina D": "20 µg" if age >= 75 else "15 µg",
+        "folati": "600 µg" if pregnancy else "400 µg",
+        "vitamina B12": "2,6 µg" if pregnancy else "2,4 µg",
+        "vitamina C": "85 mg" if female else "105 mg",
+        "sodio": "max 1,5 g (sale max 5 g)",
+        "potassio": "3,9 g",
+        "acqua": "2,0 L" if female else "2,5 L",
+    }
+
+
+def compute_energy_targets(attributes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Calcola in modo deterministico metabolismo basale, dispendio energetico
+    e obiettivi di macro e micronutrienti secondo i LARN
+
+    Args:
+        attributes: Gli attributi del profilo (vedi diet_profile.extract_profile_attributes)
+
+    Returns:
+        Gli obiettivi, oppure None se mancano sesso, età o peso o se l'utente
+        è minorenne (per cui servono i fabbisogni specifici per età)
+    """
+    sex, age, weight = attributes.get("sex"), attributes.get("age"), attributes.get("weight")
+    if sex is None or age is None or weight is None or age < 18:
+        return None
+
+    assumptions: List[str] = []
+    activity = attributes.get("activity")
+    if activity is None:
+        activity = DEFAULT_ACTIVITY
+        assumptions.append("livello di attività non indicato: considerato poco attivo")
+    pregnancy = "pregnancy" in attributes.get("restrictions", [])
+
+    bmr = _bmr(sex, age, weight)
+    pal = PAL_LEVELS[activity]
+    tdee = bmr * pal
+
+    goal = attributes.get("goal") or "maintain"
+    if pregnancy and goal == "lose":
+        # In gravidanza o allattamento non si imposta un deficit calorico
+        goal = "maintain"
+        assumptions.append("gravidanza/allattamento: nessun deficit calorico, fabbisogno da concordare con il medico")
+    target = tdee * (1 + GOAL_ADJUSTMENTS[goal])
+    if goal == "lose":
+        target = max(target, MIN_ENERGY[sex])
+    target = round(target / 10) * 10
+
+    # Proteine: PRI LARN 0,9 g/kg (1,1 dai 60 anni), più alte per aumentare la massa
+    protein_per_kg = 1.1 if age >= 60 else 0.9
+    if goal == "gain":
+        protein_per_kg = 1.4
+
+    targets: Dict[str, Any] = {
+        "bmr_kcal": round(bmr),
+        "pal": pal,
+        "tdee_kcal": round(tdee),
+        "goal": goal,
+        "target_kcal": target,
+        "protein_g": round(protein_per_kg * weight),
+        "carbohydrate_g": [round(target * share / 4) for share in CARBOHYDRATE_RANGE],
+        "fat_g": [round(target * share / 9) for share in FAT_RANGE],
+        "saturated_fat_g_max": round(target * SATURATED_FAT_MAX / 9),
+        "sugars_g_max": round(target * SUGARS_MAX / 4),
+        "fiber_g": max(FIBER_MIN_G, round(target / 1000 * FIBER_PER_1000_KCAL)),
+        "micronutrients": _micronutrients(sex, age, pregnancy),
+        "assumptions": assumptions,
+    }
+    height = attributes.get("height")
+    if height:
+        targets["bmi"] = round(weight / (height / 100) ** 2, 1)
+    return targets
+
+
+def format_targets_block(targets: Dict[str, Any]) -> str:
+    """
+    Blocco compatto con gli obiettivi numerici, da inserire nel prompt
+
+    Args:
+        targets: Gli obiettivi calcolati da compute_energy_targets
+
+    Returns:
+        Il testo del blocco
+    """
+    lines = [
+        "Obiettivi nutrizionali calcolati (LARN), da rispettare nella media giornaliera:",
+        f"- Energia: {targets['target_kcal']} kcal/giorno "
+        f"(metabolismo basale {targets['bmr_kcal']} kcal, PAL {targets['pal']}, dispendio {targets['tdee_kcal']} kcal)",
+        f"- Proteine: {targets['protein_g']} g; carboidrati: {targets['carbohydrate_g'][0]}-{targets['carbohydrate_g'][1]} g "
+        f"(zuccheri max {targets['sugars_g_max']} g); grassi: {targets['fat_g'][0]}-{targets['fat_g'][1]} g "
+        f"(saturi max {targets['saturated_fat_g_max']} g); fibra: almeno {targets['fiber_g']} g",
+        "- Micronutrienti: " + ", ".join(f"{name} {value}" for name, value in targets["micronutrients"].items()),
+    ]
+    if "bmi" in targets:
+        lines.append(f"- IMC attuale: {targets['bmi']}")
+    for assumption in targets["assumptions"]:
+        lines.append(f"- Nota: {assumption}")
+    return "\n".join(lines)
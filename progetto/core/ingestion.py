@@ -0,0 +1,487 @@
+from typing import Dict, List, Any, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from llama_index.core import Document, SimpleDirectoryReader, VectorStoreIndex, load_index_from_storage
+from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.schema import MetadataMode, TextNode
+
+from app.config import settings
+from app.core.lexical_index import BM25Index, LEXICAL_INDEX_FILE
+from app.db.vectorstore import create_storage_context, export_nodes, remove_backend_files
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# File e directory gestiti accanto al vectorstore
+MANIFEST_FILE = "manifest.json"
+PARSED_CACHE_DIR = "parsed"
+
+# Estensioni dei documenti indicizzati
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+MANIFEST_VERSION = 1
+
+
+def list_document_files(documents_dir: Path) -> List[Path]:
+    """
+    Elenca i documenti indicizzabili nella directory dei documenti
+
+    Args:
+        documents_dir: La directory dei documenti
+
+    Returns:
+        La lista ordinata dei percorsi dei documenti
+    """
+    if not os.path.exists(documents_dir):
+        return []
+    return sorted(
+        path for path in Path(documents_dir).iterdir()
+        if path.is_file() and not path.name.startswith(".")
+        and path.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Calcola l'hash SHA-256 del contenuto di un file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(storage_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Carica il manifest dell'indice, se presente
+
+    Args:
+        storage_path: Percorso del vectorstore
+
+    Returns:
+        Il manifest, oppure None se non esiste o non è leggibile
+    """
+    manifest_path = Path(storage_path) / MANIFEST_FILE
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest
+    except Exception as e:
+        logger.error(f"Errore nel caricamento del manifest dell'indice: {e}")
+        return None
+
+
+def save_manifest(storage_path: Path, manifest: Dict[str, Any]) -> None:
+    """
+    Salva il manifest dell'indice in modo atomico
+
+    Args:
+        storage_path: Percorso del vectorstore
+        manifest: Il manifest da salvare
+    """
+    manifest_path = Path(storage_path) / MANIFEST_FILE
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, manifest_path)
+
+
+def new_manifest(chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+    """
+    Crea un manifest vuoto per le impostazioni di chunking indicate
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "vector_store": settings.VECTOR_STORE_BACKEND,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "files": {},
+    }
+
+
+def new_index(storage_path: Path) -> VectorStoreIndex:
+    """
+    Crea un indice vuoto con il backend del vectorstore configurato
+
+    Args:
+        storage_path: Percorso del vectorstore
+
+    Returns:
+        L'indice vuoto, da popolare con sync_index o apply_changes
+    """
+    os.makedirs(storage_path, exist_ok=True)
+
+    # L'indice lessicale viene ricreato insieme a quello vettoriale
+    lexical_path = Path(storage_path) / LEXICAL_INDEX_FILE
+    if os.path.exists(lexical_path):
+        os.remove(lexical_path)
+
+    return VectorStoreIndex([], storage_context=create_storage_context(storage_path, load=False))
+
+
+def load_lexical_index(storage_path: Path) -> Optional[BM25Index]:
+    """
+    Carica l'indice lessicale BM25 salvato accanto al vectorstore
+
+    Args:
+        storage_path: Percorso del vectorstore
+
+    Returns:
+        L'indice lessicale, oppure None se non esiste
+    """
+    return BM25Index.load(Path(storage_path) / LEXICAL_INDEX_FILE, k1=settings.BM25_K1, b=settings.BM25_B)
+
+
+def _update_lexical_index(storage_path: Path, to_insert: List[TextNode], to_delete: List[str]) -> None:
+    """
+    Applica all'indice lessicale le stesse modifiche dell'indice vettoriale
+    """
+    lexical = load_lexical_index(storage_path) or BM25Index(k1=settings.BM25_K1, b=settings.BM25_B)
+    for node_id in to_delete:
+        lexical.remove(node_id)
+    for node in to_insert:
+        lexical.add(node.node_id, node.get_content())
+    lexical.save(Path(storage_path) / LEXICAL_INDEX_FILE)
+
+
+def _build_lexical_index(index: VectorStoreIndex, storage_path: Path, manifest: Dict[str, Any]) -> None:
+    """
+    Costruisce l'indice lessicale dai chunk già presenti nell'indice vettoriale
+    (indici creati prima dell'introduzione del recupero ibrido)
+    """
+    node_ids = [node_id for entry in manifest["files"].values() for node_id in entry["chunks"]]
+    lexical = BM25Index(k1=settings.BM25_K1, b=settings.BM25_B)
+    for start in range(0, len(node_ids), 1000):
+        for node in export_nodes(index, node_ids[start:start + 1000]):
+            lexical.add(node.node_id, node.get_content())
+    lexical.save(Path(storage_path) / LEXICAL_INDEX_FILE)
+    logger.info(f"Indice lessicale creato ({lexical.num_docs} chunk)")
+
+
+def load_index(storage_path: Path, manifest: Dict[str, Any]) -> VectorStoreIndex:
+    """
+    Carica l'indice salvato. Se è stato creato con un backend del vectorstore
+    diverso da quello configurato, viene convertito copiando gli embedding
+    esistenti, senza ricalcolarli.
+
+    Args:
+        storage_path: Percorso del vectorstore
+        manifest: Il manifest dell'indice salvato (aggiornato in caso di conversione)
+
+    Returns:
+        L'indice caricato
+    """
+    # I manifest precedenti all'introduzione del backend memmap usano il backend JSON
+    backend = manifest.get("vector_store", "simple")
+    index = load_index_from_storage(create_storage_context(storage_path, backend=backend))
+
+    if not os.path.exists(Path(storage_path) / LEXICAL_INDEX_FILE):
+        _build_lexical_index(index, storage_path, manifest)
+
+    if backend == settings.VECTOR_STORE_BACKEND:
+        return index
+
+    logger.info(f"Conversione del vectorstore da {backend} a {settings.VECTOR_STORE_BACKEND}")
+    node_ids = [node_id for entry in manifest["files"].values() for node_id in entry["chunks"]]
+    nodes = export_nodes(index, node_ids)
+
+    # Gli ID dei chunk non cambiano: l'indice lessicale resta valido
+    converted = VectorStoreIndex([], storage_context=create_storage_context(storage_path, load=False))
+    converted.insert_nodes(nodes)
+    converted.storage_context.persist(persist_dir=str(storage_path))
+    remove_backend_files(storage_path, backend)
+
+    manifest["vector_store"] = settings.VECTOR_STORE_BACKEND
+    save_manifest(storage_path, manifest)
+    logger.info(f"Vectorstore convertito ({len(nodes)} chunk)")
+    return converted
+
+
+def parse_document(path: Path, file_hash: str, storage_path: Path) -> List[Document]:
+    """
+    Estrae il testo di un documento, usando la cache del testo già estratto.
+    La cache è indicizzata per hash del contenuto, quindi un cambio delle
+    impostazioni di chunking non richiede di rileggere i PDF.
+
+    Args:
+        path: Il percorso del documento
+        file_hash: L'hash del contenuto del documento
+        storage_path: Percorso del vectorstore
+
+    Returns:
+        La lista dei documenti (es. una pagina per documento nei PDF)
+    """
+    cache_dir = Path(storage_path) / PARSED_CACHE_DIR
+    cache_path = cache_dir / f"{file_hash}.json"
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            pages = json.load(f)
+    else:
+        documents = SimpleDirectoryReader(input_files=[str(path)]).load_data()
+        pages = [{"text": doc.text, "metadata": doc.metadata} for doc in documents]
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pages, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, cache_path)
+
+    rel_path = path.name
+    documents = []
+    for i, page in enumerate(pages):
+        metadata = {**page["metadata"], "file_name": rel_path}
+        documents.append(Document(
+            text=page["text"],
+            metadata=metadata,
+            id_=f"{rel_path}#{i}",
+            excluded_embed_metadata_keys=[
+                "file_name", "file_path", "file_type", "file_size",
+                "creation_date", "last_modified_date", "last_accessed_date"
+            ],
+            excluded_llm_metadata_keys=[
+                "file_path", "file_type", "file_size",
+                "creation_date", "last_modified_date", "last_accessed_date"
+            ],
+        ))
+    return documents
+
+
+def chunk_documents(documents: List[Document], rel_path: str, node_parser: SimpleNodeParser) -> List[TextNode]:
+    """
+    Divide i documenti in chunk con ID deterministici: lo stesso testo nello
+    stesso file produce sempre lo stesso ID, così i chunk invariati non
+    vengono ricalcolati
+
+    Args:
+        documents: I documenti estratti da un file
+        rel_path: Il nome del file di origine
+        node_parser: Il parser che divide il testo in chunk
+
+    Returns:
+        La lista dei chunk con l'hash del contenuto in metadata["chunk_hash"]
+    """
+    nodes = node_parser.get_nodes_from_documents(documents)
+    occurrences: Dict[str, int] = {}
+
+    for node in nodes:
+        # L'hash copre esattamente il testo che viene inviato al modello di embedding
+        chunk_hash = hashlib.sha256(node.get_content(metadata_mode=MetadataMode.EMBED).encode("utf-8")).hexdigest()
+        occurrence = occurrences.get(chunk_hash, 0)
+        occurrences[chunk_hash] = occurrence + 1
+
+        node.id_ = hashlib.sha1(f"{rel_path}:{chunk_hash}:{occurrence}".encode("utf-8")).hexdigest()
+        node.metadata["chunk_hash"] = chunk_hash
+        node.excluded_embed_metadata_keys = list(set(node.excluded_embed_metadata_keys) | {"chunk_hash"})
+        node.excluded_llm_metadata_keys = list(set(node.excluded_llm_metadata_keys) | {"chunk_hash"})
+
+    return nodes
+
+
+def plan_file_changes(
+    documents_dir: Path,
+    manifest: Dict[str, Any],
+    chunk_size: int,
+    chunk_overlap: int
+) -> Tuple[Dict[str, Tuple[Path, str]], List[str]]:
+    """
+    Confronta la directory dei documenti con il manifest
+
+    Args:
+        documents_dir: La directory dei documenti
+        manifest: Il manifest dell'indice attuale
+        chunk_size: Dimensione dei chunk richiesta
+        chunk_overlap: Sovrapposizione dei chunk richiesta
+
+    Returns:
+        Una tupla con i file da (ri)elaborare {nome: (percorso, hash)}
+        e l'elenco dei file eliminati
+    """
+    settings_changed = (
+        manifest.get("chunk_size") != chunk_size or manifest.get("chunk_overlap") != chunk_overlap
+    )
+
+    changed: Dict[str, Tuple[Path, str]] = {}
+    present = set()
+    for path in list_document_files(documents_dir):
+        rel_path = path.name
+        present.add(rel_path)
+        file_hash = file_sha256(path)
+        known = manifest["files"].get(rel_path)
+        if settings_changed or known is None or known["hash"] != file_hash:
+            changed[rel_path] = (path, file_hash)
+
+    removed = [rel_path for rel_path in manifest["files"] if rel_path not in present]
+    return changed, removed
+
+
+def new_nodes_for_file(manifest: Dict[str, Any], rel_path: str, nodes: List[TextNode]) -> List[TextNode]:
+    """
+    Restituisce i chunk di un file che non sono ancora presenti nell'indice
+
+    Args:
+        manifest: Il manifest dell'indice attuale
+        rel_path: Il nome del file
+        nodes: I chunk attuali del file
+
+    Returns:
+        I soli chunk di cui va calcolato l'embedding
+    """
+    old_chunks = manifest["files"].get(rel_path, {}).get("chunks", {})
+    return [node for node in nodes if node.id_ not in old_chunks]
+
+
+def prune_parsed_cache(storage_path: Path, manifest: Dict[str, Any]) -> int:
+    """
+    Elimina il testo estratto dei documenti il cui hash non è più nel manifest
+    (documenti modificati o eliminati)
+
+    Args:
+        storage_path: Percorso del vectorstore
+        manifest: Il manifest aggiornato
+
+    Returns:
+        Il numero di file eliminati
+    """
+    cache_dir = Path(storage_path) / PARSED_CACHE_DIR
+    if not cache_dir.is_dir():
+        return 0
+    known = {entry["hash"] for entry in manifest["files"].values()}
+    removed = 0
+    for cache_path in cache_dir.glob("*.json"):
+        if cache_path.stem in known:
+            continue
+        try:
+            cache_path.unlink()
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Impossibile eliminare il testo estratto {cache_path.name}: {e}")
+    return removed
+
+
+def apply_changes(
+    index: VectorStoreIndex,
+    storage_path: Path,
+    manifest: Dict[str, Any],
+    file_nodes: Dict[str, Tuple[str, List[TextNode]]],
+    removed: List[str]
+) -> Dict[str, int]:
+    """
+    Applica all'indice i chunk dei file elaborati e la rimozione dei file
+    eliminati, poi salva indice e manifest ed elimina il testo estratto non
+    più referenziato. I chunk che hanno già un embedding (es. calcolato dalla
+    CLI di ingestion) non vengono ricalcolati.
+
+    Args:
+        index: L'indice vettoriale da aggiornare
+        storage_path: Percorso del vectorstore
+        manifest: Il manifest corrente (viene aggiornato)
+        file_nodes: I chunk dei file nuovi o modificati {nome: (hash, chunk)}
+        removed: I nomi dei file eliminati
+
+    Returns:
+        Il numero di chunk aggiunti e rimossi
+    """
+    to_delete: List[str] = []
+    to_insert: List[TextNode] = []
+
+    for rel_path in removed:
+        to_delete.extend(manifest["files"][rel_path]["chunks"].keys())
+        del manifest["files"][rel_path]
+
+    for rel_path, (file_hash, nodes) in file_nodes.items():
+        old_chunks = manifest["files"].get(rel_path, {}).get("chunks", {})
+        new_chunks = {node.id_: node.metadata["chunk_hash"] for node in nodes}
+
+        to_delete.extend(node_id for node_id in old_chunks if node_id not in new_chunks)
+        to_insert.extend(new_nodes_for_file(manifest, rel_path, nodes))
+
+        manifest["files"][rel_path] = {"hash": file_hash, "chunks": new_chunks}
+
+    if to_delete:
+        index.delete_nodes(to_delete, delete_from_docstore=True)
+        for node_id in to_delete:
+            if node_id in index.index_struct.nodes_dict:
+                index.index_struct.delete(node_id)
+        index.storage_context.index_store.add_index_struct(index.index_struct)
+
+    if to_insert:
+        # Solo i chunk nuovi vengono inviati al modello di embedding
+        index.insert_nodes(to_insert)
+
+    _update_lexical_index(storage_path, to_insert, to_delete)
+
+    manifest["vector_store"] = settings.VECTOR_STORE_BACKEND
+    manifest["chunk_size"] = settings.CHUNK_SIZE
+    manifest["chunk_overlap"] = settings.CHUNK_OVERLAP
+
+    index.storage_context.persist(persist_dir=str(storage_path))
+    save_manifest(storage_path, manifest)
+    parsed_removed = prune_parsed_cache(storage_path, manifest)
+
+    return {"chunks_added": len(to_insert), "chunks_removed": len(to_delete), "parsed_removed": parsed_removed}
+
+
+def sync_index(
+    index: VectorStoreIndex,
+    storage_path: Path,
+    documents_dir: Optional[Path] = None,
+    manifest: Optional[Dict[str, Any]] = None
+) -> Dict[str, int]:
+    """
+    Allinea l'indice al contenuto della directory dei documenti.
+    Vengono elaborati solo i file nuovi o modificati, e di questi vengono
+    calcolati gli embedding solo dei chunk nuovi; i chunk dei file eliminati
+    o non più presenti vengono rimossi dall'indice.
+
+    Args:
+        index: L'indice vettoriale da aggiornare
+        storage_path: Percorso del vectorstore (per manifest e cache)
+        documents_dir: La directory dei documenti (default: DOCUMENTS_DIR)
+        manifest: Il manifest corrente (default: quello salvato su disco)
+
+    Returns:
+        Statistiche dell'aggiornamento (file elaborati, chunk aggiunti e rimossi)
+    """
+    documents_dir = documents_dir or settings.DOCUMENTS_DIR
+    chunk_size, chunk_overlap = settings.CHUNK_SIZE, settings.CHUNK_OVERLAP
+
+    if manifest is None:
+        manifest = load_manifest(storage_path) or new_manifest(chunk_size, chunk_overlap)
+
+    changed, removed = plan_file_changes(documents_dir, manifest, chunk_size, chunk_overlap)
+    stats = {
+        "files_changed": len(changed), "files_removed": len(removed),
+        "chunks_added": 0, "chunks_removed": 0, "parsed_removed": 0
+    }
+
+    if not changed and not removed:
+        logger.info("Indice già allineato ai documenti")
+        stats["parsed_removed"] = prune_parsed_cache(storage_path, manifest)
+        return stats
+
+    node_parser = SimpleNodeParser.from_defaults(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    file_nodes: Dict[str, Tuple[str, List[TextNode]]] = {}
+
+    for rel_path, (path, file_hash) in changed.items():
+        try:
+            documents = parse_document(path, file_hash, storage_path)
+            nodes = chunk_documents(documents, rel_path, node_parser)
+        except Exception as e:
+            logger.error(f"Errore nell'elaborazione del documento {rel_path}: {e}")
+            continue
+
+        file_nodes[rel_path] = (file_hash, nodes)
+        logger.info(f"Documento {rel_path}: {len(nodes)} chunk, {len(new_nodes_for_file(manifest, rel_path, nodes))} nuovi")
+
+    stats.update(apply_changes(index, storage_path, manifest, file_nodes, removed))
+    logger.info(f"Indice aggiornato: {stats}")
+    return stats
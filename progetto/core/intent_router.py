@@ -0,0 +1,273 @@
+from typing import Dict, Any, Optional
+import asyncio
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.core.answer_cache import get_answer_cache, generation_variant, normalize_query
+from app.core.diet_profile import extract_profile_attributes
+from app.core.rag_engine import aembed_query, get_index_version
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Percorsi dei messaggi della chat, dal più economico al più costoso
+ROUTE_CANNED = "canned"  # Risposta predefinita (saluti, ringraziamenti, aiuto), senza modello
+ROUTE_CACHED = "cached"  # Risposta già generata per la stessa domanda
+ROUTE_RETRIEVAL = "retrieval"  # Estratti dei documenti, senza modello
+ROUTE_QA = "qa"  # Risposta breve del modello con il contesto recuperato
+ROUTE_DIET = "diet"  # Generazione completa di una dieta
+ROUTES = (ROUTE_CANNED, ROUTE_CACHED, ROUTE_RETRIEVAL, ROUTE_QA, ROUTE_DIET)
+
+CANNED_ANSWERS = {
+    "greeting": "Ciao! Sono il tuo assistente nutrizionale. Puoi farmi domande sull'alimentazione "
+                "oppure descrivermi età, sesso, peso, attività e obiettivo per ricevere una dieta personalizzata.",
+    "thanks": "Prego! Se hai altre domande sull'alimentazione sono qui.",
+    "goodbye": "A presto! Buona alimentazione.",
+    "ack": "Bene! Dimmi pure se vuoi approfondire qualcosa o ricevere una dieta personalizzata.",
+    "help": "Posso rispondere a domande su alimenti, nutrienti e fabbisogni secondo le linee guida italiane "
+            "(LARN, INRAN, CREA), riportare i passaggi dei documenti di riferimento e creare una dieta settimanale. "
+            "Per la dieta indicami sesso, età, peso, altezza, livello di attività, obiettivo ed eventuali restrizioni.",
+}
+
+# Primo livello: espressioni compilate una sola volta, applicate al testo normalizzato
+# (minuscole, senza accenti né punteggiatura). I messaggi brevi di cortesia devono
+# corrispondere per intero, le altre regole segnalano la presenza di indizi
+_CANNED_RE = re.compile(
+    r"^(?:"
+    r"(?P<greeting>(?:ciao|salve|buongiorno|buonasera|buon pomeriggio|hey|ehi|hello|hi)(?: nutribot| a tutti)?(?: come stai)?)"
+    r"|(?P<thanks>(?:ok |perfetto |ottimo )?(?:grazie(?: mille| tante| davvero| ancora)?|ti ringrazio))"
+    r"|(?P<goodbye>arrivederci|a presto|ciao ciao|alla prossima|buona (?:giornata|serata|notte))"
+    r"|(?P<ack>ok|okay|va bene|d accordo|perfetto|ottimo|capito)"
+    r"|(?P<help>aiuto|help|chi sei|(?:che )?cosa (?:sai|puoi) fare|come funzioni|come mi puoi aiutare)"
+    r")$"
+)
+
+_CUE_RE = re.compile(
+    r"\b(?:"
+    r"(?P<diet>diet[ae]|piano (?:alimentare|dietetico|nutrizionale)|regime alimentare|menu settimanale|schema alimentare)"
+    r"|(?P<request>crea\w*|fammi|fai|prepar\w*|genera\w*|elabora\w*|vorrei|voglio|mi serve|ho bisogno|consiglia\w*|proponi\w*|organizza\w*)"
+    r"|(?P<goal>dimagr\w*|perdere (?:\w+ )?(?:peso|chili|kg)|ingrassare|massa muscolare|(?:aumentare|prendere) (?:di )?peso)"
+    r"|(?P<retrieval>cosa dicono|cosa riportano|estratt\w*|passaggi|citazion\w*|testo (?:originale|dei larn|delle linee guida)|mostrami le fonti)"
+    r"|(?P<question>cosa|che|quant[oaie]|qual[ei]?|come|perche|posso|puo|e vero|meglio|dove|quando)"
+    r"|(?P<topic>calori\w*|protein\w*|carboidrat\w*|grass\w*|vitamin\w*|ferro|calcio|fibr\w*|zucch\w*|sale|sodio"
+    r"|aliment\w*|cib[oi]|mangi\w*|past[oi]|colazione|pranzo|cena|spuntin\w*|nutri\w*|integrator\w*|acqua|frutta"
+    r"|verdur\w*|legum\w*|carne|pesce|latt\w*|uova|pane|pasta|riso|olio|larn|linee guida)"
+    r")\b"
+)
+
+# Secondo livello: frasi prototipo di ogni percorso (percorso, tipo di risposta predefinita, testo)
+PROTOTYPES = [
+    (ROUTE_DIET, None, "Vorrei una dieta per perdere peso"),
+    (ROUTE_DIET, None, "Sono una donna di 35 anni, peso 70 kg e vorrei dimagrire"),
+    (ROUTE_DIET, None, "Preparami un piano alimentare settimanale"),
+    (ROUTE_DIET, None, "Sono un uomo sportivo e voglio aumentare la massa muscolare"),
+    (ROUTE_DIET, None, "Cosa dovrei mangiare ogni giorno per raggiungere il mio peso ideale?"),
+    (ROUTE_QA, None, "Quante proteine servono al giorno?"),
+    (ROUTE_QA, None, "La frutta la sera fa ingrassare?"),
+    (ROUTE_QA, None, "Quali alimenti sono ricchi di ferro?"),
+    (ROUTE_QA, None, "È meglio la pasta integrale o quella raffinata?"),
+    (ROUTE_QA, None, "Quanta acqua bisogna bere ogni giorno?"),
+    (ROUTE_RETRIEVAL, None, "Cosa dicono i LARN sul calcio?"),
+    (ROUTE_RETRIEVAL, None, "Mostrami il testo delle linee guida sul consumo di sale"),
+    (ROUTE_RETRIEVAL, None, "Riportami i passaggi dei documenti sulla fibra alimentare"),
+    (ROUTE_CANNED, "greeting", "Ciao, come va?"),
+    (ROUTE_CANNED, "thanks", "Grazie mille per l'aiuto"),
+    (ROUTE_CANNED, "help", "Cosa sai fare?"),
+    (ROUTE_CANNED, "goodbye", "Arrivederci, alla prossima"),
+]
+
+# Oltre questa lunghezza un messaggio non riceve mai una risposta predefinita
+_CANNED_MAX_WORDS = 6
+
+# Embedding normalizzati delle frasi prototipo (calcolati al primo utilizzo)
+_prototype_matrix: Optional[np.ndarray] = None
+_prototype_lock: Optional[asyncio.Lock] = None
+
+# Statistiche delle decisioni
+_router_stats = {
+    "decisions": 0,
+    "by_route": {route: 0 for route in ROUTES},
+    "by_tier": {"keywords": 0, "embeddings": 0, "fallback": 0},
+    "total_latency_ms": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def route_options(route: str) -> Dict[str, Any]:
+    """
+    Modello e token massimi generati per un percorso (None se il percorso non usa il modello)
+    """
+    if route == ROUTE_DIET:
+        return {"model": settings.ROUTER_DIET_MODEL or settings.CHAT_MODEL, "max_tokens": settings.ROUTER_DIET_MAX_TOKENS}
+    if route == ROUTE_QA:
+        return {"model": settings.ROUTER_QA_MODEL or settings.CHAT_MODEL, "max_tokens": settings.ROUTER_QA_MAX_TOKENS}
+    return {"model": None, "max_tokens": None}
+
+
+def classify_keywords(message: str) -> Optional[Dict[str, Any]]:
+    """
+    Primo livello: classificazione con le espressioni compilate, senza chiamate esterne
+
+    Args:
+        message: Il testo del messaggio
+
+    Returns:
+        Il percorso ("route"), il tipo di risposta predefinita ("kind") e il motivo
+        ("reason"), oppure None se gli indizi non bastano a decidere
+    """
+    text = normalize_query(message)
+    canned = _CANNED_RE.match(text)
+    if canned is not None:
+        return {"route": ROUTE_CANNED, "kind": canned.lastgroup, "reason": f"cortesia:{canned.lastgroup}"}
+
+    cues = {match.lastgroup for match in _CUE_RE.finditer(text)}
+    if "diet" in cues or "goal" in cues:
+        attributes = extract_profile_attributes(message)
+        has_profile = attributes["sex"] is not None and (attributes["age"] is not None or attributes["weight"] is not None)
+        if "diet" in cues and ("request" in cues or has_profile):
+            return {"route": ROUTE_DIET, "kind": None, "reason": "richiesta di dieta"}
+        if "goal" in cues and has_profile:
+            return {"route": ROUTE_DIET, "kind": None, "reason": "obiettivo con profilo"}
+        # Es. "la dieta mediterranea fa bene?": ambigua, decide il secondo livello
+        return None
+
+    if "retrieval" in cues:
+        return {"route": ROUTE_RETRIEVAL, "kind": None, "reason": "richiesta dei documenti"}
+    if "topic" in cues and ("question" in cues or message.rstrip().endswith("?")):
+        return {"route": ROUTE_QA, "kind": None, "reason": "domanda nutrizionale"}
+    return None
+
+
+async def _get_prototype_matrix() -> np.ndarray:
+    """
+    Calcola una sola volta gli embedding delle frasi prototipo (passano anche
+    dalla cache degli embedding, quindi sopravvivono ai riavvii se è su disco)
+    """
+    global _prototype_matrix, _prototype_lock
+
+    if _prototype_matrix is not None:
+        return _prototype_matrix
+
+    if _prototype_lock is None:
+        _prototype_lock = asyncio.Lock()
+    async with _prototype_lock:
+        if _prototype_matrix is None:
+            vectors = await asyncio.gather(*(aembed_query(text) for _, _, text in PROTOTYPES))
+            matrix = np.asarray(vectors, dtype=np.float32)
+            _prototype_matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    return _prototype_matrix
+
+
+async def classify_embeddings(message: str) -> Optional[Dict[str, Any]]:
+    """
+    Secondo livello: similarità coseno tra il messaggio e le frasi prototipo.
+    L'embedding del messaggio resta nella cache e viene riutilizzato dal recupero
+
+    Args:
+        message: Il testo del messaggio
+
+    Returns:
+        Il percorso del prototipo più simile, oppure None sotto ROUTER_MIN_SIMILARITY
+    """
+    matrix = await _get_prototype_matrix()
+    vector = np.asarray(await aembed_query(message), dtype=np.float32)
+    similarities = matrix @ (vector / np.linalg.norm(vector))
+
+    if len(message.split()) > _CANNED_MAX_WORDS:
+        similarities[[i for i, (route, _, _) in enumerate(PROTOTYPES) if route == ROUTE_CANNED]] = -1.0
+
+    best = int(np.argmax(similarities))
+    if similarities[best] < settings.ROUTER_MIN_SIMILARITY:
+        return None
+    route, kind, text = PROTOTYPES[best]
+    return {"route": route, "kind": kind, "reason": f"simile a '{text}' ({similarities[best]:.2f})"}
+
+
+def _fallback(message: str) -> Dict[str, Any]:
+    """
+    Percorso predefinito quando i due livelli non decidono
+    """
+    cues = {match.lastgroup for match in _CUE_RE.finditer(normalize_query(message))}
+    if cues & {"diet", "goal"} and len(message.split()) >= 10:
+        return {"route": ROUTE_DIET, "kind": None, "reason": "predefinito (messaggio lungo sulla dieta)"}
+    return {"route": ROUTE_QA, "kind": None, "reason": "predefinito"}
+
+
+def _record(decision: Dict[str, Any]) -> None:
+    with _stats_lock:
+        _router_stats["decisions"] += 1
+        _router_stats["by_route"][decision["route"]] += 1
+        _router_stats["by_tier"][decision["tier"]] += 1
+        _router_stats["total_latency_ms"] += decision["latency_ms"]
+
+
+async def route_message(message: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Sceglie il percorso di un messaggio della chat: parole chiave, poi
+    risposta già in cache, poi similarità con le frasi prototipo
+
+    Args:
+        message: Il testo del messaggio
+        use_cache: Se servire le domande già viste dalla cache delle risposte
+            (no quando la risposta dipende dalla conversazione precedente)
+
+    Returns:
+        La decisione: percorso, livello che l'ha presa, motivo, latenza in ms,
+        modello e token massimi del percorso ("answer" per le risposte in cache)
+    """
+    started_at = time.perf_counter()
+    tier = "keywords"
+    decision = classify_keywords(message)
+
+    if decision is None or decision["route"] == ROUTE_QA:
+        # Una domanda già vista si serve dalla cache, senza recupero né modello,
+        # se la risposta è stata generata con modello e token del percorso delle domande.
+        # Un miss non viene contato qui: lo registra la ricerca completa della risposta
+        if settings.ANSWER_CACHE_ENABLED and use_cache:
+            options = route_options(ROUTE_QA)
+            cached = get_answer_cache().get_exact(
+                message, get_index_version(), generation_variant(options["model"], options["max_tokens"])
+            )
+            if cached is not None:
+                decision = {"route": ROUTE_CACHED, "kind": None, "reason": "risposta in cache", "answer": cached}
+
+    if decision is None and settings.ROUTER_EMBEDDING_ENABLED:
+        tier = "embeddings"
+        try:
+            decision = await classify_embeddings(message)
+        except Exception as e:
+            logger.warning(f"Instradamento per similarità non disponibile: {e}")
+
+    if decision is None:
+        tier = "fallback"
+        decision = _fallback(message)
+
+    decision.update(route_options(decision["route"]))
+    decision["tier"] = tier
+    decision["latency_ms"] = round((time.perf_counter() - started_at) * 1000, 2)
+    _record(decision)
+    logger.info(
+        f"Instradamento: {decision['route']} (livello {tier}, {decision['reason']}) "
+        f"in {decision['latency_ms']} ms"
+    )
+    return decision
+
+
+def get_router_stats() -> Dict[str, Any]:
+    """
+    Restituisce le statistiche cumulative dell'instradamento
+    """
+    with _stats_lock:
+        stats = {
+            "decisions": _router_stats["decisions"],
+            "by_route": dict(_router_stats["by_route"]),
+            "by_tier": dict(_router_stats["by_tier"]),
+        }
+        total_latency = _router_stats["total_latency_ms"]
+    stats["avg_latency_ms"] = round(total_latency / stats["decisions"], 2) if stats["decisions"] else 0.0
+    return stats
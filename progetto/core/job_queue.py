@@ -0,0 +1,287 @@
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import socket
+import time
+
+from app.config import settings
+from app.core.diet_generator import generate_diet_plan
+from app.core.warmup import wait_until_ready
+from app.db.job_repository import QUEUED, RUNNING, DONE, FAILED, get_job_store
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+
+async def _run_diet_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Genera la dieta di un job; il risultato ha la forma di DietResponse
+    """
+    user_profile = payload["user_profile"]
+    diet_result = await generate_diet_plan(user_profile)
+    return {
+        "user_profile": user_profile,
+        "diet_plan": diet_result["diet_plan"],
+        "plan_id": diet_result.get("plan_id"),
+        "plan": diet_result.get("plan"),
+        "energy_targets": diet_result.get("energy_targets"),
+        "sources": diet_result.get("sources", []),
+        "success": True,
+        "message": "Dieta generata con successo"
+    }
+
+
+# Gestori dei job per tipo
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+    "diet": _run_diet_job,
+}
+
+# Worker attivi in questo processo
+_workers: List[asyncio.Task] = []
+_stopping = False
+# Risveglia i worker in attesa quando un job viene accodato da questo processo
+_wakeup: Optional[asyncio.Event] = None
+# Segnala a chi osserva un job che lo stato di un job è cambiato in questo processo
+_changed: Optional[asyncio.Event] = None
+
+# Tempi degli ultimi job conclusi in questo processo
+_processing_ms: "collections.deque[float]" = collections.deque(maxlen=500)
+_waiting_ms: "collections.deque[float]" = collections.deque(maxlen=500)
+_job_stats = {"completed": 0, "failed": 0, "released": 0}
+
+
+def _wakeup_event() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+def _changed_event() -> asyncio.Event:
+    global _changed
+    if _changed is None:
+        _changed = asyncio.Event()
+    return _changed
+
+
+def _notify_change() -> None:
+    # Ogni notifica sostituisce l'evento, così chi attende viene svegliato una volta sola
+    global _changed
+    event, _changed = _changed_event(), asyncio.Event()
+    event.set()
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def submit_job(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Accoda un job e risveglia i worker del processo
+
+    Args:
+        kind: Il tipo di job (vedi JOB_HANDLERS)
+        payload: I parametri del job
+
+    Returns:
+        Il job accodato
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Tipo di job non supportato: {kind}")
+    job = get_job_store().enqueue(kind, payload)
+    _wakeup_event().set()
+    return job
+
+
+async def _heartbeat(job_id: str, worker: str) -> None:
+    # Rinnova il lease finché il job è in esecuzione
+    store = get_job_store()
+    while True:
+        await asyncio.sleep(settings.JOBS_LEASE_SECONDS / 3)
+        if not store.renew(job_id, worker, settings.JOBS_LEASE_SECONDS):
+            logger.warning(f"Il job {job_id} non è più assegnato al worker {worker}")
+            return
+
+
+async def _process(job: Dict[str, Any], worker: str) -> None:
+    """
+    Esegue un job assegnato al worker e ne salva l'esito
+    """
+    store = get_job_store()
+    heartbeat = asyncio.create_task(_heartbeat(job["id"], worker))
+    _notify_change()
+    start = time.time()
+    _waiting_ms.append((start - job["created_at"]) * 1000)
+    try:
+        result = await JOB_HANDLERS[job["kind"]](job["payload"])
+        if not store.complete(job["id"], worker, result):
+            logger.warning(f"Risultato del job {job['id']} scartato: il lease era scaduto")
+        _job_stats["completed"] += 1
+        _processing_ms.append((time.time() - start) * 1000)
+    except asyncio.CancelledError:
+        # Spegnimento: il job torna in coda e sarà ripreso al prossimo avvio
+        store.release(job["id"], worker)
+        _job_stats["released"] += 1
+        raise
+    except Exception as e:
+        logger.error(f"Errore nell'esecuzione del job {job['id']}: {e}")
+        store.fail(job["id"], worker, str(e))
+        _job_stats["failed"] += 1
+        _processing_ms.append((time.time() - start) * 1000)
+    finally:
+        heartbeat.cancel()
+        _notify_change()
+
+
+async def _worker_loop(number: int) -> None:
+    worker = f"{socket.gethostname()}:{os.getpid()}:{number}"
+    store = get_job_store()
+    while not _stopping:
+        # Le diete usano il motore RAG: i job restano in coda finché non è pronto
+        if not await wait_until_ready(settings.JOBS_POLL_INTERVAL):
+            await asyncio.sleep(settings.JOBS_POLL_INTERVAL)
+            continue
+        try:
+            job = store.claim(worker, settings.JOBS_LEASE_SECONDS)
+        except Exception as e:
+            logger.error(f"Errore nel prelievo di un job dalla coda: {e}")
+            await asyncio.sleep(settings.JOBS_POLL_INTERVAL)
+            continue
+        if job is None:
+            wakeup = _wakeup_event()
+            await _wait(wakeup, settings.JOBS_POLL_INTERVAL)
+            wakeup.clear()
+            continue
+        await _process(job, worker)
+
+
+def start_job_workers() -> None:
+    """
+    Avvia i worker della coda dei job (JOBS_WORKERS per processo). I job
+    rimasti in esecuzione da un avvio precedente vengono ripresi allo
+    scadere del loro lease
+    """
+    global _stopping
+    if settings.JOBS_WORKERS <= 0 or _workers:
+        return
+    _stopping = False
+    try:
+        purged = get_job_store().purge(settings.JOBS_RETENTION_SECONDS)
+        if purged:
+            logger.info(f"Eliminati {purged} job conclusi")
+    except Exception as e:
+        logger.error(f"Errore nella pulizia della coda dei job: {e}")
+    for number in range(settings.JOBS_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop(number)))
+    logger.info(f"Avviati {settings.JOBS_WORKERS} worker della coda dei job")
+
+
+async def stop_job_workers(timeout: float) -> None:
+    """
+    Ferma i worker: smettono di prelevare job e quelli in corso hanno fino
+    a timeout secondi per concludersi, poi vengono interrotti e rimessi in coda
+
+    Args:
+        timeout: Attesa massima in secondi
+    """
+    global _stopping
+    if not _workers:
+        return
+    _stopping = True
+    _wakeup_event().set()
+    _, pending = await asyncio.wait(_workers, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    if pending:
+        logger.warning(f"{len(pending)} job interrotti allo spegnimento e rimessi in coda")
+    _workers.clear()
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+def describe_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rappresentazione pubblica di un job (vedi schemas.diet.DietJobResponse)
+
+    Args:
+        job: Il job letto dalla coda
+
+    Returns:
+        Stato, tempi, posizione in coda, errore e risultato del job
+    """
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "queue_position": get_job_store().queue_position(job) if job["status"] == QUEUED else None,
+        "created_at": _isoformat(job["created_at"]),
+        "started_at": _isoformat(job["started_at"]),
+        "finished_at": _isoformat(job["finished_at"]),
+        "error": job["error"],
+        "result": job["result"]
+    }
+
+
+async def watch_job(job_id: str) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Restituisce il job a ogni cambio di stato, fino alla conclusione.
+    I cambi avvenuti in questo processo sono notificati subito, quelli dei
+    worker di altri processi entro JOBS_POLL_INTERVAL
+
+    Args:
+        job_id: L'ID del job
+
+    Yields:
+        Il job aggiornato, oppure None se il job non esiste
+    """
+    store = get_job_store()
+    last_status = None
+    while True:
+        changed = _changed_event()
+        job = store.get(job_id)
+        if job is None:
+            yield None
+            return
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield job
+        if last_status in (DONE, FAILED):
+            return
+        await _wait(changed, settings.JOBS_POLL_INTERVAL)
+
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * share))], 1)
+
+
+def get_job_stats() -> Dict[str, Any]:
+    """
+    Restituisce profondità della coda e tempi di attesa e di esecuzione dei job
+    """
+    stats: Dict[str, Any] = {
+        "workers": sum(1 for task in _workers if not task.done()),
+        **_job_stats
+    }
+    try:
+        counts = get_job_store().counts()
+        stats["queue_depth"] = counts[QUEUED]
+        stats["running"] = counts[RUNNING]
+        stats["oldest_queued_seconds"] = counts["oldest_queued_seconds"]
+        stats["stored"] = {status: counts[status] for status in (QUEUED, RUNNING, DONE, FAILED)}
+    except Exception as e:
+        logger.error(f"Errore nella lettura della coda dei job: {e}")
+    for name, values in (("processing_ms", list(_processing_ms)), ("queue_wait_ms", list(_waiting_ms))):
+        stats[f"avg_{name}"] = round(sum(values) / len(values), 1) if values else 0.0
+        stats[f"p95_{name}"] = _percentile(values, 0.95) if values else 0.0
+    return stats
@@ -0,0 +1,251 @@
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# File dell'indice lessicale, accanto al vectorstore
+LEXICAL_INDEX_FILE = "lexical.json"
+
+LEXICAL_INDEX_VERSION = 1
+
+# Parole vuote italiane (senza accenti, come dopo la normalizzazione)
+ITALIAN_STOPWORDS = frozenset("""
+a ad agli ai al all alla alle allo anche avere che chi ci col come con contro cui da dagli dai dal dall dalla
+dalle dallo degli dei del dell della delle dello dentro di dove e ed essere fra gli ha hanno ho i il in io l la le
+lei li lo loro lui ma mi mia mie miei mio ne negli nei nel nell nella nelle nello noi non nostra nostre nostri
+nostro o ogni per perche piu po poco puo qua quale quali qualche quando quanta quante quanti quanto quella
+quelle quelli quello questa queste questi questo qui se sei sempre senza si sia siamo siete sono sopra sotto
+sta stata state stati stato su sua sue sugli sui sul sull sulla sulle sullo suo suoi ti tra tu tua tue tuo tuoi
+tutta tutte tutti tutto un una uno vi voi vostra vostre vostri vostro fa fare molto molti molta
+""".split())
+
+# Suffissi flessivi e derivativi, dal più lungo al più corto
+_SUFFIXES = tuple(sorted("""
+azione azioni amento amenti imento imenti mente atrice atrici abile abili ibile ibili
+ista iste isti ismo ismi anza anze enza enze iche ichi oso osa osi ose ico ica ici
+are ere ire ato ata ati ate uto uta uti ute ito ita iti ite
+a e i o
+""".split(), key=len, reverse=True))
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Converte il testo in minuscolo e rimuove gli accenti
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """
+    Stemmer leggero per l'italiano: rimuove il suffisso più lungo tra quelli
+    noti, lasciando una radice di almeno tre caratteri
+    (es. "vitamine" e "vitamina" -> "vitamin", "legumi" -> "legum")
+    """
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Divide un testo in termini normalizzati, senza parole vuote e ridotti alla radice
+
+    Args:
+        text: Il testo da analizzare
+
+    Returns:
+        La lista dei termini
+    """
+    return [
+        stem(token) for token in _TOKEN_PATTERN.findall(normalize_text(text))
+        if token not in ITALIAN_STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Indice invertito BM25 sui chunk dei documenti.
+
+    Per ogni chunk vengono salvati solo lunghezza e frequenze dei termini; le
+    liste di posting (array NumPy di posizioni e frequenze per termine) vengono
+    ricostruite alla prima ricerca dopo una modifica, così il punteggio di una
+    query è una somma vettoriale sui soli termini della query.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Tuple[int, Dict[str, int]]] = {}
+
+        self._dirty = True
+        self._doc_ids: List[str] = []
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._idf: Dict[str, float] = {}
+        self._norms: Optional[np.ndarray] = None
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._docs)
+
+    def add(self, node_id: str, text: str) -> None:
+        """
+        Aggiunge (o sostituisce) un chunk nell'indice
+        """
+        terms = tokenize(text)
+        with self._lock:
+            self._docs[node_id] = (len(terms), dict(Counter(terms)))
+            self._dirty = True
+
+    def remove(self, node_id: str) -> None:
+        """
+        Rimuove un chunk dall'indice
+        """
+        with self._lock:
+            if self._docs.pop(node_id, None) is not None:
+                self._dirty = True
+
+    def _rebuild(self) -> None:
+        """
+        Ricostruisce liste di posting, IDF e normalizzazioni di lunghezza
+        """
+        self._doc_ids = list(self._docs.keys())
+        lengths = np.array([self._docs[node_id][0] for node_id in self._doc_ids], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        self._norms = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for position, node_id in enumerate(self._doc_ids):
+            for term, frequency in self._docs[node_id][1].items():
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(position)
+                entry[1].append(frequency)
+
+        num_docs = len(self._doc_ids)
+        self._postings = {
+            term: (np.array(positions, dtype=np.int32), np.array(frequencies, dtype=np.float32))
+            for term, (positions, frequencies) in postings.items()
+        }
+        self._idf = {
+            term: math.log(1 + (num_docs - len(positions) + 0.5) / (len(positions) + 0.5))
+            for term, (positions, _) in self._postings.items()
+        }
+        self._dirty = False
+
+    def search(self, query: str, top_k: int) -> Tuple[List[Tuple[str, float]], float]:
+        """
+        Cerca i chunk più rilevanti per la query
+
+        Args:
+            query: Il testo della query
+            top_k: Numero massimo di risultati
+
+        Returns:
+            Una tupla con la lista (node_id, punteggio) ordinata per rilevanza e la
+            confidenza del risultato migliore, tra 0 e 1: il prodotto tra la quota di
+            termini della query presenti nell'indice e il punteggio del primo risultato
+            rispetto a quello di un chunk di lunghezza media che contiene una volta
+            ciascuno di quei termini
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if self._dirty:
+                self._rebuild()
+            if not terms or not self._doc_ids:
+                return [], 0.0
+
+            scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+            matched = 0
+            reference_score = 0.0
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                positions, frequencies = posting
+                idf = self._idf[term]
+                scores[positions] += idf * frequencies * (self.k1 + 1) / (frequencies + self._norms[positions])
+                matched += 1
+                # Con frequenza 1 e lunghezza media il contributo di un termine è pari all'IDF
+                reference_score += idf
+
+            if matched == 0:
+                return [], 0.0
+
+            top_k = min(top_k, len(self._doc_ids))
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            results = [(self._doc_ids[i], float(scores[i])) for i in candidates if scores[i] > 0]
+
+        if not results:
+            return [], 0.0
+        confidence = (matched / len(terms)) * min(results[0][1] / reference_score, 1.0)
+        return results, confidence
+
+    def save(self, path: Path) -> None:
+        """
+        Salva l'indice su disco in modo atomico
+        """
+        with self._lock:
+            data = {"version": LEXICAL_INDEX_VERSION, "docs": dict(self._docs)}
+        tmp_path = Path(str(path) + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, k1: float = 1.2, b: float = 0.75) -> Optional["BM25Index"]:
+        """
+        Carica l'indice da disco
+
+        Returns:
+            L'indice, oppure None se il file non esiste o non è valido
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != LEXICAL_INDEX_VERSION:
+                return None
+        except Exception as e:
+            logger.error(f"Errore nel caricamento dell'indice lessicale: {e}")
+            return None
+
+        index = cls(k1=k1, b=b)
+        index._docs = {node_id: (length, terms) for node_id, (length, terms) in data["docs"].items()}
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Combina più classifiche con la reciprocal rank fusion: ogni elemento
+    riceve 1 / (k + posizione) da ciascuna classifica in cui compare
+
+    Args:
+        rankings: Le classifiche di node_id, dal più al meno rilevante
+        k: La costante di smorzamento (60 è il valore usato in letteratura)
+
+    Returns:
+        La lista (node_id, punteggio) ordinata per punteggio combinato
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,15 +1,29 @@
-from typing import Dict, Any, List, Optional
-from openai import OpenAI
+from typing import TYPE_CHECKING, Dict, Any, AsyncIterator, List, Optional
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 from app.config import settings
 
+# L'SDK di OpenAI (e httpx) viene importato alla creazione del primo client
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 # Configurazione logging
 logger = logging.getLogger(__name__)
 
 # Client OpenAI
 client = None
 
+# Client OpenAI asincrono condiviso, con il suo pool di connessioni HTTP
+async_client = None
+
+# Limite alle chiamate concorrenti verso OpenAI (creato nel loop di eventi in uso)
+_llm_semaphore = None
+
+# Chiamate al modello in corso, attese allo spegnimento
+_inflight_calls = 0
+
 def get_openai_client():
     """
     Restituisce un'istanza del client OpenAI
@@ -22,6 +36,7 @@ def get_openai_client():
     # Se il client non è stato inizializzato, lo inizializza
     if client is None:
         try:
+            from openai import OpenAI
             client = OpenAI(api_key=settings.OPENAI_API_KEY)
         except Exception as e:
             logger.error(f"Errore nell'inizializzazione del client OpenAI: {e}")
@@ -80,3 +95,188 @@ def generate_chat_completion(prompt: str, system_prompt: str = None, temperature
     except Exception as e:
         logger.error(f"Errore nella generazione della risposta: {e}")
         raise
+
+def get_async_openai_client() -> "AsyncOpenAI":
+    """
+    Restituisce il client OpenAI asincrono condiviso.
+    Tutte le richieste riusano lo stesso pool di connessioni HTTP keep-alive.
+    
+    Returns:
+        Il client AsyncOpenAI configurato
+    """
+    global async_client
+    
+    if async_client is None:
+        try:
+            import httpx
+            from openai import AsyncOpenAI
+            
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_HTTP_MAX_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=10.0)
+            )
+            async_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=http_client)
+        except Exception as e:
+            logger.error(f"Errore nell'inizializzazione del client OpenAI asincrono: {e}")
+            raise
+    
+    return async_client
+
+async def close_async_openai_client() -> None:
+    """
+    Chiude il client asincrono e il relativo pool di connessioni
+    """
+    global async_client
+    
+    if async_client is not None:
+        await async_client.close()
+        async_client = None
+
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """
+    Restituisce il semaforo che limita le chiamate concorrenti al modello
+    
+    Returns:
+        Il semaforo condiviso
+    """
+    global _llm_semaphore
+    
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    
+    return _llm_semaphore
+
+@asynccontextmanager
+async def _track_llm_call():
+    global _inflight_calls
+    _inflight_calls += 1
+    try:
+        yield
+    finally:
+        _inflight_calls -= 1
+
+async def drain_llm_calls(timeout: float) -> int:
+    """
+    Attende il completamento delle chiamate al modello in corso (allo spegnimento)
+    
+    Args:
+        timeout: Attesa massima in secondi
+        
+    Returns:
+        Il numero di chiamate ancora in corso allo scadere dell'attesa
+    """
+    if _inflight_calls:
+        logger.info(f"Attesa di {_inflight_calls} chiamate al modello in corso...")
+    deadline = asyncio.get_running_loop().time() + timeout
+    while _inflight_calls and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.1)
+    if _inflight_calls:
+        logger.warning(f"{_inflight_calls} chiamate al modello interrotte allo spegnimento")
+    return _inflight_calls
+
+async def agenerate_chat_completion(
+    messages: List[Dict[str, str]],
+    max_tokens: int = 4000,
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+    response_format: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Genera una risposta in modo asincrono, senza bloccare il loop di eventi
+    
+    Args:
+        messages: I messaggi da inviare al modello
+        max_tokens: Numero massimo di token generati
+        temperature: La temperatura per la generazione (default: 0.7)
+        model: Il modello da usare (default: CHAT_MODEL)
+        response_format: Formato della risposta (es. {"type": "json_object"} per la modalità JSON)
+        
+    Returns:
+        Un dizionario con la risposta e i metadati
+    """
+    try:
+        openai_client = get_async_openai_client()
+        options = {"response_format": response_format} if response_format else {}
+        
+        # Attende uno slot libero prima di chiamare OpenAI
+        async with get_llm_semaphore(), _track_llm_call():
+            response = await openai_client.chat.completions.create(
+                model=model or settings.CHAT_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=1.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0,
+                **options
+            )
+        
+        return {
+            "text": response.choices[0].message.content,
+            "tokens_used": {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
+            }
+        }
+    except Exception as e:
+        logger.error(f"Errore nella generazione asincrona della risposta: {e}")
+        raise
+
+async def astream_chat_completion(
+    messages: List[Dict[str, str]],
+    max_tokens: int = 4000,
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+    usage: Optional[Dict[str, int]] = None
+) -> AsyncIterator[str]:
+    """
+    Genera una risposta in streaming, restituendo i frammenti di testo
+    man mano che il modello li produce
+    
+    Args:
+        messages: I messaggi da inviare al modello
+        max_tokens: Numero massimo di token generati
+        temperature: La temperatura per la generazione (default: 0.7)
+        model: Il modello da usare (default: CHAT_MODEL)
+        response_format: Formato della risposta (es. {"type": "json_object"} per la modalità JSON)
+        usage: Se indicato, viene riempito con i token usati a fine stream
+        
+    Yields:
+        I frammenti di testo generati
+    """
+    try:
+        openai_client = get_async_openai_client()
+        options: Dict[str, Any] = {"response_format": response_format} if response_format else {}
+        if usage is not None:
+            options["stream_options"] = {"include_usage": True}
+        
+        # Lo slot resta occupato per tutta la durata dello stream
+        async with get_llm_semaphore(), _track_llm_call():
+            stream = await openai_client.chat.completions.create(
+                model=model or settings.CHAT_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=1.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0,
+                stream=True,
+                **options
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if usage is not None and getattr(chunk, "usage", None):
+                    usage.update({
+                        "prompt_tokens": chunk.usage.prompt_tokens,
+                        "completion_tokens": chunk.usage.completion_tokens,
+                        "total_tokens": chunk.usage.total_tokens
+                    })
+    except Exception as e:
+        logger.error(f"Errore nella generazione in streaming della risposta: {e}")
+        raise
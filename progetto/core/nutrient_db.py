@@ -0,0 +1,530 @@
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+import csv
+import difflib
+import logging
+import re
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+
+if TYPE_CHECKING:
+    from app.models.diet import DietPlan
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Nutrienti per 100 g di parte edibile, nell'ordine delle colonne della matrice
+NUTRIENTS = ("energy_kcal", "protein_g", "fat_g", "carbohydrate_g", "fiber_g")
+
+# Intestazioni accettate per ogni colonna (confrontate senza maiuscole, accenti e unità):
+# comprendono quelle dell'esportazione delle tabelle di composizione CREA
+_COLUMN_ALIASES = {
+    "name": ("nome", "alimento", "descrizione", "nome alimento", "food name"),
+    "code": ("codice", "codice alimento", "id"),
+    "category": ("categoria", "categoria merceologica", "gruppo"),
+    "edible": ("parte edibile", "parte edibile %"),
+    "unit_grams": ("peso unita", "peso unita g", "peso medio"),
+    "energy_kcal": ("energia kcal", "energia", "energia kcal 100 g", "kcal"),
+    "protein_g": ("proteine", "proteine totali", "proteine g"),
+    "fat_g": ("lipidi", "lipidi totali", "grassi", "lipidi g"),
+    "carbohydrate_g": ("carboidrati disponibili", "carboidrati", "glucidi disponibili", "carboidrati g"),
+    "fiber_g": ("fibra alimentare totale", "fibra alimentare", "fibra", "fibra g"),
+}
+
+# Parole ignorate nei nomi degli alimenti
+_STOPWORDS = {
+    "di", "del", "della", "dello", "dei", "degli", "delle", "da", "al", "alla", "allo", "ai", "agli", "alle",
+    "con", "in", "e", "ed", "a", "il", "lo", "la", "i", "gli", "le", "un", "uno", "una", "per", "tipo",
+}
+
+# Unità di misura casalinghe e peso in grammi (dalla più specifica alla più generica)
+_UNIT_GRAMS = [
+    ("kg", 1000.0), ("g", 1.0), ("gr", 1.0), ("grammi", 1.0), ("ml", 1.0), ("cl", 10.0), ("l", 1000.0), ("litr", 1000.0),
+    ("cucchiain", 5.0), ("cucchiai", 10.0), ("fett", 30.0), ("tazzin", 50.0), ("tazz", 200.0),
+    ("bicchier", 200.0), ("vasett", 125.0), ("porzion", 100.0), ("manciat", 30.0),
+]
+_COUNT_UNITS = ("frutt", "pezz", "pz", "unita")
+_NUMBER_WORDS = {"un": 1.0, "uno": 1.0, "una": 1.0, "un'": 1.0, "mezzo": 0.5, "mezza": 0.5,
+                 "due": 2.0, "tre": 3.0, "quattro": 4.0, "cinque": 5.0}
+_QUANTITY = re.compile(
+    r"(\d+(?:[.,]\d+)?|(?<![a-z])(?:" + "|".join(sorted(_NUMBER_WORDS, key=len, reverse=True)) + r")(?![a-z]))\s*([a-z']*)"
+)
+
+
+def _normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9%]+", " ", text).strip()
+
+
+def _stem(token: str) -> str:
+    # Singolare e plurale italiani (mela/mele, fagiolo/fagioli) si riducono alla stessa radice
+    return token[:-1] if len(token) > 3 and token[-1] in "aeio" else token
+
+
+def _tokens(name: str) -> List[str]:
+    return [_stem(token) for token in _normalize_text(name).split() if token not in _STOPWORDS and not token.isdigit()]
+
+
+def _parse_number(value: str) -> float:
+    """
+    Converte un valore delle tabelle: virgola decimale, "tr" (tracce) = 0,
+    valori mancanti ("", "-", "n.d.") = NaN
+    """
+    value = (value or "").strip().lower()
+    if value in ("tr", "tracce"):
+        return 0.0
+    try:
+        return float(value.replace(",", "."))
+    except ValueError:
+        return float("nan")
+
+
+def parse_quantity(quantity: str, unit_grams: Optional[float] = None) -> Optional[float]:
+    """
+    Converte una quantità in grammi di parte edibile
+
+    Args:
+        quantity: La quantità (es. "150 g", "2 cucchiai", "1 vasetto", "2")
+        unit_grams: Peso di un'unità dell'alimento, per le quantità a numero (es. "2 uova")
+
+    Returns:
+        I grammi, oppure None se la quantità non è convertibile (es. "q.b.")
+    """
+    text = unicodedata.normalize("NFKD", quantity.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    match = _QUANTITY.search(text)
+    if match is None:
+        return None
+
+    number, unit = match.groups()
+    amount = _NUMBER_WORDS.get(number)
+    if amount is None:
+        amount = float(number.replace(",", "."))
+
+    if unit:
+        for prefix, grams in _UNIT_GRAMS:
+            if unit == prefix or (len(prefix) > 2 and unit.startswith(prefix)):
+                return amount * grams
+        if not unit.startswith(_COUNT_UNITS):
+            # Un'unità sconosciuta seguita dal nome (es. "2 uova"): conta come numero di pezzi
+            if unit_grams is None:
+                return None
+    return amount * unit_grams if unit_grams else None
+
+
+class NutrientDB:
+    """
+    Tabella di composizione degli alimenti in memoria.
+
+    I valori per 100 g di parte edibile sono in una matrice NumPy
+    (alimenti x NUTRIENTS), così i totali di pasti, giornate e settimane sono
+    prodotti di matrici. I nomi sono cercati con un indice invertito sulle
+    radici delle parole, con correzione degli errori di battitura (difflib)
+    sul vocabolario della tabella.
+    """
+
+    def __init__(self, foods: List[Dict[str, Any]]):
+        self.names = [food["name"] for food in foods]
+        self.codes = [food.get("code") or "" for food in foods]
+        self.categories = [food.get("category") or "" for food in foods]
+        self.edible = np.array([food.get("edible", 100.0) for food in foods], dtype=np.float64)
+        self.unit_grams = np.array([food.get("unit_grams", np.nan) for food in foods], dtype=np.float64)
+        self.matrix = np.array([[food[name] for name in NUTRIENTS] for food in foods], dtype=np.float64).reshape(-1, len(NUTRIENTS))
+        # I nutrienti non indicati non contribuiscono ai totali
+        self.matrix = np.nan_to_num(self.matrix, nan=0.0)
+
+        self._exact: Dict[str, int] = {}
+        self._row_tokens: List[set] = []
+        # Prima parola del nome: l'alimento di base ("Riso, brillato" e non "Gallette di riso")
+        self._head_tokens: List[str] = []
+        self._index: Dict[str, List[int]] = {}
+        for row, name in enumerate(self.names):
+            tokens = _tokens(name)
+            self._exact.setdefault(" ".join(tokens), row)
+            self._row_tokens.append(set(tokens))
+            self._head_tokens.append(tokens[0] if tokens else "")
+            for token in set(tokens):
+                self._index.setdefault(token, []).append(row)
+        self._vocabulary = list(self._index)
+        self._cache: Dict[str, Optional[Tuple[int, float]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_csv(cls, path: Path) -> "NutrientDB":
+        """
+        Carica la tabella da un file CSV (es. esportazione delle tabelle CREA).
+        Separatore (";" o ",") e colonne sono riconosciuti automaticamente
+
+        Args:
+            path: Il percorso del file CSV
+
+        Returns:
+            La tabella caricata
+
+        Raises:
+            ValueError: Se mancano le colonne del nome o dell'energia
+        """
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            sample = f.read(4096)
+            f.seek(0)
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+            reader = csv.reader(f, dialect)
+            header = next(reader)
+            columns = _map_columns(header)
+            if "name" not in columns or "energy_kcal" not in columns:
+                raise ValueError(f"{path}: colonne del nome e dell'energia non trovate ({header})")
+
+            foods = []
+            for values in reader:
+                if len(values) <= columns["name"] or not values[columns["name"]].strip():
+                    continue
+                food: Dict[str, Any] = {"name": values[columns["name"]].strip()}
+                for key in ("code", "category"):
+                    if key in columns and columns[key] < len(values):
+                        food[key] = values[columns[key]].strip()
+                for key in ("edible", "unit_grams") + NUTRIENTS:
+                    if key in columns and columns[key] < len(values):
+                        food[key] = _parse_number(values[columns[key]])
+                    elif key in NUTRIENTS:
+                        food[key] = float("nan")
+                if np.isnan(food.get("edible", np.nan)):
+                    food["edible"] = 100.0
+                foods.append(food)
+
+        logger.info(f"Tabella di composizione degli alimenti: {len(foods)} alimenti da {path}")
+        return cls(foods)
+
+    # ------------------------------------------------------------------
+    # Ricerca
+    # ------------------------------------------------------------------
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        if token in self._index:
+            return [(token, 1.0)]
+        # Errori di battitura: parole del vocabolario abbastanza simili
+        matches = difflib.get_close_matches(token, self._vocabulary, n=3, cutoff=0.8)
+        return [(match, difflib.SequenceMatcher(None, token, match).ratio()) for match in matches]
+
+    def _score(self, tokens: List[str]) -> List[Tuple[float, int]]:
+        """
+        Punteggio degli alimenti che condividono almeno una parola con la query:
+        quota delle parole della query trovate (pesata per la somiglianza) e,
+        in misura minore, se la prima parola del nome (l'alimento di base) è
+        tra quelle della query
+        """
+        # Per ogni parola della query, le parole della tabella corrispondenti e il loro peso
+        expanded = [dict(self._expand(token)) for token in tokens]
+        candidates = {row for options in expanded for token in options for row in self._index[token]}
+
+        scored = []
+        for row in candidates:
+            row_tokens = self._row_tokens[row]
+            weights = [max((weight for token, weight in options.items() if token in row_tokens), default=0.0)
+                       for options in expanded]
+            coverage = sum(weights) / len(tokens)
+            head = self._head_tokens[row]
+            head_weight = max((options.get(head, 0.0) for options in expanded), default=0.0)
+            scored.append((0.8 * coverage + 0.2 * head_weight, row))
+        # A parità di punteggio vince l'alimento elencato prima (di solito il crudo/semplice):
+        # il numero di parole del nome non conta, così "riso" non preferisce un nome più corto
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored
+
+    def _match(self, name: str) -> Optional[Tuple[int, float]]:
+        tokens = _tokens(name)
+        if not tokens:
+            return None
+        exact = self._exact.get(" ".join(tokens))
+        if exact is not None:
+            return exact, 1.0
+        scored = self._score(tokens)
+        return (scored[0][1], scored[0][0]) if scored else None
+
+    def lookup(self, name: str, threshold: Optional[float] = None) -> Optional[int]:
+        """
+        Cerca l'alimento più simile a un nome in italiano
+
+        Args:
+            name: Il nome dell'alimento (es. "petto di pollo", "mele", "yogurt grecco")
+            threshold: Punteggio minimo, tra 0 e 1 (default: NUTRIENT_MATCH_THRESHOLD)
+
+        Returns:
+            La riga della tabella, oppure None se nessun alimento è abbastanza simile
+        """
+        threshold = settings.NUTRIENT_MATCH_THRESHOLD if threshold is None else threshold
+        key = _normalize_text(name)
+        with self._lock:
+            if key not in self._cache:
+                if len(self._cache) >= 10000:
+                    self._cache.clear()
+                self._cache[key] = self._match(name)
+            match = self._cache[key]
+        if match is None or match[1] < threshold:
+            return None
+        return match[0]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Restituisce gli alimenti più simili a una query, con i valori per 100 g
+
+        Args:
+            query: Il testo da cercare
+            limit: Numero massimo di risultati
+
+        Returns:
+            Una lista di alimenti ordinata per punteggio
+        """
+        tokens = _tokens(query)
+        if not tokens:
+            return []
+        return [{**self.food(row), "score": round(score, 3)} for score, row in self._score(tokens)[:limit]]
+
+    def food(self, row: int) -> Dict[str, Any]:
+        """
+        Restituisce nome, codice, categoria e valori per 100 g di un alimento
+        """
+        return {
+            "name": self.names[row],
+            "code": self.codes[row],
+            "category": self.categories[row],
+            "per_100g": {name: round(float(value), 2) for name, value in zip(NUTRIENTS, self.matrix[row])},
+        }
+
+    # ------------------------------------------------------------------
+    # Calcolo dei nutrienti
+    # ------------------------------------------------------------------
+
+    def resolve(self, names: List[str], quantities: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Converte una lista di alimenti nelle righe della tabella e nei grammi
+
+        Args:
+            names: I nomi degli alimenti
+            quantities: Le quantità corrispondenti
+
+        Returns:
+            (righe, grammi): -1 per gli alimenti non trovati, NaN per le quantità non convertibili
+        """
+        rows = np.full(len(names), -1, dtype=np.int64)
+        grams = np.full(len(names), np.nan, dtype=np.float64)
+        for position, (name, quantity) in enumerate(zip(names, quantities)):
+            row = self.lookup(name)
+            if row is None:
+                continue
+            rows[position] = row
+            unit = self.unit_grams[row]
+            # Il peso unitario è dell'alimento intero: si conta solo la parte edibile
+            unit_edible = unit * self.edible[row] / 100 if not np.isnan(unit) else None
+            value = parse_quantity(quantity or "", unit_edible)
+            if value is not None:
+                grams[position] = value
+        return rows, grams
+
+    def nutrients(self, rows: np.ndarray, grams: np.ndarray) -> np.ndarray:
+        """
+        Nutrienti di ogni alimento: (righe x NUTRIENTS) * grammi / 100, in un'unica operazione
+
+        Args:
+            rows: Le righe della tabella (-1 = non trovato)
+            grams: I grammi (NaN = sconosciuti)
+
+        Returns:
+            Una matrice (alimenti x NUTRIENTS); zero per gli alimenti non calcolabili
+        """
+        valid = (rows >= 0) & ~np.isnan(grams)
+        values = np.zeros((len(rows), len(NUTRIENTS)), dtype=np.float64)
+        values[valid] = self.matrix[rows[valid]] * (grams[valid] / 100.0)[:, None]
+        return values
+
+
+def _map_columns(header: List[str]) -> Dict[str, int]:
+    """
+    Associa le colonne del CSV ai campi della tabella
+    """
+    normalized = [_normalize_text(column).replace("%", "").strip() for column in header]
+    columns: Dict[str, int] = {}
+    for key, aliases in _COLUMN_ALIASES.items():
+        for position, column in enumerate(normalized):
+            if column in aliases:
+                columns.setdefault(key, position)
+    # Intestazioni più lunghe, es. "Energia (kcal) per 100 g": si confronta l'inizio
+    for key, aliases in _COLUMN_ALIASES.items():
+        if key in columns:
+            continue
+        for position, column in enumerate(normalized):
+            if position in columns.values() or " kj" in f" {column} ":
+                continue
+            if any(column.startswith(alias) for alias in aliases if len(alias) > 3):
+                columns[key] = position
+                break
+    return columns
+
+
+def _to_dict(values: np.ndarray) -> Dict[str, float]:
+    return {name: round(float(value), 1) for name, value in zip(NUTRIENTS, values)}
+
+
+def compute_items(db: NutrientDB, items: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Nutrienti di una lista di alimenti e loro totale
+
+    Args:
+        db: La tabella degli alimenti
+        items: Gli alimenti, come dizionari con "name" e "quantity"
+
+    Returns:
+        Per ogni alimento la corrispondenza nella tabella, i grammi e i
+        nutrienti; il totale e gli alimenti non calcolati
+    """
+    rows, grams = db.resolve([item["name"] for item in items], [item.get("quantity", "") for item in items])
+    values = db.nutrients(rows, grams)
+    result_items = []
+    for position, item in enumerate(items):
+        row = int(rows[position])
+        computed = row >= 0 and not np.isnan(grams[position])
+        result_items.append({
+            "name": item["name"],
+            "quantity": item.get("quantity", ""),
+            "match": db.names[row] if row >= 0 else None,
+            "grams": round(float(grams[position]), 1) if computed else None,
+            "nutrients": _to_dict(values[position]) if computed else None,
+        })
+    return {
+        "items": result_items,
+        "total": _to_dict(values.sum(axis=0)),
+        "unresolved": [item["name"] for item in result_items if item["nutrients"] is None],
+    }
+
+
+def compute_plan_nutrition(db: NutrientDB, plan: "DietPlan", tolerance: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Energia e macronutrienti di un piano, per pasto, giornata e settimana.
+    Tutti gli alimenti del piano sono risolti una volta e sommati con np.add.at
+    sugli indici di pasto e giornata
+
+    Args:
+        db: La tabella degli alimenti
+        plan: Il piano dietetico
+        tolerance: Scarto relativo oltre cui le calorie indicate dal modello
+            sono segnalate (default: NUTRIENT_VERIFY_TOLERANCE)
+
+    Returns:
+        Totali per pasto, giornata e settimana, la copertura (quota di alimenti
+        calcolati) e gli alimenti con calorie discordanti o non calcolabili
+    """
+    tolerance = settings.NUTRIENT_VERIFY_TOLERANCE if tolerance is None else tolerance
+
+    names, quantities, stated, item_meal, meal_day, meal_names = [], [], [], [], [], []
+    for day_position, day in enumerate(plan.daily_plans):
+        for meal in day.meals:
+            meal_position = len(meal_names)
+            meal_names.append(meal.name)
+            meal_day.append(day_position)
+            for item in meal.items:
+                names.append(item.name)
+                quantities.append(item.quantity)
+                stated.append(np.nan if item.calories is None else float(item.calories))
+                item_meal.append(meal_position)
+
+    rows, grams = db.resolve(names, quantities)
+    values = db.nutrients(rows, grams)
+    computed = (rows >= 0) & ~np.isnan(grams)
+
+    meal_totals = np.zeros((len(meal_names), len(NUTRIENTS)))
+    np.add.at(meal_totals, np.asarray(item_meal, dtype=np.int64), values)
+    day_totals = np.zeros((len(plan.daily_plans), len(NUTRIENTS)))
+    np.add.at(day_totals, np.asarray(meal_day, dtype=np.int64), meal_totals)
+
+    # Confronto con le calorie indicate dal modello
+    stated_kcal = np.asarray(stated, dtype=np.float64)
+    energy = values[:, 0]
+    comparable = computed & ~np.isnan(stated_kcal) & (energy > 0)
+    deviation = np.zeros(len(names))
+    deviation[comparable] = np.abs(stated_kcal[comparable] - energy[comparable]) / energy[comparable]
+    flagged = np.flatnonzero(comparable & (deviation > tolerance))
+
+    days = []
+    meal_position = 0
+    for day_position, day in enumerate(plan.daily_plans):
+        meals = {}
+        for meal in day.meals:
+            meals[meal.name] = _to_dict(meal_totals[meal_position])
+            meal_position += 1
+        days.append({"day": day.day, "meals": meals, "total": _to_dict(day_totals[day_position])})
+
+    week = day_totals.sum(axis=0)
+    return {
+        "days": days,
+        "weekly_total": _to_dict(week),
+        "daily_average": _to_dict(week / len(plan.daily_plans)) if plan.daily_plans else _to_dict(week),
+        "coverage": round(float(computed.mean()), 3) if len(names) else 0.0,
+        "discrepancies": [
+            {"item": names[i], "quantity": quantities[i], "stated_kcal": int(stated_kcal[i]), "computed_kcal": round(float(energy[i]))}
+            for i in flagged
+        ],
+        "unresolved": [names[i] for i in np.flatnonzero(~computed)],
+    }
+
+
+def fill_plan_calories(db: NutrientDB, plan: "DietPlan", overwrite: bool = False) -> int:
+    """
+    Scrive nel piano le calorie calcolate dalla tabella e ricalcola i totali
+
+    Args:
+        db: La tabella degli alimenti
+        plan: Il piano dietetico (modificato sul posto)
+        overwrite: Se sostituire anche le calorie indicate dal modello
+
+    Returns:
+        Il numero di alimenti aggiornati
+    """
+    from app.core.diet_plan import fill_totals
+
+    items = [item for day in plan.daily_plans for meal in day.meals for item in meal.items]
+    rows, grams = db.resolve([item.name for item in items], [item.quantity for item in items])
+    energy = db.nutrients(rows, grams)[:, 0]
+    computed = (rows >= 0) & ~np.isnan(grams)
+
+    updated = 0
+    for position in np.flatnonzero(computed):
+        item = items[position]
+        if item.calories is None or overwrite:
+            item.calories = int(round(energy[position]))
+            updated += 1
+    fill_totals(plan)
+    return updated
+
+
+# Tabella condivisa (caricata al primo utilizzo)
+_nutrient_db: Optional[NutrientDB] = None
+_nutrient_db_lock = threading.Lock()
+
+
+def get_nutrient_db() -> NutrientDB:
+    """
+    Restituisce la tabella degli alimenti: il CSV indicato in NUTRIENT_DB_PATH
+    oppure il campione incluso nel progetto
+
+    Returns:
+        L'istanza condivisa di NutrientDB
+    """
+    global _nutrient_db
+
+    if _nutrient_db is None:
+        with _nutrient_db_lock:
+            if _nutrient_db is None:
+                try:
+                    _nutrient_db = NutrientDB.from_csv(settings.NUTRIENT_DB_PATH or settings.NUTRIENT_SAMPLE_PATH)
+                except Exception as e:
+                    logger.error(f"Errore nel caricamento della tabella degli alimenti: {e}")
+                    raise
+
+    return _nutrient_db
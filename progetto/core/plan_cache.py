@@ -0,0 +1,236 @@
+from typing import Dict, Any, Optional
+from collections import OrderedDict
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from app.config import settings
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+
+class PlanCache:
+    """
+    Cache dei piani dietetici generati, indicizzata per impronta del profilo
+    (vedi diet_profile.profile_fingerprint), versione dell'indice e variante
+    di generazione (modello e token massimi, vedi answer_cache.generation_variant).
+
+    Le voci in memoria sono gestite con politica LRU e scadenza (TTL);
+    opzionalmente vengono salvate anche su disco (SQLite), così i piani
+    sopravvivono al riavvio. Oltre a hit e miss registra la latenza delle
+    richieste servite dalla cache e di quelle generate dal modello.
+    """
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 7 * 86400, disk_path: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = Path(disk_path) if disk_path else None
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "uncacheable": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "tokens_saved": 0,
+        }
+        # Latenza cumulata (secondi) e numero di richieste per esito
+        self._latency = {"hit": [0.0, 0], "miss": [0.0, 0], "uncacheable": [0.0, 0]}
+
+        self._disk: Optional[sqlite3.Connection] = None
+        if self.disk_path is not None:
+            self._open_disk()
+
+    # ------------------------------------------------------------------
+    # Livello su disco
+    # ------------------------------------------------------------------
+
+    def _open_disk(self) -> None:
+        os.makedirs(self.disk_path.parent, exist_ok=True)
+        self._disk = sqlite3.connect(str(self.disk_path), check_same_thread=False, isolation_level=None)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute(
+            """
+            CREATE TABLE IF NOT EXISTS plans (
+                key TEXT PRIMARY KEY,
+                plan TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._disk.execute("DELETE FROM plans WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        logger.info(f"Cache dei piani dietetici su disco: {self.disk_path}")
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._disk is None:
+            return None
+        row = self._disk.execute("SELECT plan, created_at FROM plans WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"plan": json.loads(row[0]), "created_at": row[1]}
+
+    def _disk_put(self, key: str, entry: Dict[str, Any]) -> None:
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO plans (key, plan, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry["plan"], ensure_ascii=False), entry["created_at"])
+            )
+        except sqlite3.Error as e:
+            # Un errore del livello su disco non deve far fallire la richiesta
+            logger.error(f"Errore nel salvataggio su disco della cache dei piani: {e}")
+
+    # ------------------------------------------------------------------
+    # Gestione delle voci
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _make_key(fingerprint: str, index_version: str, variant: str) -> str:
+        return f"{index_version}:{variant}:{fingerprint}"
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] > self.ttl_seconds
+
+    def _insert(self, key: str, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, fingerprint: str, index_version: str, variant: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Cerca un piano generato per un profilo con la stessa impronta
+
+        Args:
+            fingerprint: L'impronta del profilo
+            index_version: La versione corrente dell'indice
+            variant: La variante di generazione
+
+        Returns:
+            Il piano salvato (con gli attributi del profilo di origine), oppure None
+        """
+        key = self._make_key(fingerprint, index_version, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            from_disk = False
+            if entry is None:
+                entry = self._disk_get(key)
+                from_disk = entry is not None
+
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            if self._is_expired(entry):
+                self._entries.pop(key, None)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            if from_disk:
+                self._insert(key, entry)
+                self._stats["disk_hits"] += 1
+            else:
+                self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            self._stats["tokens_saved"] += entry["plan"].get("tokens_used", {}).get("total_tokens", 0)
+            return entry["plan"]
+
+    def put(self, fingerprint: str, index_version: str, plan: Dict[str, Any], variant: str = "") -> None:
+        """
+        Salva un piano generato
+
+        Args:
+            fingerprint: L'impronta del profilo
+            index_version: La versione dell'indice usata per il piano
+            plan: Il piano e i suoi metadati (deve essere serializzabile in JSON)
+            variant: La variante di generazione
+        """
+        key = self._make_key(fingerprint, index_version, variant)
+        entry = {"plan": plan, "created_at": time.time()}
+        with self._lock:
+            self._insert(key, entry)
+            self._disk_put(key, entry)
+
+    def record_uncacheable(self) -> None:
+        """
+        Conta un profilo che non può essere servito dalla cache (incompleto o
+        con vincoli non riconosciuti)
+        """
+        with self._lock:
+            self._stats["uncacheable"] += 1
+
+    def record_latency(self, outcome: str, seconds: float) -> None:
+        """
+        Registra la durata di una richiesta
+
+        Args:
+            outcome: "hit", "miss" o "uncacheable"
+            seconds: La durata della richiesta
+        """
+        with self._lock:
+            total = self._latency[outcome]
+            total[0] += seconds
+            total[1] += 1
+
+    def clear(self) -> None:
+        """
+        Svuota la cache in memoria e su disco
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM plans")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Restituisce i contatori di hit/miss, la latenza media per esito e
+        l'occupazione della cache
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            requests = lookups + self._stats["uncacheable"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "hit_rate_all_requests": round(self._stats["hits"] / requests, 4) if requests else 0.0,
+                "avg_latency_ms": {
+                    outcome: round(total / count * 1000, 1) if count else None
+                    for outcome, (total, count) in self._latency.items()
+                },
+            }
+
+
+# Istanza condivisa della cache (creata al primo utilizzo)
+_plan_cache: Optional[PlanCache] = None
+
+
+def get_plan_cache() -> PlanCache:
+    """
+    Restituisce la cache dei piani dietetici configurata nelle impostazioni
+
+    Returns:
+        L'istanza condivisa di PlanCache
+    """
+    global _plan_cache
+
+    if _plan_cache is None:
+        _plan_cache = PlanCache(
+            max_entries=settings.DIET_PLAN_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.DIET_PLAN_CACHE_TTL_SECONDS,
+            disk_path=settings.DIET_PLAN_CACHE_DISK_PATH
+        )
+
+    return _plan_cache
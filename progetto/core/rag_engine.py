@@ -1,78 +1,171 @@
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+import hashlib
 import logging
 import os
+import time
 from pathlib import Path
 
-from llama_index.core import (
-    VectorStoreIndex,
-    SimpleDirectoryReader,
-    StorageContext,
-    load_index_from_storage,
-    ServiceContext,
-    set_global_service_context
-)
-from llama_index.core.node_parser import SimpleNodeParser
-from llama_index.llms.openai import OpenAI
-from llama_index.embeddings.openai import OpenAIEmbedding
-
 from app.config import settings
+from app.core.embedding_cache import get_embedding_cache
+from app.core.lexical_index import reciprocal_rank_fusion
+
+# llama_index (e con esso l'SDK di OpenAI) viene importato al primo uso, nelle
+# funzioni che ne hanno bisogno: importare questo modulo resta leggero
+if TYPE_CHECKING:
+    from llama_index.core.schema import NodeWithScore
+    from llama_index.embeddings.openai import OpenAIEmbedding
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
 
 # Variabili globali per il motore RAG
 _vector_index = None
+_retriever = None
+_embed_model = None
+_lexical_index = None
+_index_version = "empty"
+
+# Statistiche del recupero dei documenti
+_retrieval_stats = {"retrievals": 0, "total_ms": 0.0, "embedding_calls": 0, "lexical_only": 0}
 
-def initialize_rag_engine() -> None:
+def configure_llama_settings() -> "OpenAIEmbedding":
     """
-    Inizializza il motore RAG caricando i documenti e creando gli embeddings.
-    Se esiste già un indice precedentemente salvato, lo carica invece di ricrearlo.
+    Imposta modello, embedding e parser globali di Llama-Index
+    
+    Returns:
+        Il modello di embedding configurato
     """
-    global _vector_index
+    from llama_index.core import Settings as LlamaSettings
+    from llama_index.core.node_parser import SimpleNodeParser
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    from llama_index.llms.openai import OpenAI
     
     # Verifica che la chiave API OpenAI sia impostata
     if not settings.OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY non trovata nelle variabili d'ambiente")
     
-    # Imposta il contesto del servizio Llama-Index
-    llm = OpenAI(model=settings.CHAT_MODEL, api_key=settings.OPENAI_API_KEY)
     embed_model = OpenAIEmbedding(model=settings.EMBEDDING_MODEL, api_key=settings.OPENAI_API_KEY)
-    service_context = ServiceContext.from_defaults(
-        llm=llm,
-        embed_model=embed_model,
-        node_parser=SimpleNodeParser.from_defaults(chunk_size=1024, chunk_overlap=20)
+    LlamaSettings.llm = OpenAI(model=settings.CHAT_MODEL, api_key=settings.OPENAI_API_KEY)
+    LlamaSettings.embed_model = embed_model
+    LlamaSettings.node_parser = SimpleNodeParser.from_defaults(
+        chunk_size=settings.CHUNK_SIZE,
+        chunk_overlap=settings.CHUNK_OVERLAP
     )
-    set_global_service_context(service_context)
+    return embed_model
+
+def initialize_rag_engine() -> List[str]:
+    """
+    Inizializza il motore RAG caricando i documenti e creando gli embeddings.
+    Se esiste già un indice precedentemente salvato, lo carica e lo aggiorna
+    in modo incrementale: vengono elaborati solo i documenti nuovi o modificati.
+    
+    Returns:
+        I problemi che non impediscono di rispondere alle query (es. indice
+        non aggiornato ai documenti); lista vuota se l'avvio è completo
+    """
+    global _vector_index, _retriever, _embed_model, _lexical_index, _index_version
+    from app.core.ingestion import load_index, load_lexical_index, load_manifest, sync_index
+    
+    issues: List[str] = []
+    
+    _embed_model = configure_llama_settings()
     
     # Percorso del vectorstore
     storage_path = settings.VECTORSTORE_PATH
+    manifest = load_manifest(storage_path)
     
-    # Se esiste già un indice salvato, caricalo
-    if os.path.exists(storage_path) and any(os.listdir(storage_path)):
+    # Se esiste già un indice salvato con il relativo manifest, caricalo
+    if manifest is not None:
         logger.info(f"Caricamento dell'indice esistente dalla directory {storage_path}")
         try:
-            storage_context = StorageContext.from_defaults(persist_dir=str(storage_path))
-            _vector_index = load_index_from_storage(storage_context)
+            _vector_index = load_index(storage_path, manifest)
             logger.info("Indice caricato con successo")
         except Exception as e:
             logger.error(f"Errore nel caricamento dell'indice: {e}")
             logger.info("Creazione di un nuovo indice...")
             _create_new_index(storage_path)
+        else:
+            # Allinea l'indice ai documenti aggiunti, modificati o eliminati
+            try:
+                sync_index(_vector_index, storage_path, manifest=manifest)
+            except Exception as e:
+                logger.error(f"Errore nell'aggiornamento incrementale dell'indice, uso l'indice esistente: {e}")
+                issues.append(f"Indice non aggiornato ai documenti: {e}")
     else:
-        # Altrimenti, crea un nuovo indice
-        logger.info("Nessun indice esistente trovato. Creazione di un nuovo indice...")
+        # Altrimenti (nessun indice, o indice senza manifest) crea un nuovo indice
+        logger.info("Nessun indice con manifest trovato. Creazione di un nuovo indice...")
         _create_new_index(storage_path)
     
-    logger.info("Motore RAG inizializzato correttamente")
+    # Il retriever viene creato una sola volta e riusato da tutte le query
+    _retriever = _vector_index.as_retriever(similarity_top_k=_candidate_count(settings.TOP_K_RESULTS))
+    
+    # Indice lessicale BM25 per il recupero ibrido
+    _lexical_index = load_lexical_index(storage_path)
+    if _lexical_index is None:
+        logger.warning("Indice lessicale non disponibile, verrà usato solo il recupero vettoriale")
+        issues.append("Indice lessicale non disponibile")
+    
+    _index_version = _compute_index_version(storage_path)
+    logger.info(f"Motore RAG inizializzato correttamente (versione indice {_index_version})")
+    return issues
+
+def reset_after_fork() -> None:
+    """
+    Prepara un motore RAG caricato prima del fork (server con preload) all'uso
+    nel processo figlio: ricrea il modello di embedding, con il suo pool di
+    connessioni HTTP, e le connessioni del vectorstore
+    """
+    global _embed_model
+    
+    if _vector_index is None:
+        return
+    _embed_model = configure_llama_settings()
+    reopen = getattr(_vector_index.vector_store, "reopen", None)
+    if reopen is not None:
+        reopen()
+
+def _compute_index_version(storage_path: Path) -> str:
+    """
+    Calcola un identificativo della versione dell'indice persistito,
+    basato su nome, dimensione e data di modifica dei file del vectorstore.
+    Cambia ogni volta che l'indice viene ricreato o aggiornato.
+    
+    Args:
+        storage_path: Percorso del vectorstore
+        
+    Returns:
+        Una stringa breve che identifica la versione dell'indice
+    """
+    if not os.path.exists(storage_path):
+        return "empty"
+    
+    digest = hashlib.sha1()
+    for entry in sorted(os.scandir(storage_path), key=lambda e: e.name):
+        # I file ausiliari di SQLite cambiano anche solo aprendo il database
+        if entry.is_file() and not entry.name.endswith(("-wal", "-shm")):
+            stat = entry.stat()
+            digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def get_index_version() -> str:
+    """
+    Restituisce la versione dell'indice attualmente caricato
+    
+    Returns:
+        L'identificativo della versione dell'indice
+    """
+    return _index_version
 
 def _create_new_index(storage_path: Path) -> None:
     """
-    Crea un nuovo indice di embeddings dai documenti e lo salva
+    Crea un nuovo indice di embeddings dai documenti e lo salva.
+    Il testo già estratto dai documenti viene riusato dalla cache di ingestion.
     
     Args:
         storage_path: Percorso dove salvare l'indice
     """
     global _vector_index
+    from app.core.ingestion import list_document_files, new_index, new_manifest, sync_index
     
     # Verifica che la directory dei documenti esista
     documents_dir = settings.DOCUMENTS_DIR
@@ -81,70 +174,348 @@ def _create_new_index(storage_path: Path) -> None:
         os.makedirs(documents_dir, exist_ok=True)
     
     # Verifica che ci siano documenti da caricare
-    documents = list(documents_dir.glob("*.pdf")) + list(documents_dir.glob("*.docx")) + list(documents_dir.glob("*.txt"))
-    if not documents:
+    if not list_document_files(documents_dir):
         logger.warning(f"Nessun documento trovato in {documents_dir}. Scarica documenti nutrizionali prima di utilizzare il RAG.")
-        # Creazione di un indice vuoto che può essere aggiornato in seguito
-        _vector_index = VectorStoreIndex([])
-        return
     
-    # Carica i documenti dalla directory
+    # Crea un indice vuoto e lo popola tramite l'ingestion incrementale
     logger.info(f"Caricamento documenti da {documents_dir}")
     try:
-        documents = SimpleDirectoryReader(str(documents_dir)).load_data()
-        logger.info(f"Caricati {len(documents)} documenti")
-        
-        # Crea l'indice vettoriale
-        _vector_index = VectorStoreIndex.from_documents(documents)
-        
-        # Salva l'indice per uso futuro
-        _vector_index.storage_context.persist(persist_dir=str(storage_path))
-        logger.info(f"Indice creato e salvato in {storage_path}")
+        _vector_index = new_index(storage_path)
+        stats = sync_index(
+            _vector_index,
+            storage_path,
+            documents_dir=documents_dir,
+            manifest=new_manifest(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+        )
+        logger.info(f"Indice creato e salvato in {storage_path} ({stats['chunks_added']} chunk)")
     except Exception as e:
         logger.error(f"Errore durante la creazione dell'indice: {e}")
         raise
 
-def query_rag(query: str, top_k: int = settings.TOP_K_RESULTS) -> Dict[str, Any]:
+def _build_rag_result(
+    query: str,
+    context_nodes: List[Any],
+    top_k: int,
+    query_embedding: Optional[List[float]] = None,
+    token_budget: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Costruisce il risultato della query a partire dai nodi recuperati
+    
+    Args:
+        query: La query dell'utente
+        context_nodes: I nodi recuperati dall'indice, dal più rilevante
+        top_k: Numero massimo di chunk nel contesto
+        query_embedding: L'embedding della query, se calcolato
+        token_budget: Budget di token del contesto
+        
+    Returns:
+        Un dizionario con i risultati e il contesto recuperato
+    """
+    if not settings.CONTEXT_BUILDER_ENABLED:
+        # Estrai il testo da ogni nodo
+        context_nodes = context_nodes[:top_k]
+        return {
+            "query": query,
+            "context": "\n\n".join(node.node.text for node in context_nodes),
+            "source_nodes": context_nodes,
+            "num_results": len(context_nodes)
+        }
+    
+    from app.core.context_builder import build_context
+    
+    built = build_context(_with_embeddings(context_nodes), query_embedding, top_k, token_budget)
+    
+    # Restituisci un dizionario con i risultati
+    return {
+        "query": query,
+        "context": built["context"],
+        "source_nodes": built["nodes"],
+        "num_results": len(built["nodes"]),
+        "context_stats": built["stats"]
+    }
+
+def _with_embeddings(nodes: List["NodeWithScore"]) -> List["NodeWithScore"]:
+    """
+    Completa i nodi con il loro embedding, se il vectorstore non lo restituisce
+    insieme ai risultati (necessario alla selezione MMR del contesto)
+    """
+    from llama_index.core.schema import NodeWithScore
+    from app.db.vectorstore import export_nodes
+    
+    missing = [node.node.node_id for node in nodes if node.node.embedding is None]
+    if not missing:
+        return nodes
+    by_id = {node.node_id: node for node in export_nodes(_vector_index, missing)}
+    return [
+        NodeWithScore(node=by_id[node.node.node_id], score=node.score) if node.node.node_id in by_id else node
+        for node in nodes
+    ]
+
+def _pool_size(top_k: int) -> int:
+    """
+    Numero di nodi passati alla costruzione del contesto, che ne sceglie top_k
+    """
+    if settings.CONTEXT_BUILDER_ENABLED:
+        return max(top_k, settings.CONTEXT_CANDIDATES)
+    return top_k
+
+def _candidate_count(top_k: int) -> int:
+    """
+    Numero di candidati da recuperare per classifica: in modalità ibrida ne
+    servono più di top_k, perché la fusione può promuovere risultati più bassi
+    """
+    if settings.RETRIEVAL_MODE == "hybrid":
+        return max(_pool_size(top_k), settings.HYBRID_CANDIDATES)
+    return _pool_size(top_k)
+
+def _get_retriever(top_k: int):
+    """
+    Restituisce il retriever condiviso, oppure ne crea uno apposito
+    se viene richiesto un numero di risultati diverso da quello predefinito
+    
+    Args:
+        top_k: Numero di risultati più rilevanti da recuperare
+        
+    Returns:
+        Il retriever dell'indice vettoriale
+    """
+    if _vector_index is None or _retriever is None:
+        logger.error("Il motore RAG non è stato inizializzato")
+        raise RuntimeError("Il motore RAG non è stato inizializzato. Chiamare initialize_rag_engine() prima dell'uso")
+    
+    candidates = _candidate_count(top_k)
+    if candidates == _retriever.similarity_top_k:
+        return _retriever
+    return _vector_index.as_retriever(similarity_top_k=candidates)
+
+def _record_retrieval(started_at: float, lexical_only: bool = False) -> None:
+    _retrieval_stats["retrievals"] += 1
+    _retrieval_stats["total_ms"] += (time.perf_counter() - started_at) * 1000
+    if lexical_only:
+        _retrieval_stats["lexical_only"] += 1
+
+def get_retrieval_stats() -> Dict[str, Any]:
+    """
+    Restituisce le statistiche del recupero dei documenti
+    
+    Returns:
+        Un dizionario con numero di recuperi, latenza media, recuperi solo
+        lessicali e chiamate di embedding
+    """
+    retrievals = _retrieval_stats["retrievals"]
+    return {
+        "retrievals": retrievals,
+        "avg_latency_ms": round(_retrieval_stats["total_ms"] / retrievals, 2) if retrievals else 0.0,
+        "mode": settings.RETRIEVAL_MODE,
+        "lexical_only": _retrieval_stats["lexical_only"],
+        "embedding_calls": _retrieval_stats["embedding_calls"],
+        "embedding_cache": get_embedding_cache().stats()
+    }
+
+def _lexical_search(query: str, top_k: int) -> Tuple[List[Tuple[str, float]], float]:
+    """
+    Cerca la query nell'indice lessicale, se disponibile e abilitato
+    
+    Returns:
+        I candidati (node_id, punteggio BM25) e la confidenza del primo risultato
+    """
+    if _lexical_index is None or settings.RETRIEVAL_MODE == "vector":
+        return [], 0.0
+    return _lexical_index.search(query, _candidate_count(top_k))
+
+def _use_lexical_only(lexical: List[Tuple[str, float]], confidence: float) -> bool:
+    """
+    Indica se i risultati lessicali bastano, senza calcolare l'embedding della query
+    """
+    if not lexical:
+        return False
+    if settings.RETRIEVAL_MODE == "lexical":
+        return True
+    return settings.LEXICAL_FAST_PATH_ENABLED and confidence >= settings.LEXICAL_FAST_PATH_MIN_CONFIDENCE
+
+def is_lexical_fast_query(query: str) -> bool:
+    """
+    Indica se la query verrà risolta dal solo indice lessicale, così il
+    chiamante può evitare di calcolarne l'embedding
+    
+    Args:
+        query: La query dell'utente
+        
+    Returns:
+        True se il recupero non richiede l'embedding della query
+    """
+    return _use_lexical_only(*_lexical_search(query, settings.TOP_K_RESULTS))
+
+def _lexical_nodes(lexical: List[Tuple[str, float]], top_k: int) -> List["NodeWithScore"]:
+    """
+    Converte i candidati lessicali nei nodi dell'indice
+    """
+    from llama_index.core.schema import NodeWithScore
+    from app.db.vectorstore import export_nodes
+    
+    scores = dict(lexical[:top_k])
+    nodes = export_nodes(_vector_index, list(scores))
+    return [NodeWithScore(node=node, score=scores[node.node_id]) for node in nodes]
+
+def _fuse_results(
+    vector_nodes: List["NodeWithScore"],
+    lexical: List[Tuple[str, float]],
+    top_k: int
+) -> List["NodeWithScore"]:
+    """
+    Combina le classifiche vettoriale e lessicale con la reciprocal rank fusion
+    
+    Args:
+        vector_nodes: I nodi recuperati dall'indice vettoriale
+        lexical: I candidati dell'indice lessicale
+        top_k: Numero di risultati da restituire
+        
+    Returns:
+        I top_k nodi per punteggio combinato
+    """
+    from llama_index.core.schema import NodeWithScore
+    from app.db.vectorstore import export_nodes
+    
+    if not lexical:
+        return vector_nodes[:top_k]
+    
+    fused = reciprocal_rank_fusion(
+        [[node.node.node_id for node in vector_nodes], [node_id for node_id, _ in lexical]],
+        k=settings.RRF_K
+    )[:top_k]
+    
+    by_id = {node.node.node_id: node.node for node in vector_nodes}
+    missing = [node_id for node_id, _ in fused if node_id not in by_id]
+    if missing:
+        by_id.update({node.node_id: node for node in export_nodes(_vector_index, missing)})
+    
+    return [NodeWithScore(node=by_id[node_id], score=score) for node_id, score in fused if node_id in by_id]
+
+def embed_query(query: str) -> List[float]:
+    """
+    Calcola l'embedding di una query, usando la cache se disponibile
+    
+    Args:
+        query: La query dell'utente
+        
+    Returns:
+        Il vettore di embedding della query
+    """
+    if _embed_model is None:
+        logger.error("Il motore RAG non è stato inizializzato")
+        raise RuntimeError("Il motore RAG non è stato inizializzato. Chiamare initialize_rag_engine() prima dell'uso")
+    
+    cache = get_embedding_cache()
+    embedding = cache.get(settings.EMBEDDING_MODEL, query)
+    if embedding is None:
+        embedding = _embed_model.get_query_embedding(query)
+        _retrieval_stats["embedding_calls"] += 1
+        cache.put(settings.EMBEDDING_MODEL, query, embedding)
+    return embedding
+
+def query_rag(
+    query: str,
+    top_k: int = settings.TOP_K_RESULTS,
+    token_budget: Optional[int] = None
+) -> Dict[str, Any]:
     """
     Interroga il motore RAG con una query utente
     
     Args:
         query: La query dell'utente
         top_k: Numero di risultati più rilevanti da recuperare
+        token_budget: Budget di token del contesto (default: CONTEXT_TOKEN_BUDGET_QA)
         
     Returns:
         Un dizionario con i risultati e il contesto recuperato
     """
-    global _vector_index
+    retriever = _get_retriever(top_k)
     
-    if _vector_index is None:
+    try:
+        started_at = time.perf_counter()
+        
+        lexical, confidence = _lexical_search(query, top_k)
+        if _use_lexical_only(lexical, confidence):
+            context_nodes = _lexical_nodes(lexical, _pool_size(top_k))
+            _record_retrieval(started_at, lexical_only=True)
+            return _build_rag_result(query, context_nodes, top_k, token_budget=token_budget)
+        
+        # Solo recupero dei nodi, senza query engine né sintetizzatore di risposta
+        from llama_index.core.schema import QueryBundle
+        query_embedding = embed_query(query)
+        query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+        context_nodes = _fuse_results(retriever.retrieve(query_bundle), lexical, _pool_size(top_k))
+        _record_retrieval(started_at)
+        
+        return _build_rag_result(query, context_nodes, top_k, query_embedding, token_budget)
+    except Exception as e:
+        logger.error(f"Errore durante la query al motore RAG: {e}")
+        raise
+
+async def aembed_query(query: str) -> List[float]:
+    """
+    Calcola in modo asincrono l'embedding di una query, usando la cache se disponibile
+    
+    Args:
+        query: La query dell'utente
+        
+    Returns:
+        Il vettore di embedding della query
+    """
+    if _embed_model is None:
         logger.error("Il motore RAG non è stato inizializzato")
         raise RuntimeError("Il motore RAG non è stato inizializzato. Chiamare initialize_rag_engine() prima dell'uso")
     
+    cache = get_embedding_cache()
+    embedding = cache.get(settings.EMBEDDING_MODEL, query)
+    if embedding is None:
+        embedding = await _embed_model.aget_query_embedding(query)
+        _retrieval_stats["embedding_calls"] += 1
+        cache.put(settings.EMBEDDING_MODEL, query, embedding)
+    return embedding
+
+async def aquery_rag(
+    query: str,
+    top_k: int = settings.TOP_K_RESULTS,
+    query_embedding: Optional[List[float]] = None,
+    token_budget: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Versione asincrona di query_rag: l'embedding della query e il recupero
+    dei nodi non bloccano il loop di eventi
+    
+    Args:
+        query: La query dell'utente
+        top_k: Numero di risultati più rilevanti da recuperare
+        query_embedding: Embedding già calcolato della query (opzionale)
+        token_budget: Budget di token del contesto (default: CONTEXT_TOKEN_BUDGET_QA)
+        
+    Returns:
+        Un dizionario con i risultati e il contesto recuperato
+    """
+    retriever = _get_retriever(top_k)
+    
     try:
-        # Crea un query engine con il contesto
-        query_engine = _vector_index.as_query_engine(
-            similarity_top_k=top_k,
-            response_mode="no_text"  # Restituisce solo i nodi rilevanti, non una risposta generata
-        )
+        started_at = time.perf_counter()
         
-        # Esegui la query
-        response = query_engine.query(query)
+        # Parole chiave affidabili: basta l'indice lessicale locale, senza embedding
+        lexical, confidence = _lexical_search(query, top_k)
+        if _use_lexical_only(lexical, confidence) and (query_embedding is None or settings.RETRIEVAL_MODE == "lexical"):
+            context_nodes = _lexical_nodes(lexical, _pool_size(top_k))
+            _record_retrieval(started_at, lexical_only=True)
+            return _build_rag_result(query, context_nodes, top_k, token_budget=token_budget)
         
-        # Estrai i nodi di contesto
-        context_nodes = response.source_nodes
+        if query_embedding is None:
+            query_embedding = await aembed_query(query)
         
-        # Estrai il testo da ogni nodo
-        context_texts = [node.node.text for node in context_nodes]
-        context_combined = "\n\n".join(context_texts)
+        # Con l'embedding già disponibile il retriever non chiama il modello di embedding
+        from llama_index.core.schema import QueryBundle
+        vector_nodes = await retriever.aretrieve(QueryBundle(query_str=query, embedding=query_embedding))
+        context_nodes = _fuse_results(vector_nodes, lexical, _pool_size(top_k))
+        _record_retrieval(started_at)
         
-        # Restituisci un dizionario con i risultati
-        return {
-            "query": query,
-            "context": context_combined,
-            "source_nodes": context_nodes,
-            "num_results": len(context_nodes)
-        }
+        return _build_rag_result(query, context_nodes, top_k, query_embedding, token_budget)
     except Exception as e:
         logger.error(f"Errore durante la query al motore RAG: {e}")
         raise
@@ -0,0 +1,115 @@
+from typing import Dict, Any, Awaitable, Callable, Optional
+import asyncio
+import logging
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """
+    Una chiamata in corso e il numero di richieste che ne attendono il risultato
+    """
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Accorpa le chiamate concorrenti con la stessa chiave: la prima esegue la
+    funzione, le successive ne attendono il risultato invece di ripeterla.
+
+    La funzione gira in un task separato, così l'interruzione di una richiesta
+    (es. client disconnesso) non annulla il risultato atteso dalle altre; il
+    task viene annullato solo quando non resta nessuna richiesta in attesa.
+    Un errore viene propagato a tutte le richieste accorpate e la chiave viene
+    liberata: la chiamata successiva riprova da capo.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {"calls": 0, "upstream_calls": 0, "coalesced": 0, "errors": 0, "timeouts": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Esegue fn, oppure attende la chiamata già in corso con la stessa chiave
+
+        Args:
+            key: La chiave della chiamata (es. la query normalizzata)
+            fn: La funzione asincrona da eseguire
+            timeout: Attesa massima di questa richiesta, in secondi
+
+        Returns:
+            Il risultato di fn (lo stesso oggetto per tutte le richieste accorpate)
+
+        Raises:
+            asyncio.TimeoutError: Se il risultato non arriva entro il timeout
+        """
+        self._stats["calls"] += 1
+        call = self._calls.get(key)
+        if call is None:
+            self._stats["upstream_calls"] += 1
+            call = _Call(asyncio.create_task(fn()))
+            call.task.add_done_callback(lambda task, key=key: self._finish(key, task))
+            self._calls[key] = call
+        else:
+            self._stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            # shield: il timeout o l'annullamento di una richiesta non annulla la chiamata condivisa
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            logger.warning(f"Timeout in attesa della chiamata {self.name} ({timeout}s)")
+            raise
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nessuno attende più il risultato
+                call.task.cancel()
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is not None and self._calls[key].task is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Restituisce i contatori del gruppo
+
+        Returns:
+            Un dizionario con chiamate ricevute, chiamate eseguite, chiamate
+            risparmiate perché accorpate, errori, timeout e chiavi in corso
+        """
+        calls = self._stats["calls"]
+        return {
+            **self._stats,
+            "in_flight": len(self._calls),
+            "coalesced_ratio": round(self._stats["coalesced"] / calls, 4) if calls else 0.0,
+        }
+
+
+# Gruppi di accorpamento per nome (un gruppo per funzione accorpata)
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_singleflight(name: str) -> SingleFlight:
+    """
+    Restituisce il gruppo di accorpamento con il nome indicato, creandolo al primo utilizzo
+    """
+    group = _groups.get(name)
+    if group is None:
+        group = _groups[name] = SingleFlight(name)
+    return group
+
+
+def get_singleflight_stats() -> Dict[str, Any]:
+    """
+    Restituisce i contatori di tutti i gruppi di accorpamento
+    """
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,175 @@
+from typing import Dict, List, Any, Optional
+import asyncio
+import logging
+import time
+
+from app.config import settings
+from app.core.rag_engine import initialize_rag_engine
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Stati del motore RAG
+LOADING = "loading"      # Caricamento o creazione dell'indice in corso
+READY = "ready"          # Motore pronto
+DEGRADED = "degraded"    # Motore pronto ma incompleto (es. indice non aggiornato ai documenti)
+FAILED = "failed"        # Inizializzazione fallita dopo tutti i tentativi
+
+# Stato del caricamento in background
+_state = LOADING
+_issues: List[str] = []
+_error: Optional[str] = None
+_attempts = 0
+_started_at: Optional[float] = None
+_finished_at: Optional[float] = None
+_settled: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+
+
+def _set_state(state: str) -> None:
+    global _state
+    if state != _state:
+        logger.info(f"Stato del motore RAG: {_state} -> {state}")
+    _state = state
+
+
+def _settled_event() -> asyncio.Event:
+    global _settled
+    if _settled is None:
+        _settled = asyncio.Event()
+    return _settled
+
+
+async def _warmup() -> None:
+    """
+    Inizializza il motore RAG in un thread, senza bloccare il loop di eventi,
+    riprovando con attesa crescente in caso di errore
+    """
+    global _issues, _error, _attempts, _finished_at
+
+    delay = settings.WARMUP_RETRY_DELAY_SECONDS
+    while True:
+        _attempts += 1
+        try:
+            logger.info(f"Inizializzazione del motore RAG (tentativo {_attempts})...")
+            _issues = await asyncio.to_thread(initialize_rag_engine)
+        except Exception as e:
+            _error = str(e)
+            logger.error(f"Errore durante l'inizializzazione del motore RAG: {e}")
+            if _attempts >= settings.WARMUP_MAX_ATTEMPTS:
+                _finished_at = time.time()
+                _set_state(FAILED)
+                break
+            logger.info(f"Nuovo tentativo tra {delay:.0f} secondi")
+            await asyncio.sleep(delay)
+            delay *= 2
+            continue
+
+        _error = None
+        _finished_at = time.time()
+        _set_state(DEGRADED if _issues else READY)
+        logger.info(f"Motore RAG inizializzato in {_finished_at - _started_at:.1f} secondi")
+        break
+
+    _settled_event().set()
+
+
+def preload_engine() -> bool:
+    """
+    Inizializza il motore RAG in modo sincrono, prima del fork dei worker:
+    i worker ereditano l'indice già caricato e lo stato del motore
+
+    Returns:
+        True se il motore è stato caricato; in caso di errore ogni worker
+        ritenterà il caricamento in background
+    """
+    global _issues, _error, _attempts, _started_at, _finished_at
+    _started_at = time.time()
+    _attempts = 1
+    try:
+        _issues = initialize_rag_engine()
+    except Exception as e:
+        _error = str(e)
+        logger.error(f"Errore nel precaricamento del motore RAG, verrà caricato dai worker: {e}")
+        return False
+    _finished_at = time.time()
+    _set_state(DEGRADED if _issues else READY)
+    return True
+
+
+def start_warmup() -> None:
+    """
+    Avvia il caricamento del motore RAG in background. L'applicazione accetta
+    connessioni subito; le richieste che richiedono il motore attendono
+    la fine del caricamento (vedi wait_until_ready)
+    """
+    global _task, _started_at, _finished_at, _attempts
+    if _task is not None and not _task.done():
+        return
+    if is_ready():
+        # Motore già caricato dal processo master (preload_engine)
+        return
+    _started_at = time.time()
+    _finished_at = None
+    _attempts = 0
+    _settled_event().clear()
+    _set_state(LOADING)
+    _task = asyncio.create_task(_warmup())
+
+
+async def stop_warmup() -> None:
+    """
+    Interrompe il caricamento in corso allo spegnimento dell'applicazione.
+    Il thread di inizializzazione non può essere interrotto: termina da solo
+    """
+    if _task is not None and not _task.done():
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+
+def is_ready() -> bool:
+    """
+    Indica se il motore RAG può rispondere alle query
+    """
+    return _state in (READY, DEGRADED)
+
+
+async def wait_until_ready(timeout: float) -> bool:
+    """
+    Attende la fine del caricamento del motore RAG
+
+    Args:
+        timeout: Attesa massima in secondi (0 per non attendere)
+
+    Returns:
+        True se il motore è pronto (anche in modo degradato), False se il
+        caricamento è ancora in corso allo scadere dell'attesa o è fallito
+    """
+    if _state == LOADING and timeout > 0:
+        try:
+            await asyncio.wait_for(_settled_event().wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return is_ready()
+
+
+def get_engine_status() -> Dict[str, Any]:
+    """
+    Restituisce lo stato del motore RAG
+
+    Returns:
+        Un dizionario con stato, tentativi, ultimo errore, problemi dello
+        stato degradato e durata del caricamento
+    """
+    status: Dict[str, Any] = {"state": _state, "attempts": _attempts}
+    if _issues:
+        status["issues"] = list(_issues)
+    if _error:
+        status["error"] = _error
+    if _started_at is not None:
+        end = _finished_at if _finished_at is not None else time.time()
+        status["warmup_seconds"] = round(end - _started_at, 2)
+    return status
@@ -0,0 +1,183 @@
+from typing import Optional, Tuple
+import logging
+import math
+import os
+
+import numpy as np
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# File dell'indice IVF, una generazione per ogni file degli embedding
+IVF_FILE_PATTERN = "ivf.{generation}.npz"
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """
+    Assegna ogni vettore al centroide più simile (prodotto scalare), a blocchi
+    per limitare la memoria della matrice delle similarità
+    """
+    assignments = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), batch_size):
+        block = np.asarray(data[start:start + batch_size], dtype=np.float32)
+        assignments[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(
+    data: np.ndarray,
+    n_clusters: int,
+    iterations: int = 10,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    K-means sferico su vettori normalizzati (similarità coseno)
+
+    Args:
+        data: I vettori normalizzati, uno per riga
+        n_clusters: Numero di centroidi
+        iterations: Numero di iterazioni di Lloyd
+        seed: Seme del generatore casuale
+
+    Returns:
+        La matrice dei centroidi normalizzati
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.array(data[rng.choice(len(data), n_clusters, replace=False)], dtype=np.float32)
+
+    for _ in range(iterations):
+        assignments = _assign(data, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Somma dei vettori di ciascun cluster non vuoto tramite ordinamento e reduceat
+        order = np.argsort(assignments, kind="stable")
+        starts = np.searchsorted(assignments[order], np.arange(n_clusters))
+        non_empty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[non_empty] = np.add.reduceat(np.asarray(data, dtype=np.float32)[order], starts[non_empty], axis=0)
+
+        # I cluster vuoti vengono reinizializzati su vettori casuali
+        if not non_empty.all():
+            sums[~non_empty] = data[rng.choice(len(data), int((~non_empty).sum()), replace=False)]
+        centroids = _normalize_rows(sums).astype(np.float32)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Indice IVF (inverted file) per la ricerca approssimata dei vicini più prossimi.
+
+    I vettori sono raggruppati con k-means sferico; una query confronta prima
+    i centroidi e poi solo i vettori delle nprobe liste più vicine. nprobe
+    regola il compromesso tra recall e latenza: con nprobe pari al numero di
+    liste la ricerca torna esatta.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        # Righe della matrice degli embedding ordinate per lista, e inizio di ciascuna lista
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def n_vectors(self) -> int:
+        return len(self.order)
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        n_lists: Optional[int] = None,
+        iterations: int = 10,
+        sample_size: Optional[int] = None,
+        seed: int = 0
+    ) -> "IVFIndex":
+        """
+        Costruisce l'indice sui vettori (normalizzati) della matrice
+
+        Args:
+            matrix: La matrice degli embedding normalizzati
+            n_lists: Numero di liste (default: radice quadrata del numero di vettori)
+            iterations: Iterazioni di k-means
+            sample_size: Vettori usati per l'addestramento (default: 64 per lista)
+            seed: Seme del generatore casuale
+
+        Returns:
+            L'indice costruito
+        """
+        n_vectors = len(matrix)
+        n_lists = min(n_lists or max(1, int(math.sqrt(n_vectors))), n_vectors)
+        sample_size = min(sample_size or 64 * n_lists, n_vectors)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n_vectors, sample_size, replace=False))
+        centroids = spherical_kmeans(np.asarray(matrix[sample_rows], dtype=np.float32), n_lists, iterations, seed)
+
+        assignments = _assign(matrix, centroids)
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1)).astype(np.int64)
+        return cls(centroids, order, offsets)
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        query_vector: np.ndarray,
+        top_k: int,
+        nprobe: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cerca i vettori più simili alla query nelle nprobe liste più vicine
+
+        Args:
+            matrix: La matrice degli embedding normalizzati (anche in memoria mappata)
+            query_vector: L'embedding normalizzato della query
+            top_k: Numero di risultati
+            nprobe: Numero di liste da esplorare
+
+        Returns:
+            Le righe della matrice e le similarità, in ordine decrescente
+        """
+        nprobe = min(nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query_vector
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+
+        # Righe in ordine crescente: letture sequenziali sul file mappato
+        rows.sort()
+        scores = np.asarray(matrix[rows]) @ query_vector
+
+        top_k = min(top_k, rows.size)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def save(self, path: str) -> None:
+        """
+        Salva l'indice in formato .npz
+        """
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, order=self.order, offsets=self.offsets)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IVFIndex"]:
+        """
+        Carica l'indice, se presente
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data["centroids"], data["order"], data["offsets"])
@@ -0,0 +1,539 @@
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime
+import json
+import os
+import logging
+import heapq
+import threading
+from pathlib import Path
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Tipi di record scritti nel log
+OP_CHAT = "chat"      # Creazione di una chat
+OP_MESSAGE = "msg"    # Nuovo messaggio in una chat
+OP_TITLE = "title"    # Aggiornamento del titolo
+OP_DELETE = "del"     # Eliminazione di una chat
+OP_CLEAR = "clear"    # Eliminazione di tutte le chat
+OP_SUMMARY = "summary"  # Riassunto della conversazione (vale l'ultimo)
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    """
+    Serializza un record in una riga JSON compatta
+    """
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _make_snippet(content: str, position: int, width: int = 80) -> str:
+    """
+    Estrae un frammento del messaggio attorno alla posizione indicata
+    """
+    start = max(position - width // 2, 0)
+    snippet = content[start:start + width]
+    if start > 0:
+        snippet = "…" + snippet
+    if start + width < len(content):
+        snippet += "…"
+    return snippet
+
+
+class ChatLogStore:
+    """
+    Archivio delle chat basato su un log append-only.
+
+    Ogni operazione è una singola riga JSON aggiunta in coda al file; un indice
+    in memoria associa ogni chat agli offset dei suoi messaggi nel log, così le
+    scritture costano O(1) e le letture leggono solo le righe necessarie.
+    Lo spazio occupato da chat eliminate viene recuperato da una compattazione
+    eseguita in background quando la quota di byte non più validi supera la soglia.
+    """
+
+    def __init__(self, log_path: Path, compaction_ratio: float = 0.5, compaction_min_bytes: int = 1024 * 1024):
+        self.log_path = Path(log_path)
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_bytes = compaction_min_bytes
+
+        self._lock = threading.RLock()
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._live_bytes = 0
+        self._file_size = 0
+        self._compacting = False
+        self._append_file = None
+
+        os.makedirs(self.log_path.parent, exist_ok=True)
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Caricamento e applicazione dei record
+    # ------------------------------------------------------------------
+
+    def _load(self) -> None:
+        """
+        Ricostruisce l'indice in memoria leggendo il log in un'unica passata
+        """
+        self._index = {}
+        self._live_bytes = 0
+        offset = 0
+
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Riga troncata da un arresto improvviso: scarta la coda del file
+                        logger.warning(f"Record non valido all'offset {offset} in {self.log_path}, troncamento del log")
+                        break
+                    self._apply(self._index, record, offset, len(line))
+                    offset += len(line)
+
+            if offset != os.path.getsize(self.log_path):
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(offset)
+
+        self._live_bytes = sum(chat["bytes"] for chat in self._index.values())
+        self._file_size = offset
+        self._append_file = open(self.log_path, "ab")
+
+    @staticmethod
+    def _apply(index: Dict[str, Dict[str, Any]], record: Dict[str, Any], offset: int, size: int) -> None:
+        """
+        Applica un record del log all'indice in memoria
+
+        Args:
+            index: L'indice da aggiornare
+            record: Il record letto dal log
+            offset: La posizione del record nel file
+            size: La dimensione in byte del record
+        """
+        op = record.get("op")
+        chat_id = record.get("chat_id")
+
+        if op == OP_CHAT:
+            index[chat_id] = {
+                "title": record["title"],
+                "created_at": record["created_at"],
+                "updated_at": record["created_at"],
+                "offsets": [],
+                "bytes": size,
+            }
+        elif op == OP_MESSAGE and chat_id in index:
+            chat = index[chat_id]
+            chat["offsets"].append(offset)
+            chat["updated_at"] = record.get("updated_at", chat["updated_at"])
+            chat["bytes"] += size
+        elif op == OP_TITLE and chat_id in index:
+            # Il record del titolo precedente resta nel log ma non è più valido
+            index[chat_id]["title"] = record["title"]
+        elif op == OP_SUMMARY and chat_id in index:
+            # Solo l'ultimo riassunto conta tra i byte validi della chat
+            chat = index[chat_id]
+            previous = chat.get("summary")
+            chat["bytes"] += size - (previous["size"] if previous else 0)
+            chat["summary"] = {"summary": record["summary"], "seq": record["seq"], "size": size}
+        elif op == OP_DELETE:
+            index.pop(chat_id, None)
+        elif op == OP_CLEAR:
+            index.clear()
+
+    def _append(self, record: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        Aggiunge un record in coda al log
+
+        Returns:
+            Una tupla (offset, dimensione) del record scritto
+        """
+        data = _encode(record)
+        offset = self._file_size
+        self._append_file.write(data)
+        self._append_file.flush()
+        self._file_size += len(data)
+        return offset, len(data)
+
+    def _read_record(self, f, offset: int) -> Dict[str, Any]:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    # ------------------------------------------------------------------
+    # Operazioni pubbliche
+    # ------------------------------------------------------------------
+
+    def append_message(self, chat_id: str, message: str, role: str, timestamp: Optional[str] = None) -> None:
+        """
+        Aggiunge un messaggio a una chat, creandola se non esiste
+
+        Args:
+            chat_id: L'ID della chat
+            message: Il contenuto del messaggio
+            role: Il ruolo (user o assistant)
+            timestamp: Il timestamp del messaggio (opzionale)
+        """
+        with self._lock:
+            now = datetime.now().isoformat()
+
+            if chat_id not in self._index:
+                # Se è il primo messaggio dell'utente, usa parte del testo come titolo
+                if role == "user":
+                    title = message[:30] + "..." if len(message) > 30 else message
+                else:
+                    title = f"Chat {len(self._index) + 1}"
+                record = {"op": OP_CHAT, "chat_id": chat_id, "title": title, "created_at": now}
+                offset, size = self._append(record)
+                self._apply(self._index, record, offset, size)
+                self._live_bytes += size
+            elif role == "user" and not self._index[chat_id]["offsets"]:
+                title = message[:30] + "..." if len(message) > 30 else message
+                self.update_title(chat_id, title)
+
+            record = {
+                "op": OP_MESSAGE,
+                "chat_id": chat_id,
+                "role": role,
+                "content": message,
+                "timestamp": timestamp or now,
+                "updated_at": now,
+            }
+            offset, size = self._append(record)
+            self._apply(self._index, record, offset, size)
+            self._live_bytes += size
+
+    def get_messages(self, chat_id: str, limit: Optional[int] = None, before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Legge i messaggi di una chat seguendo gli offset dell'indice.
+        Con limit/before vengono letti solo i record della pagina richiesta.
+
+        Args:
+            chat_id: L'ID della chat
+            limit: Numero massimo di messaggi (opzionale, tutti se assente)
+            before: Restituisce solo i messaggi con seq minore di questo valore (opzionale)
+
+        Returns:
+            Una lista di dizionari con i dati dei messaggi in ordine cronologico
+        """
+        with self._lock:
+            chat = self._index.get(chat_id)
+            if chat is None or not chat["offsets"]:
+                return []
+
+            end = len(chat["offsets"]) if before is None else max(min(before, len(chat["offsets"])), 0)
+            start = 0 if limit is None else max(end - limit, 0)
+
+            messages = []
+            with open(self.log_path, "rb") as f:
+                for seq in range(start, end):
+                    record = self._read_record(f, chat["offsets"][seq])
+                    messages.append({
+                        "chat_id": record["chat_id"],
+                        "seq": seq,
+                        "role": record["role"],
+                        "content": record["content"],
+                        "timestamp": record["timestamp"],
+                    })
+            return messages
+
+    def get_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce i metadati di una chat dall'indice
+
+        Args:
+            chat_id: L'ID della chat
+
+        Returns:
+            Un dizionario con id, titolo, date e numero di messaggi, o None se non esiste
+        """
+        with self._lock:
+            chat = self._index.get(chat_id)
+            if chat is None:
+                return None
+            return {
+                "id": chat_id,
+                "title": chat["title"],
+                "created_at": chat["created_at"],
+                "updated_at": chat["updated_at"],
+                "message_count": len(chat["offsets"]),
+            }
+
+    def list_chats(self, limit: Optional[int] = None, before: Optional[Tuple[str, str]] = None) -> List[Dict[str, Any]]:
+        """
+        Restituisce i metadati delle chat direttamente dall'indice,
+        ordinati per data di aggiornamento (più recente prima)
+
+        Args:
+            limit: Numero massimo di chat (opzionale, tutte se assente)
+            before: Cursore (updated_at, id) dell'ultima chat della pagina precedente (opzionale)
+
+        Returns:
+            Una lista di dizionari con id, titolo, date e numero di messaggi
+        """
+        with self._lock:
+            keys = [(chat["updated_at"], chat_id) for chat_id, chat in self._index.items()]
+
+        if before is not None:
+            keys = [key for key in keys if key < tuple(before)]
+        if limit is None:
+            keys.sort(reverse=True)
+        else:
+            keys = heapq.nlargest(limit, keys)
+
+        chats = [self.get_chat(chat_id) for _, chat_id in keys]
+        return [chat for chat in chats if chat is not None]
+
+    def update_title(self, chat_id: str, new_title: str) -> None:
+        """
+        Aggiorna il titolo di una chat
+
+        Args:
+            chat_id: L'ID della chat
+            new_title: Il nuovo titolo
+        """
+        with self._lock:
+            if chat_id not in self._index:
+                return
+            record = {"op": OP_TITLE, "chat_id": chat_id, "title": new_title}
+            offset, size = self._append(record)
+            self._apply(self._index, record, offset, size)
+        self._maybe_compact()
+
+    def get_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce il riassunto della conversazione dall'indice
+
+        Args:
+            chat_id: L'ID della chat
+
+        Returns:
+            Un dizionario con il riassunto e il numero di messaggi riassunti (seq), o None
+        """
+        with self._lock:
+            chat = self._index.get(chat_id)
+            if chat is None or chat.get("summary") is None:
+                return None
+            return {"summary": chat["summary"]["summary"], "seq": chat["summary"]["seq"]}
+
+    def set_summary(self, chat_id: str, summary: str, seq: int) -> None:
+        """
+        Salva il riassunto della conversazione, se copre più messaggi di quello
+        già salvato (un aggiornamento concorrente più vecchio viene ignorato)
+
+        Args:
+            chat_id: L'ID della chat
+            summary: Il testo del riassunto
+            seq: Il numero di messaggi riassunti, dall'inizio della chat
+        """
+        with self._lock:
+            chat = self._index.get(chat_id)
+            if chat is None:
+                return
+            previous = chat.get("summary")
+            if previous is not None and previous["seq"] >= seq:
+                return
+            record = {"op": OP_SUMMARY, "chat_id": chat_id, "summary": summary, "seq": seq}
+            offset, size = self._append(record)
+            self._apply(self._index, record, offset, size)
+            self._live_bytes += size - (previous["size"] if previous else 0)
+        self._maybe_compact()
+
+    def delete_chat(self, chat_id: str) -> None:
+        """
+        Elimina una chat scrivendo un record di cancellazione
+
+        Args:
+            chat_id: L'ID della chat da eliminare
+        """
+        with self._lock:
+            if chat_id not in self._index:
+                return
+            record = {"op": OP_DELETE, "chat_id": chat_id}
+            self._live_bytes -= self._index[chat_id]["bytes"]
+            offset, size = self._append(record)
+            self._apply(self._index, record, offset, size)
+        self._maybe_compact()
+
+    def delete_all(self) -> None:
+        """
+        Elimina tutte le chat
+        """
+        with self._lock:
+            record = {"op": OP_CLEAR}
+            offset, size = self._append(record)
+            self._apply(self._index, record, offset, size)
+            self._live_bytes = 0
+        self._maybe_compact()
+
+    # ------------------------------------------------------------------
+    # Compattazione
+    # ------------------------------------------------------------------
+
+    def dead_bytes(self) -> int:
+        """
+        Restituisce il numero di byte del log non più referenziati dall'indice
+        """
+        with self._lock:
+            return self._file_size - self._live_bytes
+
+    def _maybe_compact(self) -> None:
+        """
+        Avvia la compattazione in background se lo spazio sprecato supera la soglia
+        """
+        with self._lock:
+            dead = self._file_size - self._live_bytes
+            if self._compacting or dead < self.compaction_min_bytes:
+                return
+            if dead < self._file_size * self.compaction_ratio:
+                return
+            self._compacting = True
+
+        thread = threading.Thread(target=self._compact_safely, name="chat-log-compaction", daemon=True)
+        thread.start()
+
+    def _compact_safely(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Errore durante la compattazione del log delle chat: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self) -> None:
+        """
+        Riscrive il log mantenendo solo le chat ancora presenti.
+
+        La copia dei record avviene senza bloccare le scritture: il log è
+        append-only, quindi gli offset fotografati restano validi. Solo la coda
+        scritta nel frattempo viene copiata e riapplicata sotto lock prima di
+        sostituire il file.
+        """
+        with self._lock:
+            snapshot = {
+                chat_id: {
+                    "title": chat["title"],
+                    "created_at": chat["created_at"],
+                    "offsets": list(chat["offsets"]),
+                    "summary": chat.get("summary"),
+                }
+                for chat_id, chat in self._index.items()
+            }
+            snapshot_end = self._file_size
+
+        tmp_path = self.log_path.with_suffix(self.log_path.suffix + ".compact")
+        new_index: Dict[str, Dict[str, Any]] = {}
+        new_size = 0
+
+        with open(self.log_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chat_id, chat in snapshot.items():
+                records = [{"op": OP_CHAT, "chat_id": chat_id, "title": chat["title"], "created_at": chat["created_at"]}]
+                records.extend(self._read_record(src, offset) for offset in chat["offsets"])
+                if chat["summary"] is not None:
+                    records.append({
+                        "op": OP_SUMMARY,
+                        "chat_id": chat_id,
+                        "summary": chat["summary"]["summary"],
+                        "seq": chat["summary"]["seq"],
+                    })
+                for record in records:
+                    data = _encode(record)
+                    dst.write(data)
+                    self._apply(new_index, record, new_size, len(data))
+                    new_size += len(data)
+
+            with self._lock:
+                # Copia i record aggiunti durante la compattazione
+                src.seek(snapshot_end)
+                for line in src:
+                    dst.write(line)
+                    self._apply(new_index, json.loads(line), new_size, len(line))
+                    new_size += len(line)
+                dst.flush()
+                os.fsync(dst.fileno())
+
+                self._append_file.close()
+                os.replace(tmp_path, self.log_path)
+                self._append_file = open(self.log_path, "ab")
+
+                old_size = self._file_size
+                self._index = new_index
+                self._file_size = new_size
+                self._live_bytes = sum(chat["bytes"] for chat in new_index.values())
+
+        logger.info(f"Log delle chat compattato: {old_size} -> {new_size} byte")
+
+    # ------------------------------------------------------------------
+    # Ricerca e migrazione
+    # ------------------------------------------------------------------
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Cerca i messaggi che contengono tutti i termini della query.
+        Il log non ha un indice testuale, quindi la ricerca scorre i messaggi
+        delle chat presenti: per archivi grandi è preferibile il backend SQLite.
+
+        Args:
+            query: Il testo da cercare
+            limit: Numero massimo di risultati
+
+        Returns:
+            Una lista di dizionari con i messaggi trovati
+        """
+        terms = [term.lower() for term in query.split() if term]
+        if not terms:
+            return []
+
+        results = []
+        with self._lock:
+            with open(self.log_path, "rb") as f:
+                for chat_id, chat in self._index.items():
+                    for offset in chat["offsets"]:
+                        record = self._read_record(f, offset)
+                        content_lower = record["content"].lower()
+                        if all(term in content_lower for term in terms):
+                            results.append({
+                                "chat_id": chat_id,
+                                "chat_title": chat["title"],
+                                "role": record["role"],
+                                "snippet": _make_snippet(record["content"], content_lower.find(terms[0])),
+                                "timestamp": record["timestamp"],
+                            })
+
+        # I messaggi più recenti per primi
+        results.sort(key=lambda x: x["timestamp"], reverse=True)
+        return results[:limit]
+
+    def import_chat(self, chat_id: str, title: str, created_at: str, updated_at: str, messages: List[Dict[str, Any]]) -> None:
+        """
+        Importa una chat completa (usato dalle migrazioni)
+
+        Args:
+            chat_id: L'ID della chat
+            title: Il titolo della chat
+            created_at: La data di creazione
+            updated_at: La data di ultimo aggiornamento
+            messages: I messaggi della chat in ordine cronologico
+        """
+        records = [{"op": OP_CHAT, "chat_id": chat_id, "title": title, "created_at": created_at}]
+        for msg in messages:
+            records.append({
+                "op": OP_MESSAGE,
+                "chat_id": chat_id,
+                "role": msg["role"],
+                "content": msg["content"],
+                "timestamp": msg["timestamp"],
+                "updated_at": updated_at,
+            })
+
+        with self._lock:
+            for record in records:
+                offset, size = self._append(record)
+                self._apply(self._index, record, offset, size)
+                self._live_bytes += size
+
+    def close(self) -> None:
+        """
+        Chiude il file di log
+        """
+        with self._lock:
+            if self._append_file is not None:
+                self._append_file.close()
+                self._append_file = None
@@ -1,11 +1,15 @@
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple, Union
+import asyncio
+import base64
 import json
 import os
 import logging
+import threading
 from pathlib import Path
 
-from app.schemas.chat import ChatMessage, ChatSession
+from app.schemas.chat import ChatMessage, ChatSession, ChatSearchResult
+from app.db.chat_log import ChatLogStore
+from app.db.chat_sqlite import SQLiteChatStore
 from app.config import settings
 
 # Configurazione logging
@@ -14,41 +18,130 @@ logger = logging.getLogger(__name__)
 # Percorso del file di database
 DB_DIR = Path(__file__).resolve().parent / "data"
 CHATS_FILE = DB_DIR / "chats.json"
+CHATS_LOG_FILE = DB_DIR / "chats.log"
 
-# Assicurati che la directory esista
-os.makedirs(DB_DIR, exist_ok=True)
+# Archivio delle chat (inizializzato al primo utilizzo)
+_store: Optional[Union[ChatLogStore, SQLiteChatStore]] = None
+_store_lock = threading.Lock()
 
-def _load_chats() -> Dict[str, Any]:
+def check_multiprocess_safe(workers: int) -> None:
     """
-    Carica le chat dal file JSON
+    Verifica che l'archivio delle chat configurato supporti più processi.
+    Il log append-only tiene l'indice delle chat nella memoria del processo:
+    con più worker le scritture concorrenti lo renderebbero incoerente
+    (e la compattazione potrebbe perdere messaggi). SQLite in modalità WAL
+    gestisce invece scrittori concorrenti da processi diversi.
+    
+    Args:
+        workers: Il numero di processi worker
+        
+    Raises:
+        RuntimeError: Se i worker sono più di uno e il backend non è "sqlite"
+    """
+    if workers > 1 and settings.CHAT_BACKEND != "sqlite":
+        raise RuntimeError(
+            f"CHAT_BACKEND={settings.CHAT_BACKEND} non supporta {workers} worker: "
+            "impostare CHAT_BACKEND=sqlite (le chat esistenti vengono importate al primo avvio)"
+        )
+
+def _get_store() -> Union[ChatLogStore, SQLiteChatStore]:
+    """
+    Restituisce l'archivio delle chat configurato in CHAT_BACKEND,
+    creandolo al primo utilizzo ed eseguendo le eventuali migrazioni.
     
     Returns:
-        Un dizionario con le chat caricate
+        L'archivio delle chat
     """
-    if not os.path.exists(CHATS_FILE):
-        return {"chats": {}}
+    global _store
     
-    try:
-        with open(CHATS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Errore nel caricamento delle chat: {e}")
-        return {"chats": {}}
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store(settings.CHAT_BACKEND)
+    
+    return _store
 
-def _save_chats(chats_data: Dict[str, Any]) -> None:
+def _create_store(backend: str) -> Union[ChatLogStore, SQLiteChatStore]:
     """
-    Salva le chat nel file JSON
+    Crea l'archivio per il backend indicato
     
     Args:
-        chats_data: Il dizionario delle chat da salvare
+        backend: "log" oppure "sqlite"
+        
+    Returns:
+        L'archivio delle chat
+    """
+    if backend == "sqlite":
+        store = SQLiteChatStore(settings.CHAT_SQLITE_PATH)
+        # Al primo avvio importa le chat già salvate nel log append-only
+        if store.is_empty() and os.path.exists(CHATS_LOG_FILE):
+            log_store = ChatLogStore(CHATS_LOG_FILE)
+            migrate_chats(log_store, store)
+            log_store.close()
+    elif backend == "log":
+        store = ChatLogStore(
+            CHATS_LOG_FILE,
+            compaction_ratio=settings.CHAT_LOG_COMPACTION_RATIO,
+            compaction_min_bytes=settings.CHAT_LOG_COMPACTION_MIN_BYTES
+        )
+    else:
+        raise ValueError(f"Backend delle chat non supportato: {backend}")
+    
+    if os.path.exists(CHATS_FILE):
+        migrate_json_chats(store)
+    
+    return store
+
+def migrate_json_chats(store: Union[ChatLogStore, SQLiteChatStore]) -> None:
+    """
+    Migra una sola volta le chat dal vecchio chats.json all'archivio configurato.
+    Il file originale viene rinominato in chats.json.migrated.
+    
+    Args:
+        store: L'archivio in cui importare le chat
     """
     try:
-        with open(CHATS_FILE, "w", encoding="utf-8") as f:
-            json.dump(chats_data, f, ensure_ascii=False, indent=2)
+        with open(CHATS_FILE, "r", encoding="utf-8") as f:
+            chats_data = json.load(f)
+        
+        chats = chats_data.get("chats", {})
+        for chat_id, chat_data in chats.items():
+            store.import_chat(
+                chat_id,
+                chat_data["title"],
+                chat_data["created_at"],
+                chat_data["updated_at"],
+                chat_data.get("messages", [])
+            )
+        
+        os.replace(CHATS_FILE, CHATS_FILE.with_suffix(".json.migrated"))
+        logger.info(f"Migrate {len(chats)} chat da {CHATS_FILE}")
     except Exception as e:
-        logger.error(f"Errore nel salvataggio delle chat: {e}")
+        logger.error(f"Errore nella migrazione delle chat: {e}")
         raise
 
+def migrate_chats(source: Union[ChatLogStore, SQLiteChatStore], target: Union[ChatLogStore, SQLiteChatStore]) -> None:
+    """
+    Copia tutte le chat da un archivio all'altro (es. dal log a SQLite)
+    
+    Args:
+        source: L'archivio di origine
+        target: L'archivio di destinazione
+    """
+    chats = source.list_chats()
+    for chat_data in chats:
+        target.import_chat(
+            chat_data["id"],
+            chat_data["title"],
+            chat_data["created_at"],
+            chat_data["updated_at"],
+            source.get_messages(chat_data["id"])
+        )
+        summary = source.get_summary(chat_data["id"])
+        if summary is not None:
+            target.set_summary(chat_data["id"], summary["summary"], summary["seq"])
+    logger.info(f"Migrate {len(chats)} chat nel backend {settings.CHAT_BACKEND}")
+
 def get_chat_history(chat_id: str) -> List[ChatMessage]:
     """
     Recupera lo storico messaggi di una chat
@@ -59,17 +152,39 @@ def get_chat_history(chat_id: str) -> List[ChatMessage]:
     Returns:
         Una lista di messaggi
     """
-    chats_data = _load_chats()
-    
-    if chat_id not in chats_data["chats"]:
-        return []
-    
     # Converti i dati grezzi in oggetti ChatMessage
-    messages = []
-    for msg_data in chats_data["chats"][chat_id]["messages"]:
-        messages.append(ChatMessage(**msg_data))
+    return [ChatMessage(**msg_data) for msg_data in _get_store().get_messages(chat_id)]
+
+def get_chat_history_page(chat_id: str, limit: int, before: Optional[int] = None) -> Tuple[List[ChatMessage], Optional[int]]:
+    """
+    Recupera una pagina dello storico messaggi, dalla più recente verso la più vecchia.
+    Vengono letti solo i messaggi della pagina richiesta.
+    
+    Args:
+        chat_id: L'ID della chat
+        limit: Numero massimo di messaggi da restituire
+        before: Cursore (seq) del messaggio più vecchio già caricato (opzionale)
+        
+    Returns:
+        Una tupla con i messaggi in ordine cronologico e il cursore per la pagina
+        precedente (None se non ci sono messaggi più vecchi)
+    """
+    messages = [ChatMessage(**msg_data) for msg_data in _get_store().get_messages(chat_id, limit, before)]
+    next_before = messages[0].seq if messages and messages[0].seq > 0 else None
+    return messages, next_before
+
+def get_chat_session(chat_id: str) -> Optional[ChatSession]:
+    """
+    Recupera i metadati di una singola chat
     
-    return messages
+    Args:
+        chat_id: L'ID della chat
+        
+    Returns:
+        La sessione di chat, o None se non esiste
+    """
+    chat_data = _get_store().get_chat(chat_id)
+    return ChatSession(**chat_data) if chat_data is not None else None
 
 def save_chat_message(chat_id: str, message: str, role: str, timestamp: Optional[str] = None) -> None:
     """
@@ -81,39 +196,39 @@ def save_chat_message(chat_id: str, message: str, role: str, timestamp: Optional
         role: Il ruolo (user o assistant)
         timestamp: Il timestamp del messaggio (opzionale)
     """
-    chats_data = _load_chats()
-    
-    # Se la chat non esiste, creala
-    if chat_id not in chats_data["chats"]:
-        chats_data["chats"][chat_id] = {
-            "id": chat_id,
-            "title": f"Chat {len(chats_data['chats']) + 1}",
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
-            "messages": []
-        }
-    
-    # Aggiorna il timestamp dell'ultima modifica
-    chats_data["chats"][chat_id]["updated_at"] = datetime.now().isoformat()
-    
-    # Se è il primo messaggio dell'utente, usa parte del testo come titolo
-    if role == "user" and len(chats_data["chats"][chat_id]["messages"]) == 0:
-        title = message[:30] + "..." if len(message) > 30 else message
-        chats_data["chats"][chat_id]["title"] = title
-    
-    # Crea il nuovo messaggio
-    new_message = {
-        "chat_id": chat_id,
-        "role": role,
-        "content": message,
-        "timestamp": timestamp or datetime.now().isoformat(),
-    }
+    try:
+        _get_store().append_message(chat_id, message, role, timestamp)
+    except Exception as e:
+        logger.error(f"Errore nel salvataggio del messaggio: {e}")
+        raise
+
+def get_chat_summary(chat_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Recupera il riassunto della conversazione salvato con la chat
     
-    # Aggiungi il messaggio alla chat
-    chats_data["chats"][chat_id]["messages"].append(new_message)
+    Args:
+        chat_id: L'ID della chat
+        
+    Returns:
+        Un dizionario con il riassunto ("summary") e il numero di messaggi
+        riassunti dall'inizio della chat ("seq"), o None se non esiste
+    """
+    return _get_store().get_summary(chat_id)
+
+def save_chat_summary(chat_id: str, summary: str, seq: int) -> None:
+    """
+    Salva il riassunto della conversazione di una chat
     
-    # Salva le modifiche
-    _save_chats(chats_data)
+    Args:
+        chat_id: L'ID della chat
+        summary: Il testo del riassunto
+        seq: Il numero di messaggi riassunti dall'inizio della chat
+    """
+    try:
+        _get_store().set_summary(chat_id, summary, seq)
+    except Exception as e:
+        logger.error(f"Errore nel salvataggio del riassunto della chat: {e}")
+        raise
 
 def delete_chat(chat_id: str) -> None:
     """
@@ -122,17 +237,13 @@ def delete_chat(chat_id: str) -> None:
     Args:
         chat_id: L'ID della chat da eliminare
     """
-    chats_data = _load_chats()
-    
-    if chat_id in chats_data["chats"]:
-        del chats_data["chats"][chat_id]
-        _save_chats(chats_data)
+    _get_store().delete_chat(chat_id)
 
 def delete_all_chats() -> None:
     """
     Elimina tutte le chat
     """
-    _save_chats({"chats": {}})
+    _get_store().delete_all()
 
 def get_all_chats() -> List[ChatSession]:
     """
@@ -141,25 +252,58 @@ def get_all_chats() -> List[ChatSession]:
     Returns:
         Una lista di tutte le sessioni di chat
     """
-    chats_data = _load_chats()
-    
-    # Converti i dati grezzi in oggetti ChatSession
-    chat_sessions = []
-    for chat_id, chat_data in chats_data["chats"].items():
-        session = ChatSession(
-            id=chat_id,
-            title=chat_data["title"],
-            created_at=chat_data["created_at"],
-            updated_at=chat_data["updated_at"],
-            message_count=len(chat_data["messages"])
-        )
-        chat_sessions.append(session)
+    # I metadati arrivano dall'indice (in memoria o SQLite), senza leggere i messaggi
+    chat_sessions = [ChatSession(**chat_data) for chat_data in _get_store().list_chats()]
     
     # Ordina per data di aggiornamento (più recente prima)
     chat_sessions.sort(key=lambda x: x.updated_at, reverse=True)
     
     return chat_sessions
 
+def _encode_chat_cursor(session: ChatSession) -> str:
+    """
+    Codifica la posizione di una chat nell'elenco in un cursore opaco
+    """
+    raw = f"{session.updated_at}|{session.id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_chat_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decodifica un cursore dell'elenco chat nella coppia (updated_at, id)
+    
+    Raises:
+        ValueError: Se il cursore non è valido
+    """
+    try:
+        updated_at, chat_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+    except Exception:
+        raise ValueError(f"Cursore non valido: {cursor}")
+    return updated_at, chat_id
+
+def get_chats_page(limit: int, before: Optional[str] = None) -> Tuple[List[ChatSession], Optional[str]]:
+    """
+    Recupera una pagina dell'elenco chat, ordinato per data di aggiornamento
+    
+    Args:
+        limit: Numero massimo di chat da restituire
+        before: Cursore restituito dalla pagina precedente (opzionale)
+        
+    Returns:
+        Una tupla con le sessioni di chat e il cursore per la pagina successiva
+        (None se non ci sono altre chat)
+    """
+    cursor = _decode_chat_cursor(before) if before else None
+    
+    # Chiede un elemento in più per sapere se esiste una pagina successiva
+    chats_data = _get_store().list_chats(limit + 1, cursor)
+    chat_sessions = [ChatSession(**chat_data) for chat_data in chats_data[:limit]]
+    
+    next_before = None
+    if len(chats_data) > limit:
+        next_before = _encode_chat_cursor(chat_sessions[-1])
+    
+    return chat_sessions, next_before
+
 def update_chat_title(chat_id: str, new_title: str) -> None:
     """
     Aggiorna il titolo di una chat
@@ -168,8 +312,75 @@ def update_chat_title(chat_id: str, new_title: str) -> None:
         chat_id: L'ID della chat
         new_title: Il nuovo titolo
     """
-    chats_data = _load_chats()
+    _get_store().update_title(chat_id, new_title)
+
+def search_messages(query: str, limit: int = 20) -> List[ChatSearchResult]:
+    """
+    Cerca un testo nei messaggi di tutte le chat
     
-    if chat_id in chats_data["chats"]:
-        chats_data["chats"][chat_id]["title"] = new_title
-        _save_chats(chats_data)
+    Args:
+        query: Il testo da cercare
+        limit: Numero massimo di risultati
+        
+    Returns:
+        Una lista di risultati con chat, ruolo ed estratto del messaggio
+    """
+    return [ChatSearchResult(**result) for result in _get_store().search(query, limit)]
+
+# Versioni asincrone per i gestori async: l'accesso all'archivio (con SQLite
+# un BEGIN IMMEDIATE può attendere fino a 30 s il lock di un altro processo)
+# avviene in un thread, senza bloccare il loop di eventi
+
+async def aget_chat_history_page(chat_id: str, limit: int, before: Optional[int] = None) -> Tuple[List[ChatMessage], Optional[int]]:
+    """
+    Versione asincrona di get_chat_history_page
+    """
+    return await asyncio.to_thread(get_chat_history_page, chat_id, limit, before)
+
+async def aget_chat_session(chat_id: str) -> Optional[ChatSession]:
+    """
+    Versione asincrona di get_chat_session
+    """
+    return await asyncio.to_thread(get_chat_session, chat_id)
+
+async def asave_chat_message(chat_id: str, message: str, role: str, timestamp: Optional[str] = None) -> None:
+    """
+    Versione asincrona di save_chat_message
+    """
+    await asyncio.to_thread(save_chat_message, chat_id, message, role, timestamp)
+
+async def aget_chat_summary(chat_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Versione asincrona di get_chat_summary
+    """
+    return await asyncio.to_thread(get_chat_summary, chat_id)
+
+async def asave_chat_summary(chat_id: str, summary: str, seq: int) -> None:
+    """
+    Versione asincrona di save_chat_summary
+    """
+    await asyncio.to_thread(save_chat_summary, chat_id, summary, seq)
+
+async def adelete_chat(chat_id: str) -> None:
+    """
+    Versione asincrona di delete_chat
+    """
+    await asyncio.to_thread(delete_chat, chat_id)
+
+async def adelete_all_chats() -> None:
+    """
+    Versione asincrona di delete_all_chats
+    """
+    await asyncio.to_thread(delete_all_chats)
+
+async def aget_chats_page(limit: int, before: Optional[str] = None) -> Tuple[List[ChatSession], Optional[str]]:
+    """
+    Versione asincrona di get_chats_page
+    """
+    return await asyncio.to_thread(get_chats_page, limit, before)
+
+async def asearch_messages(query: str, limit: int = 20) -> List[ChatSearchResult]:
+    """
+    Versione asincrona di search_messages
+    """
+    return await asyncio.to_thread(search_messages, query, limit)
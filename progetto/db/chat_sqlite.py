@@ -0,0 +1,383 @@
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime
+import os
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_chats_updated_at ON chats(updated_at, id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp ON messages(chat_id, timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_seq ON messages(chat_id, seq);
+
+CREATE TABLE IF NOT EXISTS chat_memory (
+    chat_id TEXT PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+# Indice full-text sul contenuto dei messaggi, mantenuto dai trigger
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+
+def _fts_query(query: str) -> str:
+    """
+    Converte il testo dell'utente in una query FTS5 sicura:
+    ogni termine viene quotato, così la sintassi FTS non viene interpretata
+    """
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class SQLiteChatStore:
+    """
+    Archivio delle chat su SQLite in modalità WAL.
+
+    I metadati delle chat (compreso il numero di messaggi) sono in una tabella
+    indicizzata per updated_at, i messaggi per (chat_id, timestamp) e il loro
+    contenuto è indicizzato con FTS5 per la ricerca full-text. Il riassunto
+    della conversazione è salvato in chat_memory, una riga per chat.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._fts_enabled = True
+
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Restituisce la connessione del thread corrente, aprendola se necessario
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        try:
+            conn.executescript(_FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            # SQLite compilato senza FTS5: la ricerca ripiega su LIKE
+            logger.warning(f"FTS5 non disponibile ({e}), la ricerca userà LIKE")
+            self._fts_enabled = False
+
+    def is_empty(self) -> bool:
+        """
+        Indica se l'archivio non contiene ancora nessuna chat
+        """
+        return self._connect().execute("SELECT 1 FROM chats LIMIT 1").fetchone() is None
+
+    def append_message(self, chat_id: str, message: str, role: str, timestamp: Optional[str] = None) -> None:
+        """
+        Aggiunge un messaggio a una chat, creandola se non esiste
+
+        Args:
+            chat_id: L'ID della chat
+            message: Il contenuto del messaggio
+            role: Il ruolo (user o assistant)
+            timestamp: Il timestamp del messaggio (opzionale)
+        """
+        now = datetime.now().isoformat()
+        conn = self._connect()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT message_count FROM chats WHERE id = ?", (chat_id,)).fetchone()
+            if row is None:
+                count = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+                conn.execute(
+                    "INSERT INTO chats (id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)",
+                    (chat_id, f"Chat {count + 1}", now, now)
+                )
+                message_count = 0
+            else:
+                message_count = row["message_count"]
+
+            # Se è il primo messaggio dell'utente, usa parte del testo come titolo
+            if role == "user" and message_count == 0:
+                title = message[:30] + "..." if len(message) > 30 else message
+                conn.execute("UPDATE chats SET title = ? WHERE id = ?", (title, chat_id))
+
+            conn.execute(
+                "INSERT INTO messages (chat_id, seq, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, message_count, role, message, timestamp or now)
+            )
+            conn.execute(
+                "UPDATE chats SET updated_at = ?, message_count = message_count + 1 WHERE id = ?",
+                (now, chat_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_messages(self, chat_id: str, limit: Optional[int] = None, before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Recupera i messaggi di una chat in ordine cronologico.
+        Con limit/before viene letta solo la pagina richiesta tramite l'indice (chat_id, seq).
+
+        Args:
+            chat_id: L'ID della chat
+            limit: Numero massimo di messaggi (opzionale, tutti se assente)
+            before: Restituisce solo i messaggi con seq minore di questo valore (opzionale)
+
+        Returns:
+            Una lista di dizionari con i dati dei messaggi
+        """
+        query = "SELECT chat_id, seq, role, content, timestamp FROM messages WHERE chat_id = ?"
+        params: List[Any] = [chat_id]
+        if before is not None:
+            query += " AND seq < ?"
+            params.append(before)
+        query += " ORDER BY seq DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        rows = self._connect().execute(query, params).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def get_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce i metadati di una chat
+
+        Args:
+            chat_id: L'ID della chat
+
+        Returns:
+            Un dizionario con id, titolo, date e numero di messaggi, o None se non esiste
+        """
+        row = self._connect().execute(
+            "SELECT id, title, created_at, updated_at, message_count FROM chats WHERE id = ?",
+            (chat_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_chats(self, limit: Optional[int] = None, before: Optional[Tuple[str, str]] = None) -> List[Dict[str, Any]]:
+        """
+        Restituisce i metadati delle chat, già ordinati per aggiornamento
+
+        Args:
+            limit: Numero massimo di chat (opzionale, tutte se assente)
+            before: Cursore (updated_at, id) dell'ultima chat della pagina precedente (opzionale)
+
+        Returns:
+            Una lista di dizionari con id, titolo, date e numero di messaggi
+        """
+        query = "SELECT id, title, created_at, updated_at, message_count FROM chats"
+        params: List[Any] = []
+        if before is not None:
+            query += " WHERE (updated_at, id) < (?, ?)"
+            params.extend(before)
+        query += " ORDER BY updated_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        rows = self._connect().execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def update_title(self, chat_id: str, new_title: str) -> None:
+        """
+        Aggiorna il titolo di una chat
+
+        Args:
+            chat_id: L'ID della chat
+            new_title: Il nuovo titolo
+        """
+        self._connect().execute("UPDATE chats SET title = ? WHERE id = ?", (new_title, chat_id))
+
+    def delete_chat(self, chat_id: str) -> None:
+        """
+        Elimina una chat e i suoi messaggi
+
+        Args:
+            chat_id: L'ID della chat da eliminare
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM chat_memory WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_all(self) -> None:
+        """
+        Elimina tutte le chat
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM chat_memory")
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM chats")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce il riassunto della conversazione
+
+        Args:
+            chat_id: L'ID della chat
+
+        Returns:
+            Un dizionario con il riassunto e il numero di messaggi riassunti (seq), o None
+        """
+        row = self._connect().execute(
+            "SELECT summary, seq FROM chat_memory WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def set_summary(self, chat_id: str, summary: str, seq: int) -> None:
+        """
+        Salva il riassunto della conversazione, se copre più messaggi di quello
+        già salvato (un aggiornamento concorrente più vecchio viene ignorato)
+
+        Args:
+            chat_id: L'ID della chat
+            summary: Il testo del riassunto
+            seq: Il numero di messaggi riassunti, dall'inizio della chat
+        """
+        self._connect().execute(
+            """
+            INSERT INTO chat_memory (chat_id, summary, seq, updated_at)
+            SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM chats WHERE id = ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                summary = excluded.summary, seq = excluded.seq, updated_at = excluded.updated_at
+            WHERE excluded.seq > chat_memory.seq
+            """,
+            (chat_id, summary, seq, datetime.now().isoformat(), chat_id)
+        )
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Cerca nei messaggi tramite l'indice full-text
+
+        Args:
+            query: Il testo da cercare
+            limit: Numero massimo di risultati
+
+        Returns:
+            Una lista di dizionari con i messaggi trovati, i più rilevanti per primi
+        """
+        if not query.split():
+            return []
+
+        conn = self._connect()
+        if self._fts_enabled:
+            rows = conn.execute(
+                """
+                SELECT m.chat_id, c.title AS chat_title, m.role, m.timestamp,
+                       snippet(messages_fts, 0, '**', '**', '…', 16) AS snippet
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                JOIN chats c ON c.id = m.chat_id
+                WHERE messages_fts MATCH ?
+                ORDER BY bm25(messages_fts)
+                LIMIT ?
+                """,
+                (_fts_query(query), limit)
+            ).fetchall()
+        else:
+            conditions = " AND ".join("m.content LIKE ?" for _ in query.split())
+            rows = conn.execute(
+                f"""
+                SELECT m.chat_id, c.title AS chat_title, m.role, m.timestamp,
+                       substr(m.content, 1, 80) AS snippet
+                FROM messages m JOIN chats c ON c.id = m.chat_id
+                WHERE {conditions}
+                ORDER BY m.timestamp DESC
+                LIMIT ?
+                """,
+                [f"%{term}%" for term in query.split()] + [limit]
+            ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def import_chat(self, chat_id: str, title: str, created_at: str, updated_at: str, messages: List[Dict[str, Any]]) -> None:
+        """
+        Importa una chat completa (usato dalle migrazioni)
+
+        Args:
+            chat_id: L'ID della chat
+            title: Il titolo della chat
+            created_at: La data di creazione
+            updated_at: La data di ultimo aggiornamento
+            messages: I messaggi della chat in ordine cronologico
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO chats (id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, title, created_at, updated_at, len(messages))
+            )
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            conn.executemany(
+                "INSERT INTO messages (chat_id, seq, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(chat_id, seq, msg["role"], msg["content"], msg["timestamp"]) for seq, msg in enumerate(messages)]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        """
+        Chiude la connessione del thread corrente
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,159 @@
+from typing import Optional
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+from app.config import settings
+from app.core.diet_plan import dump_plan, load_plan
+from app.models.diet import DietPlan
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diet_plans (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    plan BLOB NOT NULL
+);
+"""
+
+
+class DietPlanStore:
+    """
+    Archivio dei piani dietetici strutturati su SQLite in modalità WAL.
+
+    Ogni piano è salvato come JSON compatto (senza campi vuoti) compresso con
+    zlib: un piano settimanale occupa pochi KB invece del testo generato.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Restituisce la connessione del thread corrente, aprendola se necessario
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, plan: DietPlan) -> None:
+        """
+        Salva (o sostituisce) un piano
+
+        Args:
+            plan: Il piano dietetico
+        """
+        data = zlib.compress(dump_plan(plan).encode("utf-8"))
+        self._connect().execute(
+            "INSERT OR REPLACE INTO diet_plans (id, created_at, plan) VALUES (?, ?, ?)",
+            (plan.id, plan.created_at.isoformat(), data)
+        )
+
+    def get(self, plan_id: str) -> Optional[DietPlan]:
+        """
+        Recupera un piano
+
+        Args:
+            plan_id: L'ID del piano
+
+        Returns:
+            Il piano, oppure None se non esiste
+        """
+        row = self._connect().execute("SELECT plan FROM diet_plans WHERE id = ?", (plan_id,)).fetchone()
+        if row is None:
+            return None
+        return load_plan(zlib.decompress(row[0]).decode("utf-8"))
+
+    def delete(self, plan_id: str) -> bool:
+        """
+        Elimina un piano
+
+        Args:
+            plan_id: L'ID del piano
+
+        Returns:
+            True se il piano esisteva
+        """
+        cursor = self._connect().execute("DELETE FROM diet_plans WHERE id = ?", (plan_id,))
+        return cursor.rowcount > 0
+
+
+# Archivio dei piani (inizializzato al primo utilizzo)
+_store: Optional[DietPlanStore] = None
+_store_lock = threading.Lock()
+
+
+def _get_store() -> DietPlanStore:
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DietPlanStore(settings.DIET_PLAN_DB_PATH)
+
+    return _store
+
+
+def save_diet_plan(plan: DietPlan) -> str:
+    """
+    Salva un piano dietetico strutturato
+
+    Args:
+        plan: Il piano dietetico
+
+    Returns:
+        L'ID del piano
+    """
+    try:
+        _get_store().save(plan)
+        return plan.id
+    except Exception as e:
+        logger.error(f"Errore nel salvataggio del piano dietetico: {e}")
+        raise
+
+
+def get_diet_plan(plan_id: str) -> Optional[DietPlan]:
+    """
+    Recupera un piano dietetico strutturato
+
+    Args:
+        plan_id: L'ID del piano
+
+    Returns:
+        Il piano, oppure None se non esiste
+    """
+    try:
+        return _get_store().get(plan_id)
+    except Exception as e:
+        logger.error(f"Errore nel recupero del piano dietetico: {e}")
+        raise
+
+
+def delete_diet_plan(plan_id: str) -> bool:
+    """
+    Elimina un piano dietetico strutturato
+
+    Args:
+        plan_id: L'ID del piano
+
+    Returns:
+        True se il piano esisteva
+    """
+    try:
+        return _get_store().delete(plan_id)
+    except Exception as e:
+        logger.error(f"Errore nell'eliminazione del piano dietetico: {e}")
+        raise
@@ -0,0 +1,275 @@
+from typing import Dict, Any, Optional
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+from app.config import settings
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Stati di un job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result BLOB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+_COLUMNS = "id, kind, status, payload, result, error, attempts, worker, lease_until, created_at, started_at, finished_at"
+
+
+class JobStore:
+    """
+    Coda persistente dei job su SQLite in modalità WAL, condivisa tra i worker.
+
+    Un job in esecuzione è assegnato a un worker con un lease che il worker
+    rinnova periodicamente: se il processo termina senza completarlo, allo
+    scadere del lease il job torna disponibile e viene ripreso (fino a
+    max_attempts tentativi), anche dopo un riavvio.
+    """
+
+    def __init__(self, db_path: Path, max_attempts: int = 3):
+        self.db_path = Path(db_path)
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Restituisce la connessione del thread corrente, aprendola se necessario
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(zlib.decompress(job["result"]).decode("utf-8")) if job["result"] else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Aggiunge un job in coda
+
+        Args:
+            kind: Il tipo di job (es. "diet")
+            payload: I parametri del job
+
+        Returns:
+            Il job creato
+        """
+        job_id = str(uuid.uuid4())
+        self._connect().execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(payload, ensure_ascii=False), time.time())
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Recupera un job
+
+        Args:
+            job_id: L'ID del job
+
+        Returns:
+            Il job, oppure None se non esiste
+        """
+        row = self._connect().execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    def queue_position(self, job: Dict[str, Any]) -> int:
+        """
+        Numero di job in coda prima di quello indicato
+        """
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+            (QUEUED, job["created_at"])
+        ).fetchone()[0]
+
+    def claim(self, worker: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Assegna al worker il job in coda più vecchio, oppure un job in
+        esecuzione il cui lease è scaduto (worker terminato)
+
+        Args:
+            worker: L'identificativo del worker
+            lease_seconds: Durata del lease in secondi
+
+        Returns:
+            Il job assegnato, oppure None se la coda è vuota
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                row = conn.execute(
+                    """
+                    SELECT id, attempts FROM jobs
+                    WHERE status = ? OR (status = ? AND lease_until < ?)
+                    ORDER BY created_at LIMIT 1
+                    """,
+                    (QUEUED, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] < self.max_attempts:
+                    break
+                # Interrotto troppe volte (es. il processo viene terminato durante il job)
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, worker = NULL, lease_until = NULL WHERE id = ?",
+                    (FAILED, f"Job interrotto dopo {row['attempts']} tentativi", now, row["id"])
+                )
+
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_until = ?,
+                       started_at = ?, error = NULL
+                WHERE id = ?
+                """,
+                (RUNNING, worker, now + lease_seconds, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["id"])
+
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        """
+        Rinnova il lease di un job in esecuzione
+
+        Returns:
+            False se il job non è più assegnato al worker
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+            (time.time() + lease_seconds, job_id, worker, RUNNING)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        """
+        Segna un job come completato e ne salva il risultato (JSON compresso)
+
+        Returns:
+            False se il job non era più assegnato al worker
+        """
+        data = zlib.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        cursor = self._connect().execute(
+            """
+            UPDATE jobs SET status = ?, result = ?, finished_at = ?, worker = NULL, lease_until = NULL
+            WHERE id = ? AND worker = ? AND status = ?
+            """,
+            (DONE, data, time.time(), job_id, worker, RUNNING)
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        """
+        Segna un job come fallito
+
+        Returns:
+            False se il job non era più assegnato al worker
+        """
+        cursor = self._connect().execute(
+            """
+            UPDATE jobs SET status = ?, error = ?, finished_at = ?, worker = NULL, lease_until = NULL
+            WHERE id = ? AND worker = ? AND status = ?
+            """,
+            (FAILED, error, time.time(), job_id, worker, RUNNING)
+        )
+        return cursor.rowcount > 0
+
+    def release(self, job_id: str, worker: str) -> None:
+        """
+        Rimette in coda un job interrotto allo spegnimento, senza contare il tentativo
+        """
+        self._connect().execute(
+            """
+            UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), worker = NULL,
+                   lease_until = NULL, started_at = NULL
+            WHERE id = ? AND worker = ? AND status = ?
+            """,
+            (QUEUED, job_id, worker, RUNNING)
+        )
+
+    def purge(self, older_than_seconds: float) -> int:
+        """
+        Elimina i job conclusi da più di older_than_seconds
+
+        Returns:
+            Il numero di job eliminati
+        """
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - older_than_seconds)
+        )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, Any]:
+        """
+        Numero di job per stato e attesa del job in coda più vecchio
+        """
+        conn = self._connect()
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)
+        ).fetchone()[0]
+        counts["oldest_queued_seconds"] = round(time.time() - oldest, 1) if oldest is not None else 0.0
+        return counts
+
+
+# Coda dei job (inizializzata al primo utilizzo)
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    Restituisce la coda dei job, creandola al primo utilizzo
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = JobStore(settings.JOBS_DB_PATH, max_attempts=settings.JOBS_MAX_ATTEMPTS)
+
+    return _store
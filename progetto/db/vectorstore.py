@@ -0,0 +1,545 @@
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+from llama_index.core import StorageContext
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+from app.config import settings
+from app.db.ann_index import IVFIndex, IVF_FILE_PATTERN
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# File del vectorstore su memoria mappata
+NODES_DB_FILE = "nodes.db"
+VECTORS_FILE_PATTERN = "vectors.{generation}.npy"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    ref_doc_id TEXT,
+    position INTEGER,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_ref_doc_id ON nodes(ref_doc_id);
+CREATE INDEX IF NOT EXISTS idx_nodes_position ON nodes(position);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class MemmapVectorStore(BasePydanticVectorStore):
+    """
+    Vector store con gli embedding in un file .npy float32 contiguo, aperto in
+    memoria mappata, e testo e metadati dei chunk in SQLite.
+
+    All'avvio non viene letto nessun embedding: il file viene mappato in memoria
+    e le pagine sono condivise tra i worker tramite la cache del sistema operativo.
+    Gli embedding sono salvati già normalizzati, quindi la similarità coseno è un
+    unico prodotto matrice-vettore seguito da argpartition.
+
+    Le modifiche (aggiunte e rimozioni) restano in memoria fino a persist(), che
+    scrive una nuova generazione del file .npy e aggiorna i chunk in un'unica
+    transazione: un'interruzione lascia valida la generazione precedente. Gli
+    embedding aggiunti restano in blocchi separati e vengono uniti alla matrice
+    con un'unica copia, alla prima query o direttamente nel file in persist().
+
+    Oltre ANN_MIN_VECTORS chunk, persist() costruisce anche un indice IVF e le
+    query esplorano solo ANN_NPROBE liste invece di confrontare tutti i vettori.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    persist_dir: str
+
+    _lock: threading.RLock = PrivateAttr()
+    _conn: sqlite3.Connection = PrivateAttr()
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+    _pending_vectors: List[np.ndarray] = PrivateAttr(default_factory=list)
+    _node_ids: List[str] = PrivateAttr(default_factory=list)
+    _positions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _generation: int = PrivateAttr(default=0)
+    _pending_rows: Dict[str, tuple] = PrivateAttr(default_factory=dict)
+    _pending_deletes: set = PrivateAttr(default_factory=set)
+    _dirty: bool = PrivateAttr(default=False)
+    _ann: Optional[IVFIndex] = PrivateAttr(default=None)
+
+    def __init__(self, persist_dir: str, reset: bool = False, **kwargs: Any):
+        """
+        Args:
+            persist_dir: La directory dei file del vectorstore
+            reset: Se True parte da un vectorstore vuoto; i chunk esistenti
+                vengono rimossi da disco solo al prossimo persist()
+        """
+        super().__init__(persist_dir=str(persist_dir), **kwargs)
+        os.makedirs(self.persist_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._conn.executescript(_SCHEMA)
+
+        if reset:
+            self.clear()
+        else:
+            self._load()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MemmapVectorStore"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            os.path.join(self.persist_dir, NODES_DB_FILE),
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def reopen(self) -> None:
+        """
+        Apre una nuova connessione SQLite nel processo figlio dopo un fork: una
+        connessione non può essere condivisa tra processi. La matrice mappata
+        resta condivisa tramite la cache delle pagine del sistema operativo
+        """
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "MemmapVectorStore":
+        return cls(persist_dir=persist_dir)
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.persist_dir, VECTORS_FILE_PATTERN.format(generation=generation))
+
+    def _ann_path(self, generation: int) -> str:
+        return os.path.join(self.persist_dir, IVF_FILE_PATTERN.format(generation=generation))
+
+    def _load(self) -> None:
+        """
+        Mappa in memoria la generazione corrente degli embedding
+        """
+        self._generation = self._read_generation()
+        self._node_ids = [
+            node_id for (node_id,) in
+            self._conn.execute("SELECT node_id FROM nodes ORDER BY position").fetchall()
+        ]
+        self._positions = {node_id: i for i, node_id in enumerate(self._node_ids)}
+
+        path = self._vectors_path(self._generation)
+        if self._node_ids and os.path.exists(path):
+            self._matrix = np.load(path, mmap_mode="r")
+            if self._matrix.shape[0] != len(self._node_ids):
+                raise ValueError(
+                    f"Vectorstore incoerente: {self._matrix.shape[0]} embedding per {len(self._node_ids)} chunk"
+                )
+        else:
+            self._matrix = None
+
+        self._ann = IVFIndex.load(self._ann_path(self._generation)) if settings.ANN_ENABLED else None
+        if self._ann is not None and self._ann.n_vectors != len(self._node_ids):
+            logger.warning("Indice IVF non allineato agli embedding, verrà usata la ricerca esatta")
+            self._ann = None
+
+    def _read_generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    @property
+    def num_nodes(self) -> int:
+        """
+        Numero di chunk nel vectorstore
+        """
+        return len(self._node_ids)
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        """
+        Aggiunge chunk con il relativo embedding
+        """
+        if not nodes:
+            return []
+
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+
+        with self._lock:
+            # Un chunk già presente viene sostituito
+            existing = [node.node_id for node in nodes if node.node_id in self._positions]
+            if existing:
+                self._remove_rows(existing)
+
+            for node in nodes:
+                metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=self.flat_metadata)
+                self._pending_rows[node.node_id] = (node.ref_doc_id, node.get_content(), json.dumps(metadata, ensure_ascii=False))
+                self._pending_deletes.discard(node.node_id)
+
+            start = len(self._node_ids)
+            self._pending_vectors.append(vectors)
+            for i, node in enumerate(nodes):
+                self._node_ids.append(node.node_id)
+                self._positions[node.node_id] = start + i
+            self._dirty = True
+            self._ann = None
+
+        return [node.node_id for node in nodes]
+
+    def _vector_blocks(self) -> List[np.ndarray]:
+        """
+        La matrice corrente seguita dai blocchi aggiunti dopo di essa
+        """
+        return ([self._matrix] if self._matrix is not None else []) + self._pending_vectors
+
+    def _vectors(self) -> Optional[np.ndarray]:
+        """
+        Restituisce la matrice di tutti gli embedding, unendo con un'unica
+        copia i blocchi aggiunti dall'ultima unione
+        """
+        if self._pending_vectors:
+            blocks = self._vector_blocks()
+            self._matrix = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+            self._pending_vectors = []
+        return self._matrix
+
+    def _remove_rows(self, node_ids: List[str]) -> None:
+        """
+        Rimuove dalla matrice in memoria le righe dei chunk indicati
+        """
+        positions = [self._positions[node_id] for node_id in node_ids if node_id in self._positions]
+        if not positions:
+            return
+
+        keep = np.ones(len(self._node_ids), dtype=bool)
+        keep[positions] = False
+        self._matrix = np.asarray(self._vectors())[keep] if keep.any() else None
+        self._node_ids = [node_id for node_id, kept in zip(self._node_ids, keep) if kept]
+        self._positions = {node_id: i for i, node_id in enumerate(self._node_ids)}
+        self._dirty = True
+        self._ann = None
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """
+        Rimuove tutti i chunk di un documento
+        """
+        with self._lock:
+            node_ids = [
+                node_id for (node_id,) in
+                self._conn.execute("SELECT node_id FROM nodes WHERE ref_doc_id = ?", (ref_doc_id,)).fetchall()
+            ]
+            node_ids += [node_id for node_id, row in self._pending_rows.items() if row[0] == ref_doc_id]
+        self.delete_nodes(node_ids)
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **delete_kwargs: Any
+    ) -> None:
+        """
+        Rimuove i chunk indicati (la rimozione su disco avviene in persist)
+        """
+        if filters is not None:
+            raise NotImplementedError("I filtri sui metadati non sono supportati")
+        if not node_ids:
+            return
+
+        with self._lock:
+            self._remove_rows(node_ids)
+            for node_id in node_ids:
+                self._pending_rows.pop(node_id, None)
+            self._pending_deletes.update(node_ids)
+
+    def clear(self) -> None:
+        """
+        Rimuove tutti i chunk
+        """
+        with self._lock:
+            self._pending_deletes.update(
+                node_id for (node_id,) in self._conn.execute("SELECT node_id FROM nodes").fetchall()
+            )
+            self._pending_rows.clear()
+            self._generation = self._read_generation()
+            self._matrix = None
+            self._pending_vectors = []
+            self._node_ids = []
+            self._positions = {}
+            self._dirty = True
+            self._ann = None
+
+    def get_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None
+    ) -> List[BaseNode]:
+        """
+        Restituisce i chunk indicati (tutti se node_ids è assente), con il loro embedding
+        """
+        if filters is not None:
+            raise NotImplementedError("I filtri sui metadati non sono supportati")
+
+        with self._lock:
+            node_ids = [node_id for node_id in (node_ids if node_ids is not None else self._node_ids)
+                        if node_id in self._positions]
+            nodes = self._fetch_nodes(node_ids)
+            matrix = self._vectors()
+            for node in nodes:
+                node.embedding = np.asarray(matrix[self._positions[node.node_id]]).tolist()
+        return nodes
+
+    def _fetch_nodes(self, node_ids: List[str]) -> List[BaseNode]:
+        """
+        Legge testo e metadati dei chunk da SQLite, nell'ordine richiesto
+        """
+        rows: Dict[str, BaseNode] = {}
+        for node_id in node_ids:
+            pending = self._pending_rows.get(node_id)
+            if pending is not None:
+                rows[node_id] = metadata_dict_to_node(json.loads(pending[2]), text=pending[1])
+
+        # Blocchi sotto il limite di parametri di SQLite
+        stored = [node_id for node_id in node_ids if node_id not in rows]
+        for start in range(0, len(stored), 500):
+            block = stored[start:start + 500]
+            placeholders = ",".join("?" for _ in block)
+            for node_id, text, metadata in self._conn.execute(
+                f"SELECT node_id, text, metadata FROM nodes WHERE node_id IN ({placeholders})", block
+            ):
+                rows[node_id] = metadata_dict_to_node(json.loads(metadata), text=text)
+        return [rows[node_id] for node_id in node_ids if node_id in rows]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        Restituisce i chunk più simili all'embedding della query
+        """
+        if query.filters is not None:
+            raise NotImplementedError("I filtri sui metadati non sono supportati")
+        if query.query_embedding is None:
+            raise ValueError("La query deve contenere un embedding")
+
+        query_vector = np.asarray(query.query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm > 0:
+            query_vector = query_vector / norm
+
+        with self._lock:
+            if self._vectors() is None or not self._node_ids:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+            if self._ann is not None and not query.node_ids:
+                # Ricerca approssimata nelle sole liste IVF più vicine alla query
+                rows, similarities = self._ann.search(
+                    self._matrix, query_vector, query.similarity_top_k, settings.ANN_NPROBE
+                )
+                candidates = [int(i) for i in rows]
+                similarities = [float(score) for score in similarities]
+            else:
+                candidates, similarities = self._exact_search(query_vector, query.similarity_top_k, query.node_ids)
+
+            ids = [self._node_ids[i] for i in candidates]
+            nodes = self._fetch_nodes(ids)
+            # L'embedding dei risultati serve alla selezione MMR del contesto
+            for node in nodes:
+                node.embedding = np.asarray(self._matrix[self._positions[node.node_id]]).tolist()
+
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def _exact_search(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        node_ids: Optional[List[str]] = None
+    ) -> Tuple[List[int], List[float]]:
+        """
+        Ricerca esatta su tutti i vettori (o sui soli chunk indicati)
+
+        Returns:
+            Le righe più simili e le relative similarità, in ordine decrescente
+        """
+        scores = self._matrix @ query_vector
+        if node_ids:
+            allowed = np.full(len(self._node_ids), -np.inf, dtype=np.float32)
+            positions = [self._positions[node_id] for node_id in node_ids if node_id in self._positions]
+            allowed[positions] = scores[positions]
+            scores = allowed
+
+        top_k = min(top_k, len(self._node_ids))
+        # Selezione dei top-k in tempo lineare, poi ordinamento dei soli top-k
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        candidates = [int(i) for i in candidates if np.isfinite(scores[i])]
+        return candidates, [float(scores[i]) for i in candidates]
+
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        """
+        Salva una nuova generazione degli embedding e le posizioni dei chunk.
+        Il percorso passato da StorageContext viene ignorato: i file risiedono
+        sempre in persist_dir.
+        """
+        with self._lock:
+            if not self._dirty and not self._pending_deletes:
+                return
+
+            generation = self._generation + 1
+            path = self._vectors_path(generation)
+            matrix = None
+            if self._node_ids:
+                self._write_vectors(path)
+                matrix = np.load(path, mmap_mode="r")
+
+            # L'indice IVF della nuova generazione è pronto prima del commit
+            ann = None
+            if settings.ANN_ENABLED and len(self._node_ids) >= settings.ANN_MIN_VECTORS:
+                logger.info(f"Costruzione dell'indice IVF su {len(self._node_ids)} vettori")
+                ann = IVFIndex.build(matrix, n_lists=settings.ANN_NLIST)
+                ann.save(self._ann_path(generation))
+
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._pending_deletes:
+                    self._conn.executemany(
+                        "DELETE FROM nodes WHERE node_id = ?",
+                        [(node_id,) for node_id in self._pending_deletes]
+                    )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO nodes (node_id, ref_doc_id, position, text, metadata) VALUES (?, ?, NULL, ?, ?)",
+                    [(node_id, *row) for node_id, row in self._pending_rows.items()]
+                )
+                self._conn.executemany(
+                    "UPDATE nodes SET position = ? WHERE node_id = ?",
+                    [(i, node_id) for i, node_id in enumerate(self._node_ids)]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (str(generation),)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            # Rimuove le generazioni precedenti; i worker che le hanno ancora
+            # mappate continuano a leggerle finché non ricaricano l'indice
+            current = {path, self._ann_path(generation)}
+            for old_path in glob.glob(os.path.join(self.persist_dir, "vectors.*.npy")) + \
+                    glob.glob(os.path.join(self.persist_dir, "ivf.*.npz")):
+                if old_path not in current:
+                    os.remove(old_path)
+
+            self._generation = generation
+            self._pending_rows.clear()
+            self._pending_deletes.clear()
+            self._dirty = False
+            self._matrix = matrix
+            self._pending_vectors = []
+            self._ann = ann
+
+    def _write_vectors(self, path: str) -> None:
+        """
+        Scrive gli embedding in un nuovo file .npy: la matrice corrente e i
+        blocchi aggiunti sono copiati direttamente nel file mappato, senza
+        unirli prima in memoria
+        """
+        blocks = self._vector_blocks()
+        tmp_path = path + ".tmp"
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(len(self._node_ids), blocks[0].shape[1])
+        )
+        row = 0
+        for block in blocks:
+            out[row:row + len(block)] = block
+            row += len(block)
+        out.flush()
+        del out
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def create_storage_context(storage_path: Path, load: bool = True, backend: Optional[str] = None) -> StorageContext:
+    """
+    Crea lo storage context per il backend del vectorstore configurato
+
+    Args:
+        storage_path: Percorso del vectorstore
+        load: Se True carica l'indice salvato, altrimenti parte da uno storage vuoto
+        backend: "simple" (JSON di llama_index) o "memmap" (default: VECTOR_STORE_BACKEND)
+
+    Returns:
+        Lo storage context da passare a VectorStoreIndex o load_index_from_storage
+    """
+    backend = backend or settings.VECTOR_STORE_BACKEND
+
+    if backend == "memmap":
+        vector_store = MemmapVectorStore(persist_dir=str(storage_path), reset=not load)
+        if not load:
+            return StorageContext.from_defaults(vector_store=vector_store)
+        return StorageContext.from_defaults(persist_dir=str(storage_path), vector_store=vector_store)
+
+    if backend != "simple":
+        raise ValueError(f"Backend del vectorstore non supportato: {backend}")
+
+    if not load:
+        return StorageContext.from_defaults()
+    return StorageContext.from_defaults(persist_dir=str(storage_path))
+
+
+def export_nodes(index: Any, node_ids: List[str]) -> List[BaseNode]:
+    """
+    Estrae da un indice i chunk con il relativo embedding, per copiarli
+    in un vectorstore di tipo diverso senza ricalcolare gli embedding
+
+    Args:
+        index: L'indice vettoriale di origine
+        node_ids: Gli ID dei chunk da estrarre
+
+    Returns:
+        I chunk con l'embedding valorizzato
+    """
+    vector_store = index.vector_store
+    if isinstance(vector_store, MemmapVectorStore):
+        return vector_store.get_nodes(node_ids)
+
+    nodes = index.docstore.get_nodes(node_ids, raise_error=False)
+    nodes = [node for node in nodes if node is not None]
+    for node in nodes:
+        node.embedding = vector_store.get(node.node_id)
+    return nodes
+
+
+def remove_backend_files(storage_path: Path, backend: str) -> None:
+    """
+    Rimuove i file di un backend del vectorstore non più in uso
+
+    Args:
+        storage_path: Percorso del vectorstore
+        backend: Il backend di cui rimuovere i file
+    """
+    if backend == "memmap":
+        patterns = [NODES_DB_FILE + "*", "vectors.*.npy", "ivf.*.npz"]
+    else:
+        patterns = ["default__vector_store.json"]
+
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(str(storage_path), pattern)):
+            os.remove(path)
@@ -4,6 +4,9 @@ from typing import Dict, Any
 from fastapi import Depends, Header, HTTPException, status
 import logging
 
+from app.config import settings
+from app.core.warmup import LOADING, get_engine_status, wait_until_ready
+
 # Configurazione logging
 logger = logging.getLogger(__name__)
 
@@ -66,3 +69,26 @@ def get_query_params(q: str = None):
         Un dizionario con i parametri di query
     """
     return {"q": q}
+
+async def require_rag_engine():
+    """
+    Dipendenza per gli endpoint che usano il motore RAG: durante il caricamento
+    in background la richiesta attende al massimo WARMUP_REQUEST_TIMEOUT secondi
+    
+    Raises:
+        HTTPException: 503 se il motore non è pronto allo scadere dell'attesa
+            o se l'inizializzazione è fallita
+    """
+    if await wait_until_ready(settings.WARMUP_REQUEST_TIMEOUT):
+        return
+    
+    engine = get_engine_status()
+    if engine["state"] == LOADING:
+        detail = "Il motore RAG è in fase di caricamento, riprovare tra poco"
+    else:
+        detail = "Il motore RAG non è disponibile"
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": str(max(int(settings.WARMUP_RETRY_DELAY_SECONDS), 1))}
+    )
@@ -0,0 +1,61 @@
+"""
+Configurazione di gunicorn per il server di produzione.
+
+Avvio (oppure python run.py --production):
+    gunicorn -c python:app.gunicorn_conf app.main:app
+
+Tutti i valori derivano dalle impostazioni SERVER_* (variabili d'ambiente o .env).
+Con SERVER_PRELOAD_INDEX il processo master carica l'indice prima del fork:
+i worker lo ereditano e ne condividono le pagine in copy-on-write, invece di
+caricarne ciascuno una copia.
+"""
+import gc
+import logging
+
+from app.config import settings
+from app.db.chat_repository import check_multiprocess_safe
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+bind = f"{settings.SERVER_HOST}:{settings.SERVER_PORT}"
+workers = settings.SERVER_WORKERS
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# L'applicazione viene importata una sola volta nel master, prima del fork
+preload_app = True
+
+keepalive = settings.SERVER_KEEPALIVE
+backlog = settings.SERVER_BACKLOG
+timeout = settings.SERVER_TIMEOUT
+# Allo spegnimento (SIGTERM) i worker smettono di accettare connessioni e
+# completano le richieste in corso, incluse le risposte in streaming
+graceful_timeout = settings.SERVER_GRACEFUL_TIMEOUT
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """
+    Nel master, prima di aprire il socket e creare i worker
+    """
+    check_multiprocess_safe(workers)
+
+    if settings.SERVER_PRELOAD_INDEX:
+        from app.core.warmup import preload_engine
+        logger.info("Precaricamento del motore RAG nel processo master...")
+        preload_engine()
+
+    # Gli oggetti caricati finora non vengono più visitati dal garbage collector:
+    # le loro pagine restano condivise tra i worker invece di essere copiate
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Nel worker appena creato: connessioni e client non possono essere condivisi
+    con il master
+    """
+    from app.core.rag_engine import reset_after_fork
+    reset_after_fork()
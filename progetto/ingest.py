@@ -0,0 +1,327 @@
+"""
+Ingestion offline dei documenti nutrizionali.
+
+Indicizza i documenti di DOCUMENTS_DIR fuori dal processo web:
+    python -m app.ingest [--workers N] [--batch-size N] [--concurrency N] [--rebuild] [--no-resume]
+
+I documenti vengono letti e divisi in chunk in parallelo in un pool di processi,
+gli embedding sono calcolati a blocchi con concorrenza limitata e salvati in un
+checkpoint, così un'esecuzione interrotta riprende dai chunk già calcolati.
+L'indice viene salvato nello stesso formato caricato dal server all'avvio.
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.schema import MetadataMode, TextNode
+
+from app.config import settings
+from app.core.ingestion import (
+    apply_changes,
+    chunk_documents,
+    load_index,
+    load_manifest,
+    new_index,
+    new_manifest,
+    new_nodes_for_file,
+    parse_document,
+    plan_file_changes
+)
+from app.core.llm_manager import get_async_openai_client, close_async_openai_client
+from app.core.rag_engine import configure_llama_settings
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+# Checkpoint degli embedding già calcolati, accanto al vectorstore
+CHECKPOINT_FILE = "ingest_checkpoint.jsonl"
+
+
+class EmbeddingCheckpoint:
+    """
+    Checkpoint append-only degli embedding calcolati, indicizzato per hash del chunk.
+
+    Ogni blocco di embedding completato viene aggiunto al file e sincronizzato
+    su disco; una riga troncata da un'interruzione viene semplicemente ignorata.
+    """
+
+    def __init__(self, path: Path, model: str):
+        self.path = Path(path)
+        self.model = model
+        self._vectors: Dict[str, List[float]] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("model") == self.model:
+                        self._vectors[record["chunk_hash"]] = record["embedding"]
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def get(self, chunk_hash: str) -> Optional[List[float]]:
+        return self._vectors.get(chunk_hash)
+
+    def write(self, items: List[Tuple[str, List[float]]]) -> None:
+        """
+        Salva un blocco di embedding
+
+        Args:
+            items: Coppie (hash del chunk, embedding)
+        """
+        with open(self.path, "a", encoding="utf-8") as f:
+            for chunk_hash, vector in items:
+                f.write(json.dumps({"model": self.model, "chunk_hash": chunk_hash, "embedding": vector}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for chunk_hash, vector in items:
+            self._vectors[chunk_hash] = vector
+
+    def remove(self) -> None:
+        """
+        Elimina il checkpoint (a indicizzazione completata)
+        """
+        self._vectors.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _parse_and_chunk(
+    path_str: str,
+    file_hash: str,
+    storage_path_str: str,
+    chunk_size: int,
+    chunk_overlap: int
+) -> Tuple[str, int, List[TextNode]]:
+    """
+    Legge e divide in chunk un documento (eseguita nei processi del pool)
+
+    Returns:
+        Il nome del file, il numero di pagine e i chunk
+    """
+    path = Path(path_str)
+    documents = parse_document(path, file_hash, Path(storage_path_str))
+    node_parser = SimpleNodeParser.from_defaults(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return path.name, len(documents), chunk_documents(documents, path.name, node_parser)
+
+
+async def _embed_batch(texts: List[str]) -> List[List[float]]:
+    """
+    Calcola gli embedding di un blocco di testi con una sola richiesta
+    """
+    response = await get_async_openai_client().embeddings.create(model=settings.EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+async def embed_nodes(
+    nodes: List[TextNode],
+    checkpoint: EmbeddingCheckpoint,
+    batch_size: int,
+    concurrency: int
+) -> int:
+    """
+    Calcola gli embedding dei chunk non ancora presenti nel checkpoint e li
+    assegna ai chunk
+
+    Args:
+        nodes: I chunk da indicizzare
+        checkpoint: Il checkpoint degli embedding già calcolati
+        batch_size: Numero di testi per richiesta
+        concurrency: Numero massimo di richieste in parallelo
+
+    Returns:
+        Il numero di embedding calcolati in questa esecuzione
+    """
+    # I chunk con lo stesso contenuto condividono lo stesso embedding
+    pending: Dict[str, str] = {}
+    for node in nodes:
+        chunk_hash = node.metadata["chunk_hash"]
+        if checkpoint.get(chunk_hash) is None and chunk_hash not in pending:
+            pending[chunk_hash] = node.get_content(metadata_mode=MetadataMode.EMBED)
+
+    items = list(pending.items())
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def run_batch(batch: List[Tuple[str, str]]) -> None:
+        nonlocal done
+        async with semaphore:
+            vectors = await _embed_batch([text for _, text in batch])
+        checkpoint.write([(chunk_hash, vector) for (chunk_hash, _), vector in zip(batch, vectors)])
+        done += len(batch)
+        logger.info(f"Embedding: {done}/{len(items)}")
+
+    try:
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+    finally:
+        await close_async_openai_client()
+
+    for node in nodes:
+        node.embedding = checkpoint.get(node.metadata["chunk_hash"])
+    return len(items)
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+
+def run_ingestion(
+    documents_dir: Path,
+    storage_path: Path,
+    workers: Optional[int] = None,
+    batch_size: int = 128,
+    concurrency: int = 4,
+    rebuild: bool = False,
+    resume: bool = True
+) -> Dict[str, Any]:
+    """
+    Esegue l'ingestion dei documenti nuovi o modificati
+
+    Args:
+        documents_dir: La directory dei documenti
+        storage_path: Percorso del vectorstore
+        workers: Processi per la lettura dei documenti (default: numero di CPU)
+        batch_size: Numero di testi per richiesta di embedding
+        concurrency: Richieste di embedding in parallelo
+        rebuild: Se True ricrea l'indice ignorando il manifest
+        resume: Se False scarta il checkpoint di un'esecuzione precedente
+
+    Returns:
+        Le statistiche di ogni fase
+    """
+    configure_llama_settings()
+    os.makedirs(storage_path, exist_ok=True)
+
+    manifest = None if rebuild else load_manifest(storage_path)
+    index = None
+    if manifest is not None:
+        try:
+            index = load_index(storage_path, manifest)
+        except Exception as e:
+            logger.error(f"Errore nel caricamento dell'indice, verrà ricreato: {e}")
+            manifest = None
+    if manifest is None:
+        manifest = new_manifest(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+        index = new_index(storage_path)
+
+    changed, removed = plan_file_changes(documents_dir, manifest, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+    report: Dict[str, Any] = {"files_changed": len(changed), "files_removed": len(removed), "files_failed": []}
+    if not changed and not removed:
+        logger.info("Indice già allineato ai documenti")
+        return report
+
+    # Fase 1: lettura e chunking in parallelo
+    started_at = time.perf_counter()
+    file_nodes: Dict[str, Tuple[str, List[TextNode]]] = {}
+    pages = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                _parse_and_chunk, str(path), file_hash, str(storage_path),
+                settings.CHUNK_SIZE, settings.CHUNK_OVERLAP
+            ): (rel_path, file_hash)
+            for rel_path, (path, file_hash) in changed.items()
+        }
+        for future in as_completed(futures):
+            rel_path, file_hash = futures[future]
+            try:
+                _, num_pages, nodes = future.result()
+            except Exception as e:
+                logger.error(f"Errore nell'elaborazione del documento {rel_path}: {e}")
+                report["files_failed"].append(rel_path)
+                continue
+            pages += num_pages
+            file_nodes[rel_path] = (file_hash, nodes)
+    parse_seconds = time.perf_counter() - started_at
+    chunks = sum(len(nodes) for _, nodes in file_nodes.values())
+    report["parse"] = {
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(parse_seconds, 2),
+        "pages_per_s": _rate(pages, parse_seconds),
+        "chunks_per_s": _rate(chunks, parse_seconds),
+    }
+    logger.info(f"Lettura: {report['parse']}")
+
+    # Fase 2: embedding dei soli chunk nuovi, con checkpoint
+    checkpoint = EmbeddingCheckpoint(Path(storage_path) / CHECKPOINT_FILE, settings.EMBEDDING_MODEL)
+    if not resume:
+        checkpoint.remove()
+    elif len(checkpoint):
+        logger.info(f"Ripresa dal checkpoint: {len(checkpoint)} embedding già calcolati")
+
+    new_nodes = [
+        node
+        for rel_path, (_, nodes) in file_nodes.items()
+        for node in new_nodes_for_file(manifest, rel_path, nodes)
+    ]
+    started_at = time.perf_counter()
+    embedded = asyncio.run(embed_nodes(new_nodes, checkpoint, batch_size, concurrency))
+    embed_seconds = time.perf_counter() - started_at
+    report["embed"] = {
+        "embeddings": embedded,
+        "from_checkpoint": len(new_nodes) - embedded,
+        "seconds": round(embed_seconds, 2),
+        "embeddings_per_s": _rate(embedded, embed_seconds),
+    }
+    logger.info(f"Embedding: {report['embed']}")
+
+    # Fase 3: aggiornamento e salvataggio dell'indice
+    started_at = time.perf_counter()
+    report["index"] = apply_changes(index, storage_path, manifest, file_nodes, removed)
+    report["index"]["seconds"] = round(time.perf_counter() - started_at, 2)
+    logger.info(f"Indice: {report['index']}")
+
+    checkpoint.remove()
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Punto di ingresso della riga di comando
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.ingest", description="Indicizza i documenti nutrizionali")
+    parser.add_argument("--documents-dir", type=Path, default=settings.DOCUMENTS_DIR)
+    parser.add_argument("--workers", type=int, default=settings.INGEST_WORKERS,
+                        help="Processi per la lettura dei documenti (default: numero di CPU)")
+    parser.add_argument("--batch-size", type=int, default=settings.INGEST_EMBED_BATCH_SIZE,
+                        help="Testi per richiesta di embedding")
+    parser.add_argument("--concurrency", type=int, default=settings.INGEST_EMBED_CONCURRENCY,
+                        help="Richieste di embedding in parallelo")
+    parser.add_argument("--rebuild", action="store_true", help="Ricrea l'indice ignorando il manifest")
+    parser.add_argument("--no-resume", action="store_true", help="Scarta il checkpoint di un'esecuzione interrotta")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    report = run_ingestion(
+        documents_dir=args.documents_dir,
+        storage_path=settings.VECTORSTORE_PATH,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        rebuild=args.rebuild,
+        resume=not args.no_resume
+    )
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 1 if report["files_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
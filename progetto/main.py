@@ -4,11 +4,16 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import os
 import json
+import asyncio
+import uuid
+import datetime
 import logging
 from pathlib import Path
 
-from app.api.routes import chat, diet
-from app.core.rag_engine import initialize_rag_engine
+from app.api.routes import chat, diet, diet_jobs, diet_plans, health, metrics, nutrients
+from app.core.job_queue import start_job_workers, stop_job_workers, watch_job, describe_job
+from app.core.warmup import start_warmup, stop_warmup, wait_until_ready
+from app.core.llm_manager import close_async_openai_client, drain_llm_calls
 from app.config import settings
 
 # Configurazione logging
@@ -28,47 +33,100 @@ app = FastAPI(
 # Monta le route API
 app.include_router(chat.router, prefix="/api")
 app.include_router(diet.router, prefix="/api")
+app.include_router(diet_jobs.router, prefix="/api")
+app.include_router(diet_plans.router, prefix="/api")
+app.include_router(nutrients.router, prefix="/api")
+app.include_router(metrics.router, prefix="/api")
+app.include_router(health.router)
 
 # Configurazione delle directory statiche e dei template
 BASE_DIR = Path(__file__).resolve().parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 
-# Inizializzazione del motore RAG all'avvio dell'app
+# Caricamento del motore RAG in background: l'app risponde subito a /healthz
+# e /readyz, le richieste che usano il motore attendono la fine del caricamento.
+# I worker della coda dei job partono subito e attendono anch'essi il motore
 @app.on_event("startup")
 async def startup_event():
-    try:
-        # Inizializza il motore RAG
-        logger.info("Inizializzazione del motore RAG...")
-        initialize_rag_engine()
-        logger.info("Motore RAG inizializzato con successo!")
-    except Exception as e:
-        logger.error(f"Errore durante l'inizializzazione del motore RAG: {e}")
-        # Non arrestare l'app, ma segnala l'errore
-        pass
+    start_warmup()
+    start_job_workers()
+
+# Chiusura del pool di connessioni verso OpenAI allo spegnimento
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_warmup()
+    # Job e risposte in corso condividono la stessa scadenza, entro il graceful_timeout
+    # di gunicorn: i job non conclusi tornano in coda per il prossimo avvio, le
+    # risposte vengono completate prima di chiudere il client
+    await asyncio.gather(
+        stop_job_workers(settings.SERVER_GRACEFUL_TIMEOUT),
+        drain_llm_calls(settings.SERVER_GRACEFUL_TIMEOUT)
+    )
+    await close_async_openai_client()
 
 # Endpoint root che serve la pagina HTML principale
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+async def forward_job_updates(send, job_id: str) -> None:
+    """
+    Invia al client ogni cambio di stato di un job, fino alla sua conclusione
+    """
+    try:
+        async for job in watch_job(job_id):
+            if job is None:
+                await send({"type": "job", "job_id": job_id, "status": "not_found"})
+                return
+            await send({"type": "job", **describe_job(job)})
+    except Exception as e:
+        logger.error(f"Errore nell'invio degli aggiornamenti del job {job_id}: {e}")
+
 # WebSocket per la comunicazione in tempo reale con il frontend
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    # Gli aggiornamenti dei job e le risposte della chat condividono la connessione
+    send_lock = asyncio.Lock()
+    job_watchers = set()
+
+    async def send(payload):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
+
     try:
         while True:
             data = await websocket.receive_text()
             # Processa i dati ricevuti
             message_data = json.loads(data)
-            response = await chat.process_message(message_data)
-            # Invia la risposta al client
-            await websocket.send_text(json.dumps(response))
+            # Iscrizione agli aggiornamenti di un job ({"type": "job", "job_id": ...})
+            if message_data.get("type") == "job":
+                task = asyncio.create_task(forward_job_updates(send, str(message_data.get("job_id", ""))))
+                job_watchers.add(task)
+                task.add_done_callback(job_watchers.discard)
+                continue
+            if not message_data.get("chat_id"):
+                message_data["chat_id"] = str(uuid.uuid4())
+            if not await wait_until_ready(settings.WARMUP_REQUEST_TIMEOUT):
+                await send({
+                    "chat_id": message_data["chat_id"],
+                    "status": "error",
+                    "message": "Il servizio non è ancora disponibile, riprova tra poco",
+                    "timestamp": datetime.datetime.now().isoformat()
+                })
+                continue
+            # Invia al client i frammenti della risposta man mano che vengono generati
+            async for payload in chat.stream_message(message_data):
+                await send(payload)
     except WebSocketDisconnect:
         logger.info("Cliente WebSocket disconnesso")
     except Exception as e:
         logger.error(f"Errore WebSocket: {e}")
         await websocket.close()
+    finally:
+        for task in list(job_watchers):
+            task.cancel()
 
 if __name__ == "__main__":
     import uvicorn
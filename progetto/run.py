@@ -1,7 +1,8 @@
+import argparse
 import os
+import sys
 import logging
 import uvicorn
-from app.main import app
 from app.config import settings
 
 # Configurazione logging
@@ -11,31 +12,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def run_production(workers: int) -> None:
+    """
+    Avvia il server di produzione: gunicorn con worker uvicorn, indice
+    precaricato prima del fork e spegnimento graduale (vedi gunicorn_conf.py)
+
+    Args:
+        workers: Il numero di processi worker
+    """
+    from app.db.chat_repository import check_multiprocess_safe
+
+    # Errore immediato, prima di avviare gunicorn
+    check_multiprocess_safe(workers)
+
+    os.environ["SERVER_WORKERS"] = str(workers)
+    logger.info(f"🚀 Avvio del server di produzione con {workers} worker")
+    # Il processo viene sostituito da gunicorn, che gestisce i segnali
+    os.execv(sys.executable, [
+        sys.executable, "-m", "gunicorn",
+        "-c", "python:app.gunicorn_conf",
+        "app.main:app"
+    ])
+
 def main():
     """
     Funzione principale per avviare l'applicazione
     """
+    parser = argparse.ArgumentParser(description="Avvia il Chatbot Nutrizionista")
+    parser.add_argument("--production", action="store_true",
+                        help="Server di produzione con più worker (senza ricaricamento automatico)")
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS,
+                        help="Processi worker in produzione (default: SERVER_WORKERS)")
+    args = parser.parse_args()
+
     # Verifica che le directory necessarie esistano
     if not os.path.exists(settings.DOCUMENTS_DIR):
         os.makedirs(settings.DOCUMENTS_DIR, exist_ok=True)
         logger.info(f"Creata directory per i documenti: {settings.DOCUMENTS_DIR}")
-    
+
     if not os.path.exists(settings.VECTORSTORE_PATH):
         os.makedirs(settings.VECTORSTORE_PATH, exist_ok=True)
         logger.info(f"Creata directory per il vectorstore: {settings.VECTORSTORE_PATH}")
-    
+
     # Verifica la chiave API OpenAI
     if not settings.OPENAI_API_KEY:
         logger.warning("⚠️ OPENAI_API_KEY non trovata nelle variabili d'ambiente.")
         logger.warning("Crea un file .env nella directory principale con la tua API key di OpenAI:")
         logger.warning("OPENAI_API_KEY=sk-your-api-key")
-    
-    # Avvia il server
+
+    if args.production:
+        run_production(args.workers)
+        return
+
+    # Avvia il server di sviluppo, con ricaricamento automatico
     logger.info("🚀 Avvio del server Chatbot Nutrizionista")
     uvicorn.run(
         "app.main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
         reload=True,
         log_level="info"
     )
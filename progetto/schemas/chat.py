@@ -5,6 +5,7 @@ from datetime import datetime
 class ChatMessage(BaseModel):
     """Schema per i messaggi di chat"""
     chat_id: str
+    seq: Optional[int] = None  # Posizione del messaggio nella chat, usata come cursore
     role: str  # "user" o "assistant"
     content: str
     timestamp: str
@@ -16,3 +17,19 @@ class ChatSession(BaseModel):
     created_at: str
     updated_at: str
     message_count: int
+
+class ChatHistoryResponse(BaseModel):
+    """Schema per una pagina dello storico messaggi"""
+    chat_id: str
+    title: Optional[str] = None
+    messages: List[ChatMessage]
+    next_before: Optional[int] = None  # Cursore per caricare i messaggi più vecchi
+    has_more: bool = False
+
+class ChatSearchResult(BaseModel):
+    """Schema per i risultati della ricerca nei messaggi"""
+    chat_id: str
+    chat_title: str
+    role: str
+    snippet: str
+    timestamp: str
@@ -1,14 +1,58 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Dict, Any, List, Optional
+
+from app.models.diet import DietPlan, Meal
 
 class DietRequest(BaseModel):
     """Schema per le richieste di generazione dieta"""
     user_profile: str
     
+class DietBatchRequest(BaseModel):
+    """Schema per la generazione di diete per più profili"""
+    profiles: List[str] = Field(..., min_length=1)
+
 class DietResponse(BaseModel):
     """Schema per le risposte con diete generate"""
     user_profile: str
     diet_plan: str
+    plan_id: Optional[str] = None
+    plan: Optional[DietPlan] = None
+    energy_targets: Optional[Dict[str, Any]] = None
     sources: List[str] = []
     success: bool
     message: str
+
+class DietJobResponse(BaseModel):
+    """Schema per lo stato di un job di generazione di una dieta"""
+    job_id: str
+    kind: str = "diet"
+    status: str
+    attempts: int = 0
+    queue_position: Optional[int] = None
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    result: Optional[DietResponse] = None
+
+class DietPlanTotals(BaseModel):
+    """Schema per i totali calorici di un piano, calcolati localmente"""
+    plan_id: str
+    days: List[Dict[str, Any]]
+    weekly_total_calories: Optional[int] = None
+    average_daily_calories: Optional[int] = None
+
+class MealLookupResponse(BaseModel):
+    """Schema per la ricerca di un pasto in un piano"""
+    plan_id: str
+    day: str
+    meal: Meal
+
+class FoodItem(BaseModel):
+    """Schema per un alimento con la sua quantità"""
+    name: str
+    quantity: str = ""
+
+class NutritionRequest(BaseModel):
+    """Schema per il calcolo dei nutrienti di una lista di alimenti"""
+    items: List[FoodItem]
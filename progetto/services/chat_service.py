@@ -1,11 +1,41 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import logging
 import asyncio
 import datetime
 import json
+import time
 
-from app.core.diet_generator import generate_diet_plan, analyze_nutritional_query
-from app.db.chat_repository import save_chat_message, get_chat_history, get_all_chats, delete_chat, delete_all_chats
+from app.core.diet_generator import (
+    generate_diet_plan,
+    analyze_nutritional_query,
+    retrieve_guideline_excerpts,
+    stream_diet_plan,
+    stream_nutritional_query
+)
+from app.core.conversation_memory import (
+    load_memory,
+    schedule_memory_update,
+    has_memory,
+    contextual_profile
+)
+from app.core.intent_router import (
+    route_message,
+    CANNED_ANSWERS,
+    ROUTE_CANNED,
+    ROUTE_CACHED,
+    ROUTE_RETRIEVAL,
+    ROUTE_DIET
+)
+from app.db.chat_repository import (
+    get_chat_history,
+    asave_chat_message,
+    aget_chat_history_page,
+    aget_chat_session,
+    aget_chats_page,
+    adelete_chat,
+    adelete_all_chats,
+    asearch_messages
+)
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
@@ -25,8 +55,11 @@ async def process_message(message_data: Dict[str, Any]) -> Dict[str, Any]:
         message_text = message_data.get("message", "")
         timestamp = message_data.get("timestamp", datetime.datetime.now().isoformat())
         
+        # Memoria della conversazione precedente (riassunto e ultimi messaggi)
+        memory = await load_memory(chat_id)
+        
         # Salva il messaggio dell'utente
-        save_chat_message(chat_id, message_text, "user", timestamp)
+        await asave_chat_message(chat_id, message_text, "user", timestamp)
         
         # Inizia con un messaggio di "sto generando..."
         response_data = {
@@ -36,26 +69,13 @@ async def process_message(message_data: Dict[str, Any]) -> Dict[str, Any]:
             "timestamp": datetime.datetime.now().isoformat()
         }
         
-        # Analizza il messaggio per determinare se è una richiesta di dieta
-        is_diet_request = _is_diet_request(message_text)
-        
-        # Genera la risposta in base al tipo di richiesta
-        bot_response = ""
-        sources = []
-        
-        if is_diet_request:
-            # È una richiesta di dieta, usa il generatore di diete
-            diet_result = generate_diet_plan(message_text)
-            bot_response = diet_result["diet_plan"]
-            sources = diet_result.get("sources", [])
-        else:
-            # È una domanda generica sulla nutrizione
-            analysis_result = analyze_nutritional_query(message_text)
-            bot_response = analysis_result["answer"]
-            sources = analysis_result.get("sources", [])
+        # Sceglie il percorso del messaggio e genera la risposta
+        decision = await route_message(message_text, use_cache=not has_memory(memory))
+        bot_response, sources = await _answer(decision, message_text, memory)
         
-        # Salva la risposta del bot
-        save_chat_message(chat_id, bot_response, "assistant", datetime.datetime.now().isoformat())
+        # Salva la risposta del bot e aggiorna il riassunto in background
+        await asave_chat_message(chat_id, bot_response, "assistant", datetime.datetime.now().isoformat())
+        schedule_memory_update(chat_id)
         
         # Prepara la risposta finale
         response_data = {
@@ -63,6 +83,7 @@ async def process_message(message_data: Dict[str, Any]) -> Dict[str, Any]:
             "status": "complete",
             "message": bot_response,
             "sources": sources,
+            "route": decision["route"],
             "timestamp": datetime.datetime.now().isoformat()
         }
         
@@ -76,43 +97,142 @@ async def process_message(message_data: Dict[str, Any]) -> Dict[str, Any]:
             "timestamp": datetime.datetime.now().isoformat()
         }
 
-def _is_diet_request(message: str) -> bool:
+async def stream_message(message_data: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
     """
-    Determina se un messaggio è una richiesta di dieta
+    Elabora un messaggio dell'utente restituendo la risposta in streaming.
+    La risposta del bot viene salvata una sola volta, a generazione completata.
     
     Args:
+        message_data: Dati del messaggio dell'utente
+        
+    Yields:
+        Payload con status "thinking", poi "streaming" (con il frammento in "delta")
+        e infine "complete" con la risposta intera, oppure "error"
+    """
+    chat_id = message_data.get("chat_id", "")
+    try:
+        message_text = message_data.get("message", "")
+        timestamp = message_data.get("timestamp", datetime.datetime.now().isoformat())
+        started_at = time.perf_counter()
+        
+        # Memoria della conversazione precedente (riassunto e ultimi messaggi)
+        memory = await load_memory(chat_id)
+        
+        # Salva il messaggio dell'utente
+        await asave_chat_message(chat_id, message_text, "user", timestamp)
+        
+        yield {
+            "chat_id": chat_id,
+            "status": "thinking",
+            "message": "Sto analizzando la tua richiesta...",
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        
+        # Sceglie il percorso del messaggio e il generatore corrispondente
+        decision = await route_message(message_text, use_cache=not has_memory(memory))
+        events = _stream_answer(decision, message_text, memory)
+        
+        chunks = []
+        sources = []
+        final_text = None
+        first_token_at = None
+        async for event in events:
+            if event["type"] == "sources":
+                sources = event["sources"]
+                continue
+            if event["type"] == "plan":
+                # Il piano ricostruito sostituisce il testo (JSON) inviato in streaming
+                final_text = event["content"]
+                continue
+            
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                logger.info(f"Primo token per la chat {chat_id} dopo {first_token_at - started_at:.2f}s")
+            
+            chunks.append(event["content"])
+            yield {
+                "chat_id": chat_id,
+                "status": "streaming",
+                "delta": event["content"]
+            }
+        
+        bot_response = final_text if final_text is not None else "".join(chunks)
+        
+        # Salva la risposta del bot una volta completata e aggiorna il riassunto in background
+        await asave_chat_message(chat_id, bot_response, "assistant", datetime.datetime.now().isoformat())
+        schedule_memory_update(chat_id)
+        
+        yield {
+            "chat_id": chat_id,
+            "status": "complete",
+            "message": bot_response,
+            "sources": sources,
+            "route": decision["route"],
+            "ttft_ms": round((first_token_at - started_at) * 1000) if first_token_at else None,
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Errore nell'elaborazione del messaggio in streaming: {e}")
+        yield {
+            "chat_id": chat_id,
+            "status": "error",
+            "message": f"Mi dispiace, si è verificato un errore: {str(e)}",
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+
+async def _answer(decision: Dict[str, Any], message: str, memory: Optional[Dict[str, Any]] = None) -> Tuple[str, List[str]]:
+    """
+    Genera la risposta lungo il percorso scelto dal router
+    
+    Args:
+        decision: La decisione del router
         message: Il testo del messaggio
+        memory: La memoria della chat (riassunto e ultimi messaggi)
         
     Returns:
-        True se il messaggio è una richiesta di dieta, False altrimenti
+        Il testo della risposta e le fonti
     """
-    # Parole chiave che potrebbero indicare una richiesta di dieta
-    diet_keywords = [
-        "dieta", "piano alimentare", "nutrizione", "regime alimentare",
-        "menu settimanale", "pasti", "calorie", "mangiare", "alimentazione",
-        "peso", "dimagrire", "ingrassare", "massa muscolare", "proteina"
-    ]
-    
-    # Frasi comuni per richieste di dieta
-    diet_phrases = [
-        "voglio perdere peso", "vorrei dimagrire", "come posso aumentare di peso",
-        "che cosa dovrei mangiare", "cosa posso mangiare", "come dovrei alimentarmi",
-        "sono un uomo di", "sono una donna di", "ho anni", "sono alto", "sono alta",
-        "il mio obiettivo è", "voglio mettere massa", "sedentario", "attivo", "sportivo"
-    ]
+    route = decision["route"]
+    if route == ROUTE_CANNED:
+        return CANNED_ANSWERS[decision["kind"]], []
+    if route == ROUTE_CACHED:
+        return decision["answer"]["answer"], decision["answer"].get("sources", [])
+    if route == ROUTE_RETRIEVAL:
+        result = await retrieve_guideline_excerpts(message)
+        return result["answer"], result["sources"]
+    if route == ROUTE_DIET:
+        result = await generate_diet_plan(
+            contextual_profile(message, memory), model=decision["model"], max_tokens=decision["max_tokens"]
+        )
+        return result["diet_plan"], result.get("sources", [])
     
-    # Converti il messaggio in minuscolo per un confronto case-insensitive
-    message_lower = message.lower()
-    
-    # Controlla se il messaggio contiene almeno una parola chiave e una frase comune
-    has_keyword = any(keyword in message_lower for keyword in diet_keywords)
-    has_phrase = any(phrase in message_lower for phrase in diet_phrases)
-    
-    # Se il messaggio è lungo e contiene una parola chiave o una frase, consideralo una richiesta di dieta
-    # Le richieste di dieta tendono ad essere più lunghe di semplici domande
-    is_long_message = len(message.split()) >= 10
+    result = await analyze_nutritional_query(
+        message, model=decision["model"], max_tokens=decision["max_tokens"], memory=memory
+    )
+    return result["answer"], result.get("sources", [])
+
+async def _stream_answer(decision: Dict[str, Any], message: str, memory: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Versione in streaming di _answer: i percorsi senza modello inviano
+    la risposta in un unico frammento
+    """
+    route = decision["route"]
+    if route == ROUTE_DIET:
+        events = stream_diet_plan(
+            contextual_profile(message, memory), model=decision["model"], max_tokens=decision["max_tokens"]
+        )
+    elif route in (ROUTE_CANNED, ROUTE_CACHED, ROUTE_RETRIEVAL):
+        answer, sources = await _answer(decision, message, memory)
+        yield {"type": "sources", "sources": sources}
+        yield {"type": "delta", "content": answer}
+        return
+    else:
+        events = stream_nutritional_query(
+            message, model=decision["model"], max_tokens=decision["max_tokens"], memory=memory
+        )
     
-    return (has_keyword and (has_phrase or is_long_message))
+    async for event in events:
+        yield event
 
 def get_chat_history_formatted(chat_id: str) -> List[Dict[str, Any]]:
     """
@@ -1,5 +1,9 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+import asyncio
 import logging
+import time
+from app.config import settings
+from app.core.answer_cache import normalize_query
 from app.core.diet_generator import generate_diet_plan
 
 # Configurazione logging
@@ -17,12 +21,13 @@ async def generate_diet(user_profile: str) -> Dict[str, Any]:
     """
     try:
         # Genera la dieta utilizzando il core generator
-        diet_result = generate_diet_plan(user_profile)
+        diet_result = await generate_diet_plan(user_profile)
         
         # Formatta la risposta
         response = {
             "user_profile": user_profile,
             "diet_plan": diet_result["diet_plan"],
+            "plan_id": diet_result.get("plan_id"),
             "sources": diet_result.get("sources", []),
             "success": True,
             "message": "Dieta generata con successo"
@@ -39,6 +44,83 @@ async def generate_diet(user_profile: str) -> Dict[str, Any]:
             "message": f"Errore nella generazione della dieta: {str(e)}"
         }
 
+async def generate_diet_batch(profiles: List[str]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Genera le diete di più profili in parallelo (al massimo DIET_BATCH_CONCURRENCY
+    alla volta), restituendo ogni risultato appena pronto. I profili identici
+    (a meno di maiuscole e punteggiatura) vengono generati una sola volta;
+    quelli con la stessa impronta condividono comunque la generazione tramite
+    la cache dei piani e l'accorpamento delle richieste
+    
+    Args:
+        profiles: I profili degli utenti
+        
+    Yields:
+        Un elemento {"type": "item"} per ogni profilo, nell'ordine di completamento,
+        con "index" (posizione nella richiesta) e "success"; infine un elemento
+        {"type": "summary"} con i conteggi
+    """
+    started_at = time.perf_counter()
+    groups: Dict[str, List[int]] = {}
+    for index, profile in enumerate(profiles):
+        groups.setdefault(normalize_query(profile), []).append(index)
+    
+    semaphore = asyncio.Semaphore(max(settings.DIET_BATCH_CONCURRENCY, 1))
+    
+    async def run(indices: List[int]) -> Tuple[List[int], Optional[Dict[str, Any]], Optional[Exception], float]:
+        async with semaphore:
+            item_started_at = time.perf_counter()
+            try:
+                result = await generate_diet_plan(profiles[indices[0]])
+                return indices, result, None, time.perf_counter() - item_started_at
+            except Exception as e:
+                # L'errore riguarda solo questo profilo, non l'intero lotto
+                logger.error(f"Errore nella generazione della dieta {indices[0]} del lotto: {e}")
+                return indices, None, e, time.perf_counter() - item_started_at
+    
+    tasks = [asyncio.create_task(run(indices)) for indices in groups.values()]
+    succeeded = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indices, result, error, elapsed = await next_done
+            for position, index in enumerate(indices):
+                item = {
+                    "type": "item",
+                    "index": index,
+                    "user_profile": profiles[index],
+                    "success": error is None,
+                    "deduplicated": position > 0,
+                    "elapsed_ms": round(elapsed * 1000)
+                }
+                if error is None:
+                    succeeded += 1
+                    item.update({
+                        "diet_plan": result["diet_plan"],
+                        "plan_id": result.get("plan_id"),
+                        "plan": result.get("plan"),
+                        "energy_targets": result.get("energy_targets"),
+                        "sources": result.get("sources", []),
+                        "cached": result.get("cached", False),
+                        "message": "Dieta generata con successo"
+                    })
+                else:
+                    failed += 1
+                    item["message"] = f"Errore nella generazione della dieta: {str(error)}"
+                yield item
+    finally:
+        # Client disconnesso: le generazioni non ancora concluse vengono annullate
+        for task in tasks:
+            task.cancel()
+    
+    yield {
+        "type": "summary",
+        "total": len(profiles),
+        "unique": len(groups),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started_at) * 1000)
+    }
+
 def format_diet_for_display(diet_data: Dict[str, Any]) -> str:
     """
     Formatta i dati della dieta per la visualizzazione nel chatbot
@@ -18,6 +18,14 @@ document.addEventListener('DOMContentLoaded', function() {
     let isProcessing = false;
     let voiceOutputEnabled = false;
 
+    // Stato della paginazione
+    const HISTORY_PAGE_SIZE = 20;
+    const CHAT_LIST_PAGE_SIZE = 30;
+    let historyCursor = null;       // seq del messaggio più vecchio caricato
+    let isLoadingHistory = false;
+    let chatListCursor = null;      // cursore della pagina successiva di chat
+    let isLoadingChatList = false;
+
     // Inizializzazione
     initializeApp();
 
@@ -39,6 +47,8 @@ document.addEventListener('DOMContentLoaded', function() {
         deleteAllBtn.addEventListener('click', deleteAllChats);
         menuToggle.addEventListener('click', toggleSidebar);
         voiceOutputBtn.addEventListener('click', toggleVoiceOutput);
+        chatContainer.addEventListener('scroll', handleChatScroll);
+        chatList.addEventListener('scroll', handleChatListScroll);
 
         // Aggiusta l'altezza dell'input
         adjustInputHeight();
@@ -59,7 +69,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    // Invia un messaggio
+    // Invia un messaggio e riceve la risposta in streaming (Server-Sent Events)
     async function sendMessage() {
         if (isProcessing || chatInput.value.trim() === '') return;
 
@@ -72,12 +82,13 @@ document.addEventListener('DOMContentLoaded', function() {
         // Aggiunge il messaggio dell'utente alla chat
         appendMessage(message, 'user');
 
-        // Mostra l'indicatore di caricamento
-        const loadingElement = showLoading();
+        // Mostra l'indicatore di caricamento fino al primo frammento
+        let loadingElement = showLoading();
+        let streamingElement = null;
+        let streamedText = '';
 
         try {
-            // Invia il messaggio all'API
-            const response = await fetch('/api/chat/message', {
+            const response = await fetch('/api/chat/message/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -89,23 +100,69 @@ document.addEventListener('DOMContentLoaded', function() {
                 }),
             });
 
-            const data = await response.json();
-            
-            // Rimuovi l'indicatore di caricamento
-            chatContainer.removeChild(loadingElement);
-
-            // Aggiorna l'ID della chat se necessario
-            if (data.chat_id && !currentChatId) {
-                currentChatId = data.chat_id;
-                updateURLWithChatId();
+            // Senza uno stream SSE (es. 503 durante il caricamento del motore) mostra l'errore del server
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.ok || !contentType.includes('text/event-stream')) {
+                if (loadingElement) {
+                    chatContainer.removeChild(loadingElement);
+                    loadingElement = null;
+                }
+                appendMessage(await describeStreamFailure(response), 'assistant');
+                isProcessing = false;
+                return;
             }
 
-            // Aggiungi la risposta del bot alla chat
-            appendMessage(data.message, 'assistant', data.sources);
-
-            // Se è l'output vocale è abilitato, leggi la risposta
-            if (voiceOutputEnabled) {
-                playVoiceResponse(data.message);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+
+                for (const event of events) {
+                    if (!event.startsWith('data: ')) continue;
+                    const data = JSON.parse(event.slice(6));
+
+                    // Aggiorna l'ID della chat se necessario
+                    if (data.chat_id && !currentChatId) {
+                        currentChatId = data.chat_id;
+                        updateURLWithChatId();
+                    }
+
+                    if (data.status === 'streaming') {
+                        if (loadingElement) {
+                            chatContainer.removeChild(loadingElement);
+                            loadingElement = null;
+                            streamingElement = createMessageElement('', 'assistant');
+                            chatContainer.appendChild(streamingElement);
+                        }
+                        streamedText += data.delta;
+                        streamingElement.querySelector('.message').innerHTML = formatAssistantMessage(streamedText);
+                        chatContainer.scrollTop = chatContainer.scrollHeight;
+                    } else if (data.status === 'complete' || data.status === 'error') {
+                        if (loadingElement) {
+                            chatContainer.removeChild(loadingElement);
+                            loadingElement = null;
+                        }
+                        if (streamingElement) {
+                            chatContainer.removeChild(streamingElement);
+                            streamingElement = null;
+                        }
+
+                        // Aggiungi la risposta completa del bot alla chat
+                        appendMessage(data.message, 'assistant', data.sources);
+
+                        // Se è l'output vocale è abilitato, leggi la risposta
+                        if (voiceOutputEnabled && data.status === 'complete') {
+                            playVoiceResponse(data.message);
+                        }
+                    }
+                }
             }
 
             // Aggiorna la lista delle chat
@@ -113,7 +170,9 @@ document.addEventListener('DOMContentLoaded', function() {
         } catch (error) {
             console.error('Errore:', error);
             // Rimuovi l'indicatore di caricamento
-            chatContainer.removeChild(loadingElement);
+            if (loadingElement) {
+                chatContainer.removeChild(loadingElement);
+            }
             // Mostra un messaggio di errore
             appendMessage('Mi dispiace, si è verificato un errore nella comunicazione con il server.', 'assistant');
         }
@@ -121,8 +180,64 @@ document.addEventListener('DOMContentLoaded', function() {
         isProcessing = false;
     }
 
+    // Messaggio da mostrare quando il server non risponde con uno stream
+    async function describeStreamFailure(response) {
+        let detail = null;
+        try {
+            const body = await response.json();
+            detail = typeof body.detail === 'string' ? body.detail : null;
+        } catch (e) {
+            // Corpo assente o non JSON
+        }
+
+        if (response.status === 503) {
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+            if (!detail) {
+                return Number.isNaN(retryAfter)
+                    ? 'Il servizio è in avvio, riprova tra poco.'
+                    : `Il servizio è in avvio, riprova tra ${retryAfter} secondi.`;
+            }
+            return Number.isNaN(retryAfter) ? detail : `${detail} (nuovo tentativo tra ${retryAfter} secondi)`;
+        }
+        return detail || 'Mi dispiace, si è verificato un errore nella comunicazione con il server.';
+    }
+
+    // Converte il markdown semplice delle risposte del bot in HTML
+    function formatAssistantMessage(message) {
+        // Sostituisce i caratteri ** con <strong> e </strong>
+        let formattedMessage = message.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
+        // Sostituisce le linee con elenchi puntati
+        formattedMessage = formattedMessage.replace(/^- (.*?)$/gm, '<li>$1</li>');
+        formattedMessage = formattedMessage.replace(/<li>(.*?)<\/li>/g, function(match) {
+            return '<ul>' + match + '</ul>';
+        });
+        // Sostituisce i tag <ul><ul> con un singolo <ul>
+        formattedMessage = formattedMessage.replace(/<\/ul>\s*<ul>/g, '');
+        // Sostituisce le linee vuote con paragrafi
+        formattedMessage = formattedMessage.replace(/\n\n/g, '</p><p>');
+        // Avvolge il testo in paragrafi
+        return '<p>' + formattedMessage + '</p>';
+    }
+
     // Aggiungi un messaggio alla chat
-    function appendMessage(message, role, sources = []) {
+    function appendMessage(message, role, sources = [], timestamp = null) {
+        chatContainer.appendChild(createMessageElement(message, role, sources, timestamp));
+
+        // Scorri alla fine della chat
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    }
+
+    // Inserisce in cima alla chat una pagina di messaggi più vecchi
+    function prependMessages(messages) {
+        const fragment = document.createDocumentFragment();
+        messages.forEach(msg => {
+            fragment.appendChild(createMessageElement(msg.content, msg.role, [], msg.timestamp));
+        });
+        chatContainer.insertBefore(fragment, chatContainer.firstChild);
+    }
+
+    // Crea l'elemento DOM di un messaggio
+    function createMessageElement(message, role, sources = [], timestamp = null) {
         const messageContainer = document.createElement('div');
         messageContainer.className = `message-container ${role === 'user' ? 'user-container' : 'assistant-container'}`;
 
@@ -136,21 +251,7 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Formattiamo il messaggio con markdown se è del bot
         if (role === 'assistant') {
-            // Sostituisce i caratteri ** con <strong> e </strong>
-            let formattedMessage = message.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
-            // Sostituisce le linee con elenchi puntati
-            formattedMessage = formattedMessage.replace(/^- (.*?)$/gm, '<li>$1</li>');
-            formattedMessage = formattedMessage.replace(/<li>(.*?)<\/li>/g, function(match) {
-                return '<ul>' + match + '</ul>';
-            });
-            // Sostituisce i tag <ul><ul> con un singolo <ul>
-            formattedMessage = formattedMessage.replace(/<\/ul>\s*<ul>/g, '');
-            // Sostituisce le linee vuote con paragrafi
-            formattedMessage = formattedMessage.replace(/\n\n/g, '</p><p>');
-            // Avvolge il testo in paragrafi
-            formattedMessage = '<p>' + formattedMessage + '</p>';
-            
-            messageElement.innerHTML = formattedMessage;
+            messageElement.innerHTML = formatAssistantMessage(message);
         } else {
             messageElement.textContent = message;
         }
@@ -158,8 +259,8 @@ document.addEventListener('DOMContentLoaded', function() {
         // Aggiungi l'ora del messaggio
         const timeElement = document.createElement('div');
         timeElement.className = 'message-time';
-        const now = new Date();
-        timeElement.textContent = now.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+        const messageDate = timestamp ? new Date(timestamp) : new Date();
+        timeElement.textContent = messageDate.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
         messageElement.appendChild(timeElement);
 
         // Aggiungi le fonti se presenti
@@ -171,10 +272,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         messageContainer.appendChild(messageElement);
-        chatContainer.appendChild(messageContainer);
-
-        // Scorri alla fine della chat
-        chatContainer.scrollTop = chatContainer.scrollHeight;
+        return messageContainer;
     }
 
     // Mostra l'indicatore di caricamento
@@ -197,6 +295,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Inizia una nuova chat
     function startNewChat() {
         currentChatId = null;
+        historyCursor = null;
         currentChatTitle.textContent = 'Nuova Chat';
         chatContainer.innerHTML = `
             <div class="welcome-message">
@@ -213,25 +312,47 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    // Carica le chat esistenti
+    // Carica la prima pagina delle chat esistenti
     async function fetchChats() {
         try {
-            const response = await fetch('/api/chat/list');
+            const response = await fetch(`/api/chat/list?limit=${CHAT_LIST_PAGE_SIZE}`);
             const data = await response.json();
             
             // Aggiorna la lista delle chat
+            chatListCursor = data.next_before;
             renderChatList(data.chats);
         } catch (error) {
             console.error('Errore nel caricamento delle chat:', error);
         }
     }
 
+    // Carica la pagina successiva di chat quando la sidebar arriva in fondo
+    async function handleChatListScroll() {
+        if (!chatListCursor || isLoadingChatList) return;
+        if (chatList.scrollTop + chatList.clientHeight < chatList.scrollHeight - 50) return;
+
+        isLoadingChatList = true;
+        try {
+            const response = await fetch(`/api/chat/list?limit=${CHAT_LIST_PAGE_SIZE}&before=${encodeURIComponent(chatListCursor)}`);
+            const data = await response.json();
+            chatListCursor = data.next_before;
+            renderChatList(data.chats, true);
+        } catch (error) {
+            console.error('Errore nel caricamento delle chat:', error);
+        }
+        isLoadingChatList = false;
+    }
+
     // Renderizza la lista delle chat
-    function renderChatList(chats) {
-        chatList.innerHTML = '';
+    function renderChatList(chats, append = false) {
+        if (!append) {
+            chatList.innerHTML = '';
+        }
         
         if (chats.length === 0) {
-            noChatsMsg.style.display = 'block';
+            if (!append) {
+                noChatsMsg.style.display = 'block';
+            }
             return;
         }
         
@@ -271,22 +392,18 @@ document.addEventListener('DOMContentLoaded', function() {
         chatContainer.innerHTML = '';
         
         try {
-            // Ottieni lo storico della chat
-            const response = await fetch(`/api/chat/history/${chatId}`);
+            // Ottieni l'ultima pagina dello storico della chat
+            const response = await fetch(`/api/chat/history/${chatId}?limit=${HISTORY_PAGE_SIZE}`);
             const history = await response.json();
             
-            // Trova la chat nella lista per impostare il titolo
-            const chatResponse = await fetch('/api/chat/list');
-            const chatData = await chatResponse.json();
-            const chat = chatData.chats.find(c => c.id === chatId);
-            
-            if (chat) {
-                currentChatTitle.textContent = chat.title;
+            if (history.title) {
+                currentChatTitle.textContent = history.title;
             }
             
             // Renderizza i messaggi
-            history.forEach(msg => {
-                appendMessage(msg.content, msg.role);
+            historyCursor = history.next_before;
+            history.messages.forEach(msg => {
+                appendMessage(msg.content, msg.role, [], msg.timestamp);
             });
             
             // Aggiorna l'URL
@@ -304,6 +421,31 @@ document.addEventListener('DOMContentLoaded', function() {
         isProcessing = false;
     }
 
+    // Carica i messaggi più vecchi quando l'utente scorre verso l'alto
+    async function handleChatScroll() {
+        if (historyCursor === null || isLoadingHistory || !currentChatId) return;
+        if (chatContainer.scrollTop > 80) return;
+
+        isLoadingHistory = true;
+        const chatId = currentChatId;
+        try {
+            const response = await fetch(`/api/chat/history/${chatId}?limit=${HISTORY_PAGE_SIZE}&before=${historyCursor}`);
+            const history = await response.json();
+
+            // La chat potrebbe essere cambiata durante la richiesta
+            if (chatId === currentChatId) {
+                // Mantiene la posizione di lettura dopo l'inserimento in cima
+                const previousHeight = chatContainer.scrollHeight;
+                prependMessages(history.messages);
+                chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+                historyCursor = history.next_before;
+            }
+        } catch (error) {
+            console.error('Errore nel caricamento dei messaggi precedenti:', error);
+        }
+        isLoadingHistory = false;
+    }
+
     // Elimina una chat
     async function deleteChat(chatId) {
         if (isProcessing) return;
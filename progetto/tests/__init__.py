@@ -0,0 +1 @@
+# Test dell'applicazione (python -m pytest app/tests)
@@ -0,0 +1,99 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.core import diet_generator
+
+from app.core.answer_cache import AnswerCache, generation_variant
+from app.core.plan_cache import PlanCache
+
+QA = generation_variant("gpt-4o-mini", 700)
+ANALYZE = generation_variant(None, 1000)
+
+
+def test_answers_are_separated_by_variant():
+    cache = AnswerCache()
+    cache.put("Quante proteine al giorno?", "v1", {"answer": "breve"}, [1.0, 0.0], variant=QA)
+
+    assert cache.get_exact("quante proteine al giorno", "v1", QA) == {"answer": "breve"}
+    assert cache.get_exact("quante proteine al giorno", "v1", ANALYZE) is None
+    assert cache.get_similar([1.0, 0.0], "v1", QA) == {"answer": "breve"}
+    assert cache.get_similar([1.0, 0.0], "v1", ANALYZE) is None
+
+
+def test_disk_entries_keep_their_variant(tmp_path):
+    path = tmp_path / "answers.db"
+    AnswerCache(disk_path=path).put("vitamina D", "v1", {"answer": "ok"}, [0.0, 1.0], variant=QA)
+
+    reloaded = AnswerCache(disk_path=path)
+    assert reloaded.get_similar([0.0, 1.0], "v1", QA) == {"answer": "ok"}
+    assert reloaded.get_similar([0.0, 1.0], "v1", ANALYZE) is None
+
+
+def test_disk_cache_without_variant_column_is_migrated(tmp_path):
+    path = tmp_path / "answers.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE answers (key TEXT PRIMARY KEY, index_version TEXT NOT NULL, answer TEXT NOT NULL, "
+        "embedding BLOB, created_at REAL NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+
+    cache = AnswerCache(disk_path=path)
+    cache.put("ferro", "v1", {"answer": "ok"}, variant=QA)
+    assert cache.get_exact("ferro", "v1", QA) == {"answer": "ok"}
+
+
+def test_plans_are_separated_by_variant():
+    cache = PlanCache()
+    cache.put("F|30-39|65", "v1", {"diet_plan": "piano"}, variant=generation_variant("diet-model", 4000))
+
+    assert cache.get("F|30-39|65", "v1", generation_variant("diet-model", 4000)) == {"diet_plan": "piano"}
+    assert cache.get("F|30-39|65", "v1", generation_variant(None, 4000)) is None
+
+
+@pytest.fixture
+def lookup(monkeypatch):
+    """
+    Ricerca delle risposte con cache nuova e embedding sostituito; "lexical"
+    indica se la query segue la scorciatoia lessicale
+    """
+    cache = AnswerCache()
+    state = {"cache": cache, "lexical": False}
+
+    async def fake_embed(query):
+        return [1.0, 0.0]
+
+    monkeypatch.setattr(diet_generator, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(diet_generator, "get_index_version", lambda: "v1")
+    monkeypatch.setattr(diet_generator, "aembed_query", fake_embed)
+    monkeypatch.setattr(diet_generator, "is_lexical_fast_query", lambda query: state["lexical"])
+    return state
+
+
+def test_each_lookup_counts_one_miss(lookup):
+    cache = lookup["cache"]
+
+    asyncio.run(diet_generator._lookup_cached_answer("quante proteine?", QA))
+    lookup["lexical"] = True
+    asyncio.run(diet_generator._lookup_cached_answer("vitamina D", QA))
+
+    stats = cache.stats()
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == 0.0
+
+
+def test_exact_hit_is_counted_once(lookup):
+    cache = lookup["cache"]
+    cache.put("quante proteine?", "v1", {"answer": "ok"}, [1.0, 0.0], variant=QA)
+
+    # Il router controlla la corrispondenza esatta senza registrare i miss
+    assert cache.get_exact("ferro", "v1", QA) is None
+    lookup["lexical"] = True
+    asyncio.run(diet_generator._lookup_cached_answer("ferro", QA))
+    asyncio.run(diet_generator._lookup_cached_answer("quante proteine?", QA))
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 0, 1)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core import diet_generator
+from app.core.intent_router import ROUTE_DIET
+from app.core.plan_cache import PlanCache
+from app.db import chat_repository
+from app.services import chat_service
+
+PLAN_JSON = """{"title": "Piano", "daily_plans": [{"day": "Lunedì", "meals": [
+{"name": "Colazione", "items": [{"name": "Yogurt greco", "quantity": "150 g", "calories": 130}]},
+{"name": "Pranzo", "items": [{"name": "Pasta integrale", "quantity": "80 g", "calories": 280}]}]}]}"""
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """
+    Chat con memoria, archivio, router e modello sostituiti: restituisce
+    le chiamate al modello e i piani salvati
+    """
+    calls, saved = [], []
+
+    async def fake_query_rag(query, **kwargs):
+        return {"context": "LARN", "source_nodes": []}
+
+    async def fake_stream(messages, max_tokens, model=None, usage=None, **kwargs):
+        calls.append(model)
+        for start in range(0, len(PLAN_JSON), 40):
+            yield PLAN_JSON[start:start + 40]
+        usage.update({"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2})
+
+    async def fake_route(message, use_cache=True):
+        return {"route": ROUTE_DIET, "model": "diet-model", "max_tokens": 4000}
+
+    async def no_memory(chat_id):
+        return {"summary": "", "messages": []}
+
+    async def no_save(*args):
+        return None
+
+    cache = PlanCache()
+    monkeypatch.setattr(diet_generator, "get_plan_cache", lambda: cache)
+    monkeypatch.setattr(diet_generator, "get_index_version", lambda: "v1")
+    monkeypatch.setattr(diet_generator, "aquery_rag", fake_query_rag)
+    monkeypatch.setattr(diet_generator, "astream_chat_completion", fake_stream)
+    monkeypatch.setattr(diet_generator, "save_diet_plan", saved.append)
+    monkeypatch.setattr(chat_service, "route_message", fake_route)
+    monkeypatch.setattr(chat_service, "load_memory", no_memory)
+    monkeypatch.setattr(chat_service, "asave_chat_message", no_save)
+    monkeypatch.setattr(chat_service, "schedule_memory_update", lambda chat_id: None)
+    return calls, saved
+
+
+async def _collect(message):
+    return [event async for event in chat_service.stream_message({"chat_id": "c1", "message": message})]
+
+
+def test_streamed_diet_is_structured_saved_and_reused(chat):
+    calls, saved = chat
+
+    first = asyncio.run(_collect("Donna di 35 anni, 65 kg, sedentaria, voglio dimagrire"))
+    second = asyncio.run(_collect("Donna di 36 anni, 66 kg, sedentaria, voglio dimagrire"))
+
+    assert calls == ["diet-model"]
+    assert len(saved) == 2
+    # Senza piano in cache i frammenti arrivano man mano, con la cache in un unico frammento
+    assert len([e for e in first if e["status"] == "streaming"]) > 1
+    assert len([e for e in second if e["status"] == "streaming"]) == 1
+    for events in (first, second):
+        complete = events[-1]
+        assert complete["status"] == "complete"
+        assert complete["route"] == ROUTE_DIET
+        assert "Yogurt greco" in complete["message"]
+        assert "{" not in complete["message"]
+
+
+def test_slow_chat_store_does_not_block_the_event_loop(chat, monkeypatch):
+    # Un salvataggio che attende un lock SQLite non deve fermare le altre richieste
+    monkeypatch.setattr(chat_service, "asave_chat_message", chat_repository.asave_chat_message)
+    monkeypatch.setattr(chat_repository, "save_chat_message", lambda *args: time.sleep(0.2))
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await _collect("Donna di 35 anni, 65 kg, sedentaria, voglio dimagrire")
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(run()) >= 20
@@ -0,0 +1,41 @@
+import pytest
+
+from app.core.diet_profile import extract_profile_attributes, profile_fingerprint
+from app.core.energy_targets import PAL_LEVELS, compute_energy_targets
+
+
+@pytest.mark.parametrize("profile, activity", [
+    ("Donna 30 anni 60 kg, dimagrire, non sono sportiva", "sedentary"),
+    ("Uomo di 40 anni, 80 kg, non sono molto attivo", "sedentary"),
+    ("Donna, 50 anni, non sono per niente attiva", "sedentary"),
+    ("Uomo 35 anni, non faccio sport", "sedentary"),
+    ("Donna 45 anni sedentaria", "sedentary"),
+    ("Donna 28 anni, poco attiva", "light"),
+    ("Uomo 30 anni, attivo", "moderate"),
+    ("Ragazza sportiva di 25 anni", "high"),
+    ("Uomo 22 anni, atleta agonista", "high"),
+    ("Donna 30 anni 60 kg", None),
+])
+def test_activity_extraction(profile, activity):
+    assert extract_profile_attributes(profile)["activity"] == activity
+
+
+def test_negated_sport_does_not_share_athlete_fingerprint():
+    negated = extract_profile_attributes("Donna 30 anni 60 kg, dimagrire, non sono sportiva")
+    athlete = extract_profile_attributes("Donna 30 anni 60 kg, dimagrire, sono sportiva")
+
+    assert profile_fingerprint(negated) != profile_fingerprint(athlete)
+    assert compute_energy_targets(negated)["pal"] == PAL_LEVELS["sedentary"]
+    assert compute_energy_targets(athlete)["pal"] == PAL_LEVELS["high"]
+
+
+@pytest.mark.parametrize("profile, expected", [
+    ("Donna di 35 anni, 65 kg, 168 cm, voglio dimagrire",
+     {"sex": "F", "age": 35, "weight": 65.0, "height": 168.0, "goal": "lose"}),
+    ("Uomo 50 anni 90kg, vorrei mantenere il peso, diabetico",
+     {"sex": "M", "age": 50, "weight": 90.0, "goal": "maintain", "restrictions": ["diabetes"]}),
+])
+def test_profile_extraction(profile, expected):
+    attributes = extract_profile_attributes(profile)
+    for name, value in expected.items():
+        assert attributes[name] == value
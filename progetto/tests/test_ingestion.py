@@ -0,0 +1,32 @@
+from app.config import settings
+from app.core.ingestion import PARSED_CACHE_DIR, new_manifest, prune_parsed_cache, sync_index
+
+
+def _write_parsed(storage_path, *hashes):
+    cache_dir = storage_path / PARSED_CACHE_DIR
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for file_hash in hashes:
+        (cache_dir / f"{file_hash}.json").write_text("[]", encoding="utf-8")
+    return cache_dir
+
+
+def test_prune_keeps_only_hashes_in_manifest(tmp_path):
+    cache_dir = _write_parsed(tmp_path, "aaa", "bbb", "ccc")
+    manifest = new_manifest(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+    manifest["files"]["larn.pdf"] = {"hash": "bbb", "chunks": {}}
+
+    assert prune_parsed_cache(tmp_path, manifest) == 2
+    assert sorted(path.name for path in cache_dir.iterdir()) == ["bbb.json"]
+
+
+def test_sync_removes_leftovers_when_index_is_aligned(tmp_path):
+    documents_dir = tmp_path / "documents"
+    documents_dir.mkdir()
+    storage_path = tmp_path / "vectorstore"
+    cache_dir = _write_parsed(storage_path, "old")
+    manifest = new_manifest(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+
+    stats = sync_index(None, storage_path, documents_dir=documents_dir, manifest=manifest)
+
+    assert stats["parsed_removed"] == 1
+    assert list(cache_dir.iterdir()) == []
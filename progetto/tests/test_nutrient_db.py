@@ -0,0 +1,37 @@
+import pytest
+
+from app.config import settings
+from app.core.nutrient_db import NutrientDB
+
+
+@pytest.fixture(scope="module")
+def db():
+    return NutrientDB.from_csv(settings.NUTRIENT_SAMPLE_PATH)
+
+
+@pytest.mark.parametrize("query, name", [
+    ("riso", "Riso, brillato, crudo"),
+    ("riso integrale", "Riso integrale, crudo"),
+    ("gallette di riso", "Gallette di riso"),
+    ("pasta", "Pasta di semola, cruda"),
+    ("pasta integrale", "Pasta integrale, cruda"),
+    ("pane", "Pane comune, tipo 0"),
+    ("latte", "Latte di vacca, parzialmente scremato"),
+    ("fiocchi di latte", "Fiocchi di latte"),
+    ("yogurt greco", "Yogurt greco, magro"),
+    ("yogurt grecco", "Yogurt greco, magro"),
+    ("petto di pollo", "Pollo, petto, crudo"),
+    ("uova", "Uovo di gallina, intero"),
+    ("mele", "Mela, con buccia"),
+    ("avena", "Avena, fiocchi"),
+    ("olio", "Olio extravergine di oliva"),
+    ("patate", "Patate, crude"),
+])
+def test_lookup_staples(db, query, name):
+    row = db.lookup(query)
+    assert row is not None
+    assert db.names[row] == name
+
+
+def test_lookup_unknown_food(db):
+    assert db.lookup("caviale") is None
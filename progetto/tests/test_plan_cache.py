@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.core import diet_generator
+from app.core.plan_cache import PlanCache
+
+PLAN_TEXT = """
+Lunedì
+Colazione: yogurt greco 150 g (130 kcal), fiocchi d'avena 40 g (150 kcal)
+Pranzo: pasta integrale 80 g (280 kcal), verdure grigliate 200 g (80 kcal)
+Cena: merluzzo 150 g (120 kcal), patate 200 g (160 kcal)
+"""
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    """
+    Generatore di diete con recupero, modello e archivio dei piani sostituiti:
+    restituisce la cache dei piani e l'elenco delle chiamate al modello
+    """
+    cache = PlanCache()
+    calls = []
+
+    async def fake_query_rag(query, **kwargs):
+        return {"context": "LARN: fabbisogni energetici", "source_nodes": []}
+
+    async def fake_completion(messages, max_tokens, model=None, **kwargs):
+        calls.append(model)
+        return {
+            "text": PLAN_TEXT,
+            "tokens_used": {"prompt_tokens": 900, "completion_tokens": 600, "total_tokens": 1500}
+        }
+
+    monkeypatch.setattr(diet_generator, "get_plan_cache", lambda: cache)
+    monkeypatch.setattr(diet_generator, "get_index_version", lambda: "v1")
+    monkeypatch.setattr(diet_generator, "aquery_rag", fake_query_rag)
+    monkeypatch.setattr(diet_generator, "agenerate_chat_completion", fake_completion)
+    monkeypatch.setattr(diet_generator, "save_diet_plan", lambda plan: None)
+    return cache, calls
+
+
+def test_equivalent_profile_is_served_from_cache(generator):
+    cache, calls = generator
+
+    first = asyncio.run(diet_generator.generate_diet_plan("Donna di 35 anni, 65 kg, sedentaria, voglio dimagrire"))
+    second = asyncio.run(diet_generator.generate_diet_plan("Donna di 36 anni, 66 kg, sedentaria, voglio dimagrire"))
+
+    assert len(calls) == 1
+    assert not first.get("cached")
+    assert second["cached"] is True
+    assert second["user_profile"].startswith("Donna di 36 anni")
+    assert second["tokens_used"]["total_tokens"] == 0
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["tokens_saved"] == 1500
+
+
+def test_different_fingerprint_is_generated(generator):
+    cache, calls = generator
+
+    asyncio.run(diet_generator.generate_diet_plan("Donna di 35 anni, 65 kg, sedentaria, voglio dimagrire"))
+    asyncio.run(diet_generator.generate_diet_plan("Uomo di 35 anni, 80 kg, sedentario, voglio dimagrire"))
+
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 0
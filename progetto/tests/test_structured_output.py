@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from app.core import diet_generator
+
+
+class FakeBadRequest(Exception):
+    status_code = 400
+
+    def __init__(self, message, param=None):
+        super().__init__(message)
+        self.param = param
+
+
+@pytest.fixture
+def completion(monkeypatch):
+    """
+    Chiamata al modello sostituita: i modelli in "rejecting" rifiutano
+    response_format, gli altri errori si impostano con "error"
+    """
+    state = {"rejecting": set(), "error": None, "calls": []}
+
+    async def fake_completion(messages, max_tokens, model=None, response_format=None, **kwargs):
+        state["calls"].append((model, response_format is not None))
+        if state["error"] is not None:
+            raise state["error"]
+        if response_format is not None and model in state["rejecting"]:
+            raise FakeBadRequest("'response_format' of type 'json_object' is not supported with this model",
+                                 param="response_format")
+        return {"text": "{}", "tokens_used": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+    monkeypatch.setattr(diet_generator, "agenerate_chat_completion", fake_completion)
+    monkeypatch.setattr(diet_generator, "_json_mode_unsupported", set())
+    return state
+
+
+def test_json_mode_fallback_is_per_model(completion):
+    completion["rejecting"].add("old-model")
+
+    asyncio.run(diet_generator._agenerate_structured([], 100, model="old-model"))
+    asyncio.run(diet_generator._agenerate_structured([], 100, model="old-model"))
+    asyncio.run(diet_generator._agenerate_structured([], 100, model="new-model"))
+
+    assert completion["calls"] == [
+        ("old-model", True), ("old-model", False),
+        ("old-model", False),
+        ("new-model", True),
+    ]
+
+
+def test_other_bad_requests_do_not_disable_json_mode(completion):
+    completion["error"] = FakeBadRequest("This model's maximum context length is 8192 tokens", param="messages")
+
+    with pytest.raises(FakeBadRequest):
+        asyncio.run(diet_generator._agenerate_structured([], 100, model="gpt"))
+
+    assert diet_generator._json_mode_unsupported == set()
+
+
+def test_streamed_plan_falls_back_before_the_first_fragment(monkeypatch):
+    calls = []
+
+    async def fake_stream(messages, max_tokens, model=None, response_format=None, usage=None, **kwargs):
+        calls.append(response_format is not None)
+        if response_format is not None:
+            raise FakeBadRequest("Invalid parameter: 'response_format'", param="response_format")
+        yield "{}"
+
+    async def collect():
+        return [delta async for delta in diet_generator._astream_structured([], 100, model="old-model")]
+
+    monkeypatch.setattr(diet_generator, "astream_chat_completion", fake_stream)
+    monkeypatch.setattr(diet_generator, "_json_mode_unsupported", set())
+
+    assert asyncio.run(collect()) == ["{}"]
+    assert calls == [True, False]
+    assert diet_generator._json_mode_unsupported == {"old-model"}
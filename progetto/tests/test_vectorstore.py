@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.config import settings
+from app.db.vectorstore import MemmapVectorStore
+
+
+def _nodes(start, count, dim=8):
+    rng = np.random.default_rng(start)
+    return [
+        TextNode(id_=f"n{i}", text=f"chunk {i}", embedding=rng.normal(size=dim).tolist())
+        for i in range(start, start + count)
+    ]
+
+
+def _top_id(store, node):
+    result = store.query(VectorStoreQuery(query_embedding=node.embedding, similarity_top_k=1))
+    return result.ids[0]
+
+
+@pytest.fixture(autouse=True)
+def exact_search(monkeypatch):
+    monkeypatch.setattr(settings, "ANN_ENABLED", False)
+
+
+def test_batches_are_merged_once_and_persisted(tmp_path):
+    store = MemmapVectorStore(persist_dir=str(tmp_path))
+    batches = [_nodes(start, 10) for start in range(0, 50, 10)]
+    for batch in batches:
+        store.add(batch)
+
+    # Gli inserimenti non copiano la matrice: i blocchi restano in attesa
+    assert store._matrix is None
+    assert len(store._pending_vectors) == 5
+
+    store.persist()
+    reloaded = MemmapVectorStore(persist_dir=str(tmp_path))
+    assert reloaded.num_nodes == 50
+    assert isinstance(reloaded._matrix, np.memmap)
+    assert _top_id(reloaded, batches[3][4]) == "n34"
+
+
+def test_adding_after_load_keeps_the_memmap_until_needed(tmp_path):
+    store = MemmapVectorStore(persist_dir=str(tmp_path))
+    first = _nodes(0, 20)
+    store.add(first)
+    store.persist()
+
+    store = MemmapVectorStore(persist_dir=str(tmp_path))
+    more = _nodes(20, 5)
+    store.add(more)
+    assert isinstance(store._matrix, np.memmap)
+
+    # Le query vedono anche i chunk aggiunti dopo il caricamento
+    assert _top_id(store, more[2]) == "n22"
+    assert _top_id(store, first[7]) == "n7"
+
+    store.add(_nodes(25, 5))
+    store.persist()
+    assert isinstance(store._matrix, np.memmap)
+    assert store._matrix.shape[0] == 30
+    assert _top_id(MemmapVectorStore(persist_dir=str(tmp_path)), more[2]) == "n22"
+
+
+def test_replacing_a_pending_node(tmp_path):
+    store = MemmapVectorStore(persist_dir=str(tmp_path))
+    store.add(_nodes(0, 5))
+    replacement = TextNode(id_="n1", text="nuovo", embedding=_nodes(99, 1)[0].embedding)
+    store.add([replacement])
+    store.persist()
+
+    store = MemmapVectorStore(persist_dir=str(tmp_path))
+    assert store.num_nodes == 5
+    assert _top_id(store, replacement) == "n1"
+    assert store.get_nodes(["n1"])[0].get_content() == "nuovo"